@@ -1,6 +1,7 @@
 from flask import Flask, request, jsonify
 import datetime
-from database import SessionLocal, engine, Base
+from model import SessionLocal, engine
+from migrations import run_migrations
 from crud import (
     get_or_create_user,
     create_wallet,
@@ -9,10 +10,11 @@ from crud import (
     delete_expense,
     generate_monthly_report
 )
-from models import Expense
+from model import Expense, User, Wallet
+from money import from_minor
 
-# Crea le tabelle se non esistono
-Base.metadata.create_all(bind=engine)
+# Crea o aggiorna lo schema del DB applicando le migrazioni mancanti
+run_migrations(engine)
 
 app = Flask(__name__)
 
@@ -47,18 +49,28 @@ def expenses():
         session.close()
         return jsonify(result), 201
 
-    # GET: restituisce la lista di tutte le spese/entrate
-    expenses_list = session.query(Expense).all()
+    # GET: restituisce la lista di tutte le spese/entrate.
+    # Solo le colonne necessarie, con utente e wallet in join: una sola query
+    rows = session.query(
+        Expense.id,
+        User.telegram_id,
+        Expense.description,
+        Expense.amount_minor,
+        Wallet.currency,
+        Expense.category,
+        Expense.location,
+        Expense.date
+    ).join(User, Expense.user_id == User.id).join(Wallet, Expense.wallet_id == Wallet.id).all()
     result = []
-    for exp in expenses_list:
+    for expense_id, telegram_id, description, amount_minor, currency, category, location, date in rows:
         result.append({
-            "id": exp.id,
-            "telegram_id": exp.user.telegram_id,
-            "description": exp.description,
-            "amount": exp.amount,
-            "category": exp.category,
-            "location": exp.location,
-            "date": exp.date.strftime("%Y-%m-%d")
+            "id": expense_id,
+            "telegram_id": telegram_id,
+            "description": description,
+            "amount": from_minor(amount_minor, currency),
+            "category": category,
+            "location": location,
+            "date": date.strftime("%Y-%m-%d")
         })
     session.close()
     return jsonify(result)
@@ -99,7 +111,6 @@ def monthly_report():
         return jsonify({"error": "telegram_id, month e year sono richiesti"}), 400
     session = SessionLocal()
     # Otteniamo l'utente in base al telegram_id
-    from models import User
     user = session.query(User).filter_by(telegram_id=telegram_id).first()
     if not user:
         session.close()
@@ -0,0 +1,386 @@
+"""
+Benchmark delle operazioni principali su dataset sintetici di varie dimensioni.
+
+Per ogni scala (numero di transazioni) il dataset viene generato una volta
+con generate_dataset.py (stesso seed e stessa data finale, quindi identico
+tra esecuzioni) e riusato. Le operazioni girano sul codice reale del bot,
+della webapp e di crud.py con le chiamate verso Telegram sostituite da
+funzioni vuote. Per ogni operazione si registrano:
+
+- latenza (p50, p95, max in ms) su più iterazioni, a cache svuotate;
+- statement SQL eseguiti in una chiamata;
+- picco di memoria allocata (tracemalloc, in un'esecuzione separata).
+
+I risultati si salvano in JSON come baseline; confrontati con una baseline
+esistente, l'uscita è 1 se un'operazione peggiora oltre la soglia.
+
+    python benchmark.py --scales 10000,100000 --output risultati.json
+    python benchmark.py --scales 10000,100000 --baseline baseline.json --update-baseline
+    python benchmark.py --scales 10000,100000 --baseline baseline.json --threshold 0.25
+"""
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+from sqlalchemy import create_engine, delete, event, func, select
+import sqlalchemy
+from model import SessionLocal, User, Wallet, Expense, DailyRollup, MediaFile
+from generate_dataset import generate_dataset
+from pagination import fetch_page
+
+BENCH_SCALES = (10000, 100000)  # 1000000 da abilitare con --scales
+BENCH_ITERATIONS = 5
+BENCH_WARMUP = 1
+BENCH_SEED = 42
+BENCH_END_DATE = datetime.datetime(2026, 1, 1)  # Fine fissa delle date: dataset identici nel tempo
+BENCH_ROWS_PER_USER = 100
+BENCH_DEEP_PAGE = 100  # Pagina N della lista transazioni
+BENCH_IMPORT_ROWS = 10000
+BENCH_THRESHOLD = 0.25  # Peggioramento relativo tollerato
+BENCH_MIN_DELTA_MS = 2.0  # Sotto questa differenza assoluta la latenza non conta come regressione
+BENCH_DATA_DIR = "bench_data"
+
+
+# ----------------------- DATASET ------------------------
+
+def dataset_engine(rows, data_dir=BENCH_DATA_DIR, seed=BENCH_SEED):
+    """Engine del dataset con `rows` transazioni, generato se non esiste già"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"bench_{rows}_{seed}.db")
+    partial = path + ".tmp"
+    if not os.path.exists(path):
+        if os.path.exists(partial):
+            os.remove(partial)
+        print(f"🔄 Generazione dataset di {rows} transazioni in {path}...")
+        generate_dataset(
+            create_engine(f"sqlite:///{partial}"), users=max(10, rows // BENCH_ROWS_PER_USER),
+            expenses=rows, shares=max(5, rows // 1000), seed=seed, end_date=BENCH_END_DATE
+        )
+        os.replace(partial, path)  # Un dataset interrotto non viene mai riusato
+    return create_engine(f"sqlite:///{path}")
+
+
+class StatementCounter:
+    """Conta gli statement SQL eseguiti su un engine"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+# ----------------------- CONTESTO ------------------------
+
+class _FakeMessage(SimpleNamespace):
+    """Risposta fittizia delle chiamate alla Bot API"""
+
+
+def _silence_bot(bot):
+    """Sostituisce le chiamate verso Telegram con funzioni che non fanno richieste"""
+    def reply(*args, **kwargs):
+        return _FakeMessage(chat=SimpleNamespace(id=0), message_id=1,
+                            photo=[SimpleNamespace(file_id="bench")],
+                            document=SimpleNamespace(file_id="bench"))
+
+    for name in ("send_message", "reply_to", "edit_message_text", "send_photo",
+                 "send_document", "answer_callback_query"):
+        setattr(bot, name, reply)
+    bot.send_media_group = lambda chat_id, media, **kwargs: [reply() for _ in media]
+    bot.get_file = lambda file_id: SimpleNamespace(file_path=file_id)
+
+
+def _clear_caches():
+    """Svuota le cache in-process, così ogni iterazione misura il lavoro completo"""
+    import crud
+    crud.clear_identity_cache()  # Anche report e grafici
+
+
+def _heaviest_user(session):
+    """(id, telegram_id) dell'utente con più transazioni: il caso peggiore"""
+    user_id = session.execute(
+        select(Expense.user_id).group_by(Expense.user_id).order_by(func.count().desc()).limit(1)
+    ).scalar()
+    return user_id, session.get(User, user_id).telegram_id
+
+
+def _deep_cursor(session, user_id, pages):
+    """Cursore della pagina `pages` della lista transazioni (calcolato fuori dalla misura)"""
+    from crud import get_shared_owner_ids
+    query = session.query(Expense).filter(Expense.user_id.in_([user_id] + get_shared_owner_ids(session, user_id)))
+    cursor = None
+    for _ in range(pages - 1):
+        page = fetch_page(query, cursor, limit=5)
+        if not page["has_next"]:
+            break
+        cursor = page["next_cursor"]
+    return cursor
+
+
+def _import_csv_bytes(session, rows):
+    """CSV da importare, con le prime `rows` transazioni del dataset"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["date", "amount", "description", "category", "location", "currency"])
+    from money import from_minor
+    for date, amount_minor, description, category, location, currency in session.execute(
+        select(Expense.date, Expense.amount_minor, Expense.description, Expense.category,
+               Expense.location, Wallet.currency)
+        .join(Wallet, Expense.wallet_id == Wallet.id)
+        .order_by(Expense.id).limit(rows)
+    ):
+        writer.writerow([date.strftime("%Y-%m-%d"), from_minor(amount_minor, currency),
+                         description, category, location, currency])
+    return buffer.getvalue().encode("utf-8")
+
+
+def _chart_inputs(session, user_id, year):
+    """Aggregati mensili nel formato di create_report_charts (come in process_report)"""
+    from collections import defaultdict
+    overall = defaultdict(lambda: [0, 0])
+    categories = defaultdict(lambda: [0, 0])
+    wallets = defaultdict(lambda: [0, 0])
+    month = func.strftime("%m/%Y", Expense.date)
+    rows = session.execute(
+        select(month, Expense.category, Wallet.name, func.sum(Expense.amount_minor), func.count())
+        .join(Wallet, Expense.wallet_id == Wallet.id)
+        .where(Expense.user_id == user_id, Wallet.currency == "EUR",
+               Expense.date >= datetime.datetime(year, 1, 1), Expense.date < datetime.datetime(year + 1, 1, 1))
+        .group_by(month, Expense.category, Wallet.name)
+    )
+    for period, category, wallet, total_minor, count in rows:
+        for totals, key in ((overall, period), (categories, category), (wallets, (period, wallet))):
+            totals[key][0] += total_minor / 100
+            totals[key][1] += count
+    return overall, categories, wallets
+
+
+def build_operations(engine):
+    """Operazioni da misurare: nome -> (funzione, pulizia dopo ogni chiamata o None)"""
+    import bot as bot_module
+    import webapp
+    from crud import generate_monthly_report, generate_yearly_report
+
+    bot = bot_module.bot
+    _silence_bot(bot)
+    session = SessionLocal()
+    try:
+        user_id, telegram_id = _heaviest_user(session)
+        chat_id = int(telegram_id)
+        deep_cursor = _deep_cursor(session, user_id, BENCH_DEEP_PAGE)
+        csv_bytes = _import_csv_bytes(session, BENCH_IMPORT_ROWS)
+        chart_inputs = _chart_inputs(session, user_id, BENCH_END_DATE.year - 1)
+    finally:
+        session.close()
+
+    last_month = BENCH_END_DATE - datetime.timedelta(days=1)
+    client = webapp.app.test_client()
+    import_user = {"telegram_id": None}
+
+    def with_session(function):
+        def run():
+            session = SessionLocal()
+            try:
+                return function(session)
+            finally:
+                session.close()
+        return run
+
+    def csv_import():
+        import_user["telegram_id"] = f"bench-import-{time.monotonic_ns()}"
+        bot.download_file = lambda file_path: csv_bytes
+        message = SimpleNamespace(
+            chat=SimpleNamespace(id=chat_id),
+            from_user=SimpleNamespace(id=import_user["telegram_id"], username="bench", first_name="bench"),
+            document=SimpleNamespace(file_id="bench", file_name="import.csv"),
+        )
+        bot_module.process_csv_import(message)
+
+    def remove_imported():
+        # Il dataset torna com'era prima dell'import
+        with engine.begin() as conn:
+            imported = select(User.id).where(User.telegram_id == import_user["telegram_id"]).scalar_subquery()
+            for table, column in ((Expense, Expense.user_id), (DailyRollup, DailyRollup.user_id),
+                                  (MediaFile, MediaFile.user_id), (User, User.id)):
+                conn.execute(delete(table).where(column == imported))
+
+    def csv_export():
+        for _, file in bot_module.build_csv_export(user_id):
+            file.close()
+
+    def dashboard():
+        response = client.get(f"/dashboard/{telegram_id}")
+        if response.status_code != 200:
+            raise RuntimeError(f"Dashboard: HTTP {response.status_code}")
+
+    return {
+        "monthly_report": (with_session(
+            lambda session: generate_monthly_report(session, user_id, last_month.year, last_month.month)), None),
+        "yearly_report": (with_session(
+            lambda session: generate_yearly_report(session, user_id, last_month.year)), None),
+        "show_report": (lambda: bot_module.show_report(chat_id), None),
+        "list_page_1": (lambda: bot_module.show_transactions_list(chat_id), None),
+        f"list_page_{BENCH_DEEP_PAGE}": (lambda: bot_module.show_transactions_list(chat_id, cursor=deep_cursor), None),
+        "csv_import": (csv_import, remove_imported),
+        "csv_export": (csv_export, None),
+        "report_charts": (lambda: bot_module.create_report_charts(*chart_inputs, "EUR"), None),
+        "dashboard": (dashboard, None),
+    }
+
+
+# ----------------------- MISURA ------------------------
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def measure(function, cleanup, counter, iterations=BENCH_ITERATIONS, warmup=BENCH_WARMUP):
+    """Latenze, statement SQL e picco di memoria di una operazione"""
+    def call():
+        _clear_caches()
+        try:
+            function()
+        finally:
+            if cleanup:
+                cleanup()
+
+    for _ in range(warmup):
+        call()
+
+    timings = []
+    statements = 0
+    for _ in range(iterations):
+        _clear_caches()
+        counter.count = 0
+        started = time.perf_counter()
+        try:
+            function()
+        finally:
+            elapsed = time.perf_counter() - started
+            statements = counter.count
+            if cleanup:
+                cleanup()
+        timings.append(elapsed * 1000)
+
+    # Memoria misurata a parte: tracemalloc rallenta l'esecuzione
+    _clear_caches()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        if cleanup:
+            cleanup()
+
+    return {
+        "p50_ms": round(_percentile(timings, 0.50), 3),
+        "p95_ms": round(_percentile(timings, 0.95), 3),
+        "max_ms": round(max(timings), 3),
+        "statements": statements,
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(scales=BENCH_SCALES, iterations=BENCH_ITERATIONS, data_dir=BENCH_DATA_DIR,
+                   only=None, on_result=None):
+    """Esegue i benchmark per ogni scala; restituisce il dict dei risultati"""
+    results = {
+        "meta": {
+            "seed": BENCH_SEED,
+            "end_date": BENCH_END_DATE.date().isoformat(),
+            "iterations": iterations,
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "platform": platform.platform(),
+            "created_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        },
+        "results": {},
+    }
+    for rows in scales:
+        engine = dataset_engine(rows, data_dir)
+        # Bot, webapp e crud usano SessionLocal: da qui in poi lavorano sul dataset
+        SessionLocal.configure(bind=engine)
+        counter = StatementCounter(engine)
+        scale_results = results["results"][str(rows)] = {}
+        for name, (function, cleanup) in build_operations(engine).items():
+            if only and name not in only:
+                continue
+            scale_results[name] = measure(function, cleanup, counter, iterations)
+            if on_result:
+                on_result(rows, name, scale_results[name])
+        engine.dispose()
+    return results
+
+
+def compare(results, baseline, threshold=BENCH_THRESHOLD):
+    """Elenco delle regressioni rispetto alla baseline (vuoto se nessuna)"""
+    regressions = []
+    for scale, operations in results["results"].items():
+        for name, current in operations.items():
+            previous = baseline.get("results", {}).get(scale, {}).get(name)
+            if previous is None:
+                continue
+            label = f"{name} @ {scale}"
+            if (current["p50_ms"] > previous["p50_ms"] * (1 + threshold)
+                    and current["p50_ms"] - previous["p50_ms"] > BENCH_MIN_DELTA_MS):
+                regressions.append(f"{label}: p50 {previous['p50_ms']} → {current['p50_ms']} ms")
+            if current["statements"] > previous["statements"]:
+                regressions.append(f"{label}: statement SQL {previous['statements']} → {current['statements']}")
+            if current["peak_kb"] > previous["peak_kb"] * (1 + threshold):
+                regressions.append(f"{label}: memoria {previous['peak_kb']} → {current['peak_kb']} KB")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark di report, liste, import, export e dashboard")
+    parser.add_argument("--scales", default=",".join(str(rows) for rows in BENCH_SCALES),
+                        help="Numero di transazioni dei dataset, separati da virgola (es. 10000,100000,1000000)")
+    parser.add_argument("--iterations", type=int, default=BENCH_ITERATIONS)
+    parser.add_argument("--only", help="Operazioni da eseguire, separate da virgola")
+    parser.add_argument("--data-dir", default=BENCH_DATA_DIR)
+    parser.add_argument("--output", help="File JSON in cui salvare i risultati")
+    parser.add_argument("--baseline", help="Baseline JSON con cui confrontare i risultati")
+    parser.add_argument("--update-baseline", action="store_true", help="Sovrascrive la baseline con i risultati")
+    parser.add_argument("--threshold", type=float, default=BENCH_THRESHOLD)
+    args = parser.parse_args()
+
+    def print_result(rows, name, result):
+        print(f"{rows:>9} {name:<16} p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+              f"SQL {result['statements']:>5}  mem {result['peak_kb']:>10.1f} KB")
+
+    results = run_benchmarks(
+        scales=[int(rows) for rows in args.scales.split(",")],
+        iterations=args.iterations,
+        data_dir=args.data_dir,
+        only=set(args.only.split(",")) if args.only else None,
+        on_result=print_result
+    )
+    from charts import shutdown
+    shutdown()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Baseline salvata in {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("❌ Regressioni rispetto alla baseline:")
+            for regression in regressions:
+                print(f"  • {regression}")
+            sys.exit(1)
+        print("✅ Nessuna regressione rispetto alla baseline")
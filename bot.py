@@ -1,11 +1,13 @@
 import datetime
-import csv
 import pandas as pd
 import io
 from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
-from config import TELEGRAM_API_TOKEN
+from config import TELEGRAM_API_TOKEN, STATE_BACKEND, STATE_TTL, STATE_MAX_ENTRIES
 from model import SessionLocal, engine, Base, Expense, User, Wallet, SharedAccess
+from migrations import run_migrations, reset_schema
+from money import from_minor
 from crud import (
     get_or_create_user,
     create_wallet,
@@ -15,11 +17,25 @@ from crud import (
     share_expense,
     revoke_share,
     generate_monthly_report,
-    generate_yearly_report
+    generate_yearly_report,
+    generate_owner_reports,
+    get_shared_owner_ids,
+    get_visible_owner_ids,
+    cached_report,
+    clear_identity_cache,
+    create_expenses_bulk,
+    get_cached_file_ids,
+    store_file_ids,
+    forget_file_ids
 )
-import matplotlib.pyplot as plt
-import numpy as np
-from matplotlib.ticker import FuncFormatter
+from pagination import fetch_page
+from sqlalchemy.orm import joinedload, contains_eager
+from importer import import_csv, import_chunks, open_error_report, MissingColumnsError
+from columnar import export_columnar, iter_columnar_chunks, columnar_format
+from state_store import make_state_store, StateHandlerBackend
+from charts import render_charts, chart_key
+from exporter import iter_export_rows, export_files
+import time
 import random
 from datetime import timedelta
 from collections import defaultdict
@@ -34,16 +50,29 @@ config.read('config.ini')
 # Ottieni l'URL di ngrok dalla configurazione
 NGROK_URL = config.get('WEBAPP', 'NGROK_URL', fallback='https://example.ngrok.io')
 
-# Crea le tabelle nel DB (se non esistono)
-Base.metadata.create_all(bind=engine)
+# Crea o aggiorna lo schema del DB applicando le migrazioni mancanti
+run_migrations(engine)
 
-bot = TeleBot(TELEGRAM_API_TOKEN)
+# Stato delle conversazioni (dati parziali e next step handler) con scadenza
+state_store = make_state_store(STATE_BACKEND, ttl=STATE_TTL, maxsize=STATE_MAX_ENTRIES)
+
+bot = TeleBot(TELEGRAM_API_TOKEN, next_step_backend=StateHandlerBackend(state_store))
 
 # Numero di transazioni per pagina
 PAGE_SIZE = 5
 
-# Dizionario per memorizzare temporaneamente i dati di inserimento per chat
-temp_expense_data = {}
+# Intervallo minimo (secondi) tra due aggiornamenti del messaggio di avanzamento dell'import
+IMPORT_PROGRESS_INTERVAL = 2
+
+# Testi dei pulsanti della keyboard permanente
+NAVIGATION_BUTTONS = [
+    "💰 Nuova Transazione",
+    "📋 Lista Transazioni",
+    "📊 Report",
+    "👥 Condivisioni",
+    "🏠 Menu Principale",
+    "❓ Aiuto"
+]
 
 if not NGROK_URL:
     print("⚠️ NGROK_URL non impostato. La webapp non funzionerà correttamente.")
@@ -120,14 +149,7 @@ def send_welcome(message):
         session.close()
 
 # Aggiungi handler per i pulsanti della keyboard permanente
-@bot.message_handler(func=lambda message: message.text in [
-    "💰 Nuova Transazione",
-    "📋 Lista Transazioni",
-    "📊 Report",
-    "👥 Condivisioni",
-    "🏠 Menu Principale",
-    "❓ Aiuto"
-])
+@bot.message_handler(func=lambda message: message.text in NAVIGATION_BUTTONS)
 def handle_navigation_buttons(message):
     """Gestisce i click sui pulsanti della keyboard permanente"""
     try:
@@ -173,45 +195,34 @@ def handle_transactions_pagination(call: CallbackQuery):
     """Gestisce la paginazione della lista transazioni"""
     try:
         bot.answer_callback_query(call.id)
-        offset = int(call.data.split("_")[-1])
+        cursor = call.data[len("list_transactions_"):]
         username = get_username_from_callback(call)
-        show_transactions_list(call.message.chat.id, call.message.message_id, offset, username)
+        show_transactions_list(call.message.chat.id, call.message.message_id, cursor, username)
     except Exception as e:
         bot.answer_callback_query(call.id, f"⚠️ Errore: {str(e)}")
 
-def show_transactions_list(chat_id, message_id=None, offset=0, username=None):
+def show_transactions_list(chat_id, message_id=None, cursor=None, username=None):
     """Mostra la lista delle transazioni (proprie e condivise)"""
     try:
         session = SessionLocal()
         user = get_or_create_user(session, str(chat_id), username or str(chat_id))
         
-        # Recupera le transazioni dell'utente
-        own_transactions = session.query(Expense).join(Wallet).filter(
-            Expense.user_id == user.id
+        # Transazioni proprie e di chi ha condiviso con l'utente, in un'unica query
+        owner_ids = [user.id] + get_shared_owner_ids(session, user.id)
+        # Proprietario e wallet caricati nella stessa query della pagina (niente N+1)
+        all_transactions = session.query(Expense).options(
+            joinedload(Expense.user),
+            joinedload(Expense.wallet)
+        ).filter(
+            Expense.user_id.in_(owner_ids)
         )
         
-        # Recupera le transazioni condivise con l'utente
-        shared_with_me = session.query(SharedAccess.owner_id).filter(
-            SharedAccess.viewer_id == user.id
-        ).all()
-        shared_user_ids = [owner_id for (owner_id,) in shared_with_me]
-        
-        # Se ci sono condivisioni, aggiungi le transazioni condivise
-        if shared_user_ids:
-            shared_transactions = session.query(Expense).join(Wallet).filter(
-                Expense.user_id.in_(shared_user_ids)
-            )
-            # Unisci le query
-            all_transactions = own_transactions.union(shared_transactions)
-        else:
-            all_transactions = own_transactions
-        
-        # Ordina e applica offset e limit
-        transactions = all_transactions.order_by(
-            Expense.date.desc()
-        ).offset(offset).limit(6).all()
+        # Pagina a cursore: il costo non dipende dalla profondità della pagina
+        page = fetch_page(all_transactions, cursor, limit=5)
+        display_transactions = page["items"]
+        offset = page["offset"]
         
-        if not transactions:
+        if not display_transactions:
             msg_text = "Nessuna transazione trovata."
             if message_id:
                 bot.edit_message_text(msg_text, chat_id, message_id)
@@ -219,18 +230,13 @@ def show_transactions_list(chat_id, message_id=None, offset=0, username=None):
                 bot.send_message(chat_id, msg_text)
             return
         
-        # Usa solo le prime 5 transazioni per la visualizzazione
-        display_transactions = transactions[:5]
-        has_next = len(transactions) > 5
-        has_prev = offset > 0
-        
         # Costruisci il messaggio con le transazioni
         msg_text = f"*📋 Transazioni {offset+1}-{offset+len(display_transactions)}:*\n\n"
         
         # Raggruppa le transazioni per utente
         transactions_by_user = {}
         for tx in display_transactions:
-            owner = session.query(User).get(tx.user_id)
+            owner = tx.user
             if owner.id not in transactions_by_user:
                 transactions_by_user[owner.id] = {
                     'owner': owner,
@@ -263,12 +269,12 @@ def show_transactions_list(chat_id, message_id=None, offset=0, username=None):
         markup = InlineKeyboardMarkup()
         row = []
         
-        if has_prev:
+        if page["has_prev"]:
             row.append(InlineKeyboardButton("⬅️ Precedenti", 
-                      callback_data=f"list_transactions_{offset-5}"))
-        if has_next:
+                      callback_data=f"list_transactions_{page['prev_cursor']}"))
+        if page["has_next"]:
             row.append(InlineKeyboardButton("Successive ➡️", 
-                      callback_data=f"list_transactions_{offset+5}"))
+                      callback_data=f"list_transactions_{page['next_cursor']}"))
         if row:
             markup.row(*row)
         
@@ -325,73 +331,39 @@ def report_callback(call: CallbackQuery):
     except Exception as e:
         bot.answer_callback_query(call.id, f"⚠️ Errore: {str(e)}")
 
+def format_owner_reports(reports_by_user):
+    """Genera il testo del report a partire dai totali per proprietario"""
+    msg_text = "*📊 Report Dettagliato*\n\n"
+    
+    for user_data in reports_by_user.values():
+        if user_data['is_own']:
+            msg_text += "*Le tue transazioni*\n"
+        else:
+            msg_text += f"*Transazioni di {user_data['owner_name']}*\n"
+        msg_text += f"💰 Totale: {user_data['total']:+,.2f}\n"
+        msg_text += f"📥 Entrate: {user_data['income']:,.2f}\n"
+        msg_text += f"📤 Uscite: {user_data['expenses']:,.2f}\n\n"
+        
+        msg_text += "*Dettaglio per categoria:*\n"
+        for category, amount in user_data['by_category'].items():
+            emoji = "📈" if amount >= 0 else "📉"
+            msg_text += f"{emoji} {category}: {amount:+,.2f}\n"
+        msg_text += "\n"
+    return msg_text
+
 def show_report(chat_id, message_id=None, username=None):
     """Mostra il report delle transazioni (proprie e condivise)"""
     try:
         session = SessionLocal()
         user = get_or_create_user(session, str(chat_id), username or str(chat_id))
         
-        # Recupera le transazioni dell'utente
-        own_transactions = session.query(Expense).join(Wallet).filter(
-            Expense.user_id == user.id
-        ).all()
-        
-        # Recupera le transazioni condivise con l'utente
-        shared_with_me = session.query(SharedAccess.owner_id).filter(
-            SharedAccess.viewer_id == user.id
-        ).all()
-        shared_user_ids = [owner_id for (owner_id,) in shared_with_me]
-        
-        # Dizionario per memorizzare i report per utente
-        reports_by_user = {}
-        
-        # Analizza le transazioni proprie
-        if own_transactions:
-            reports_by_user[user.id] = {
-                'username': "Le tue transazioni",
-                'transactions': own_transactions,
-                'total': sum(tx.amount for tx in own_transactions),
-                'expenses': sum(tx.amount for tx in own_transactions if tx.amount < 0),
-                'income': sum(tx.amount for tx in own_transactions if tx.amount > 0),
-                'by_category': defaultdict(float)
-            }
-            for tx in own_transactions:
-                reports_by_user[user.id]['by_category'][tx.category] += tx.amount
-        
-        # Analizza le transazioni condivise
-        if shared_user_ids:
-            for owner_id in shared_user_ids:
-                shared_transactions = session.query(Expense).join(Wallet).filter(
-                    Expense.user_id == owner_id
-                ).all()
-                
-                if shared_transactions:
-                    owner = session.query(User).get(owner_id)
-                    reports_by_user[owner_id] = {
-                        'username': f"Transazioni di {owner.username or owner.telegram_id}",
-                        'transactions': shared_transactions,
-                        'total': sum(tx.amount for tx in shared_transactions),
-                        'expenses': sum(tx.amount for tx in shared_transactions if tx.amount < 0),
-                        'income': sum(tx.amount for tx in shared_transactions if tx.amount > 0),
-                        'by_category': defaultdict(float)
-                    }
-                    for tx in shared_transactions:
-                        reports_by_user[owner_id]['by_category'][tx.category] += tx.amount
-        
-        # Genera il messaggio del report
-        msg_text = "*📊 Report Dettagliato*\n\n"
-        
-        for user_data in reports_by_user.values():
-            msg_text += f"*{user_data['username']}*\n"
-            msg_text += f"💰 Totale: {user_data['total']:+,.2f}\n"
-            msg_text += f"📥 Entrate: {user_data['income']:,.2f}\n"
-            msg_text += f"📤 Uscite: {user_data['expenses']:,.2f}\n\n"
-            
-            msg_text += "*Dettaglio per categoria:*\n"
-            for category, amount in user_data['by_category'].items():
-                emoji = "📈" if amount >= 0 else "📉"
-                msg_text += f"{emoji} {category}: {amount:+,.2f}\n"
-            msg_text += "\n"
+        # Totali propri e dei proprietari che condividono, con una sola query aggregata;
+        # il testo resta in cache finché nessuno dei proprietari modifica i propri dati
+        owner_ids = get_visible_owner_ids(session, user.id)
+        msg_text = cached_report(
+            session, "show_report", owner_ids, "all",
+            lambda: format_owner_reports(generate_owner_reports(session, user.id, owner_ids))
+        )
         
         # Crea la tastiera con le opzioni
         markup = InlineKeyboardMarkup()
@@ -624,12 +596,12 @@ def process_expense_details(message):
             date = datetime.datetime.utcnow()
 
         # Salva i dati parzialmente raccolti
-        temp_expense_data[message.chat.id] = {
+        state_store.set(f"expense:{message.chat.id}", {
             "amount": amount,
             "description": description,
             "category": category,
             "date": date
-        }
+        })
 
         # Chiedi il luogo
         markup = InlineKeyboardMarkup()
@@ -682,7 +654,7 @@ def process_expense_location(message):
     """
     try:
         chat_id = message.chat.id
-        data = temp_expense_data.get(chat_id)
+        data = state_store.get(f"expense:{chat_id}")
         if not data:
             bot.reply_to(message, "⚠️ Dati non trovati. Riprova l'inserimento.")
             return
@@ -722,7 +694,7 @@ def handle_currency_selection(call: CallbackQuery):
     try:
         _, currency, location = call.data.split("_", 2)
         chat_id = call.message.chat.id
-        data = temp_expense_data.get(chat_id)
+        data = state_store.get(f"expense:{chat_id}")
         
         if not data:
             bot.answer_callback_query(call.id, "⚠️ Dati non trovati. Riprova l'inserimento.")
@@ -748,7 +720,7 @@ def handle_currency_selection(call: CallbackQuery):
         )
         
         # Pulisci i dati temporanei
-        temp_expense_data.pop(chat_id, None)
+        state_store.pop(f"expense:{chat_id}")
         
         # Conferma l'inserimento
         bot.answer_callback_query(call.id, "✅ Transazione inserita con successo!")
@@ -770,16 +742,54 @@ def handle_currency_selection(call: CallbackQuery):
         if 'session' in locals():
             session.close()
 
+# ----------------------- INVIO MEDIA CON CACHE DEI FILE_ID ------------------------
+
+def send_cached_media(chat_id, user_id, media_key, produce, kind="photo"):
+    """Invia foto o documenti generati riusando i file_id di Telegram.
+
+    Se per `media_key` ci sono file_id salvati con i dati attuali dell'utente
+    vengono reinviati senza upload; altrimenti `produce()` genera la lista di
+    buffer (o di coppie (nome file, buffer) per i documenti) da caricare e i
+    file_id ottenuti vengono salvati. Se Telegram rifiuta un file_id vengono
+    caricate solo quella parte e le successive.
+    """
+    send = bot.send_photo if kind == "photo" else bot.send_document
+    session = SessionLocal()
+    try:
+        file_ids = get_cached_file_ids(session, media_key, user_id)
+        delivered = []
+        if file_ids:
+            try:
+                for file_id in file_ids:
+                    send(chat_id, file_id)
+                    delivered.append(file_id)
+                return
+            except ApiTelegramException:
+                forget_file_ids(session, media_key)  # file_id non più valido: si ricarica
+
+        file_ids = list(delivered)  # Le parti già arrivate non vengono inviate di nuovo
+        for index, item in enumerate(produce()):
+            file_name, buf = item if isinstance(item, tuple) else (None, item)
+            if index < len(delivered):
+                buf.close()
+                continue
+            if file_name is not None:
+                sent = send(chat_id, buf, visible_file_name=file_name)
+            else:
+                sent = send(chat_id, buf)
+            buf.close()
+            file_ids.append(sent.photo[-1].file_id if kind == "photo" else sent.document.file_id)
+        store_file_ids(session, media_key, user_id, file_ids)
+    finally:
+        session.close()
+
 # ----------------------- LISTA TRANSAZIONI CON PAGINAZIONE ------------------------
 
-def send_expenses_page(chat_id, user, page: int):
+def send_expenses_page(chat_id, user, cursor=None):
     session = SessionLocal()
-    expenses = (session.query(Expense)
-                .filter_by(user_id=user.id)
-                .order_by(Expense.date.desc())
-                .offset(page * PAGE_SIZE)
-                .limit(PAGE_SIZE)
-                .all())
+    expenses_query = session.query(Expense).options(joinedload(Expense.wallet)).filter_by(user_id=user.id)
+    page = fetch_page(expenses_query, cursor, limit=PAGE_SIZE)
+    expenses = page["items"]
     if not expenses:
         bot.send_message(chat_id, "📭 Non ci sono transazioni per questa pagina.")
         session.close()
@@ -800,26 +810,29 @@ def send_expenses_page(chat_id, user, page: int):
         )
         bot.send_message(chat_id, text, reply_markup=markup, parse_mode="Markdown")
 
+    session.close()
+
     # Bottoni di navigazione per la paginazione e per il download CSV
     nav_markup = InlineKeyboardMarkup()
-    if page > 0:
-        nav_markup.add(InlineKeyboardButton("<< Precedente", callback_data=f"list_expenses_page_{page-1}"))
-    session = SessionLocal()
-    count = session.query(Expense).filter_by(user_id=user.id).count()
-    session.close()
-    if (page + 1) * PAGE_SIZE < count:
-        nav_markup.add(InlineKeyboardButton("Successiva >>", callback_data=f"list_expenses_page_{page+1}"))
+    if page["has_prev"]:
+        nav_markup.add(InlineKeyboardButton("<< Precedente", callback_data=f"list_expenses_page_{page['prev_cursor']}"))
+    if page["has_next"]:
+        nav_markup.add(InlineKeyboardButton("Successiva >>", callback_data=f"list_expenses_page_{page['next_cursor']}"))
     nav_markup.add(InlineKeyboardButton("Scarica CSV", callback_data="download_csv"))
-    bot.send_message(chat_id, f"Pagina {page + 1}", reply_markup=nav_markup)
+    nav_markup.row(
+        InlineKeyboardButton("Scarica Parquet", callback_data="download_parquet"),
+        InlineKeyboardButton("Scarica Arrow", callback_data="download_arrow")
+    )
+    bot.send_message(chat_id, f"Pagina {page['offset'] // PAGE_SIZE + 1}", reply_markup=nav_markup)
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("list_expenses_page_"))
 def list_expenses_callback(call: CallbackQuery):
-    page = int(call.data.split("_")[-1])
+    cursor = call.data[len("list_expenses_page_"):]
     session = SessionLocal()
     user = get_or_create_user(session, str(call.from_user.id),
                               call.from_user.username or call.from_user.first_name)
     session.close()
-    send_expenses_page(call.message.chat.id, user, page)
+    send_expenses_page(call.message.chat.id, user, cursor)
     bot.answer_callback_query(call.id)
 
 # ----------------------- DOWNLOAD CSV ------------------------
@@ -829,31 +842,44 @@ def download_csv_callback(call: CallbackQuery):
     session = SessionLocal()
     user = get_or_create_user(session, str(call.from_user.id),
                               call.from_user.username or call.from_user.first_name)
-    expenses = (session.query(Expense)
-                .filter_by(user_id=user.id)
-                .order_by(Expense.date.desc())
-                .all())
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["ID", "Data", "Descrizione", "Importo", "Categoria", "Luogo", "Valuta"])
-    for exp in expenses:
-        writer.writerow([
-            exp.id,
-            exp.date.strftime('%Y-%m-%d'),
-            exp.description,
-            exp.amount,
-            exp.category,
-            exp.location,
-            exp.wallet.currency
-        ])
+    user_id = user.id
     session.close()
-    csv_data = output.getvalue()
-    output.close()
-    csv_bytes = io.BytesIO(csv_data.encode('utf-8'))
-    csv_bytes.name = "transazioni.csv"
-    bot.send_document(call.message.chat.id, document=csv_bytes)
+    # Il contenuto dell'export dipende solo dai dati dell'utente, già legati alla data_version
+    send_cached_media(call.message.chat.id, user_id, f"csv_export:{user_id}",
+                      lambda: build_csv_export(user_id), kind="document")
     bot.answer_callback_query(call.id)
 
+def build_csv_export(user_id, compression="zip"):
+    """Genera l'export compresso delle transazioni dell'utente, diviso in più file se troppo grande"""
+    session = SessionLocal()
+    try:
+        return export_files(iter_export_rows(session, user_id), compression)
+    finally:
+        session.close()
+
+@bot.callback_query_handler(func=lambda call: call.data in ["download_parquet", "download_arrow"])
+def download_columnar_callback(call: CallbackQuery):
+    """Export tipizzato in formato Parquet o Arrow IPC"""
+    fmt = call.data[len("download_"):]
+    session = SessionLocal()
+    user = get_or_create_user(session, str(call.from_user.id),
+                              call.from_user.username or call.from_user.first_name)
+    user_id = user.id
+    session.close()
+    try:
+        send_cached_media(call.message.chat.id, user_id, f"{fmt}_export:{user_id}",
+                          lambda: [build_columnar_export(user_id, fmt)], kind="document")
+        bot.answer_callback_query(call.id)
+    except RuntimeError as e:  # pyarrow non installato
+        bot.answer_callback_query(call.id, f"⚠️ {str(e)}")
+
+def build_columnar_export(user_id, fmt):
+    session = SessionLocal()
+    try:
+        return export_columnar(session, user_id, fmt)
+    finally:
+        session.close()
+
 # ----------------------- MODIFICA ED ELIMINAZIONE TRANSAZIONI ------------------------
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("delete_"))
@@ -1000,14 +1026,14 @@ def process_report(message: Message):
                                 message.from_user.username or message.from_user.first_name)
         
         # Recupera le transazioni separate per valuta
-        transactions_eur = session.query(Expense).join(Wallet).filter(
+        transactions_eur = session.query(Expense).join(Wallet).options(contains_eager(Expense.wallet)).filter(
             Expense.user_id == user.id,
             Expense.date >= start_date,
             Expense.date < end_date,
             Wallet.currency == "EUR"
         ).all()
 
-        transactions_sat = session.query(Expense).join(Wallet).filter(
+        transactions_sat = session.query(Expense).join(Wallet).options(contains_eager(Expense.wallet)).filter(
             Expense.user_id == user.id,
             Expense.date >= start_date,
             Expense.date < end_date,
@@ -1027,16 +1053,21 @@ def process_report(message: Message):
             
             for exp in transactions:
                 key = get_period_key(exp.date)
-                overall[key][0] += exp.amount
+                overall[key][0] += exp.amount_minor
                 overall[key][1] += 1
                 
-                by_category[(key, exp.category)][0] += exp.amount
+                by_category[(key, exp.category)][0] += exp.amount_minor
                 by_category[(key, exp.category)][1] += 1
                 
                 wallet_name = exp.wallet.name if exp.wallet else "N/D"
-                by_wallet[(key, wallet_name)][0] += exp.amount
+                by_wallet[(key, wallet_name)][0] += exp.amount_minor
                 by_wallet[(key, wallet_name)][1] += 1
 
+            # Le somme sono esatte in unità minime: converti una sola volta alla fine
+            for totals in (overall, by_category, by_wallet):
+                for key in totals:
+                    totals[key][0] = from_minor(totals[key][0], currency)
+
             total_amount = sum(total for total, _ in overall.values())
             total_transactions = sum(count for _, count in overall.values())
 
@@ -1082,10 +1113,9 @@ def process_report(message: Message):
             
             bot.send_message(message.chat.id, "📊 Generazione grafici EUR...")
             try:
-                image_buffers = create_report_charts(overall_eur, categories_eur, wallets_eur, "EUR")
-                for buf in image_buffers:
-                    bot.send_photo(message.chat.id, buf)
-                    buf.close()
+                data = report_chart_data(overall_eur, categories_eur, wallets_eur, "EUR")
+                send_cached_media(message.chat.id, user.id, f"chart:{user.id}:{chart_key('report', data, 'photo')}",
+                                  lambda: [io.BytesIO(image) for image in render_charts("report", data)])
             except Exception as e:
                 bot.send_message(message.chat.id, f"⚠️ Errore nella generazione dei grafici EUR: {str(e)}")
 
@@ -1095,10 +1125,9 @@ def process_report(message: Message):
             
             bot.send_message(message.chat.id, "📊 Generazione grafici SAT...")
             try:
-                image_buffers = create_report_charts(overall_sat, categories_sat, wallets_sat, "SAT")
-                for buf in image_buffers:
-                    bot.send_photo(message.chat.id, buf)
-                    buf.close()
+                data = report_chart_data(overall_sat, categories_sat, wallets_sat, "SAT")
+                send_cached_media(message.chat.id, user.id, f"chart:{user.id}:{chart_key('report', data, 'photo')}",
+                                  lambda: [io.BytesIO(image) for image in render_charts("report", data)])
             except Exception as e:
                 bot.send_message(message.chat.id, f"⚠️ Errore nella generazione dei grafici SAT: {str(e)}")
 
@@ -1108,127 +1137,27 @@ def process_report(message: Message):
         if 'session' in locals():
             session.close()
 
-def create_report_charts(overall, category_totals, wallet_totals, currency):
+def report_chart_data(overall, category_totals, wallet_totals, currency):
+    """Serie dei grafici del report in forma serializzabile (input di charts.render_charts)"""
+    # Totali per wallet su tutto il periodo
+    wallets = defaultdict(float)
+    for (_, wallet_name), (amount, _) in wallet_totals.items():
+        wallets[wallet_name] += float(amount)
+
+    return {
+        "currency": currency,
+        "overall": [[period, float(overall[period][0])] for period in sorted(overall.keys())],
+        "categories": [[str(cat), float(amount)] for cat, (amount, _) in category_totals.items()],
+        "wallets": [[name, amount] for name, amount in wallets.items()],
+    }
+
+def create_report_charts(overall, category_totals, wallet_totals, currency, preset="photo"):
     """
-    Crea i grafici per il report finanziario.
+    Crea i grafici per il report finanziario (nel pool di processi di charts.py).
     Restituisce una lista di buffer di immagini.
     """
-    plt.style.use('ggplot')
-    image_buffers = []
-    
-    # Funzione helper per formattare gli importi
-    def currency_formatter(x, p):
-        return f'{x:,.0f} {currency}'
-
-    try:
-        # 1. Grafico andamento temporale
-        plt.figure(figsize=(12, 6))
-        periods = sorted(overall.keys())
-        amounts = [float(overall[p][0]) for p in periods]  # Converti in float
-        
-        plt.plot(periods, amounts, marker='o', linewidth=2, markersize=8)
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.title(f'📈 Andamento Temporale ({currency})', pad=20, fontsize=14)
-        plt.xlabel('Periodo', fontsize=12)
-        plt.ylabel(f'Importo ({currency})', fontsize=12)
-        plt.xticks(rotation=45)
-        plt.gca().yaxis.set_major_formatter(FuncFormatter(currency_formatter))
-        
-        # Aggiungi etichette dei valori
-        for i, amount in enumerate(amounts):
-            plt.annotate(f'{amount:,.0f} {currency}', 
-                        (periods[i], amount),
-                        textcoords="offset points",
-                        xytext=(0,10),
-                        ha='center')
-        
-        plt.tight_layout()
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=300, bbox_inches='tight')
-        buf.seek(0)
-        image_buffers.append(buf)
-        plt.close()
-
-        # 2. Grafico a torta delle categorie
-        if category_totals:
-            plt.figure(figsize=(10, 10))
-            # Converti le tuple in stringhe per le categorie
-            categories_dict = {}
-            for (period, cat), (amount, count) in category_totals.items():
-                if cat not in categories_dict:
-                    categories_dict[cat] = [0, 0]
-                categories_dict[cat][0] += float(amount)
-                categories_dict[cat][1] += count
-
-            categories = list(categories_dict.keys())
-            amounts = [abs(total[0]) for total in categories_dict.values()]
-            total = sum(amounts)
-            
-            if total > 0:
-                # Filtra le categorie che rappresentano meno dell'1% del totale
-                threshold = total * 0.01
-                significant_indices = [i for i, amount in enumerate(amounts) if amount > threshold]
-                significant_categories = [categories[i] for i in significant_indices]
-                significant_amounts = [amounts[i] for i in significant_indices]
-                
-                colors = plt.cm.Set3(np.linspace(0, 1, len(significant_categories)))
-                wedges, texts, autotexts = plt.pie(significant_amounts, 
-                                              labels=significant_categories,
-                                              colors=colors,
-                                              autopct='%1.1f%%',
-                                              pctdistance=0.85)
-                
-                plt.setp(autotexts, size=8, weight="bold")
-                plt.setp(texts, size=10)
-                
-                plt.title(f'🏷️ Distribuzione per Categoria ({currency})', pad=20, fontsize=14)
-                plt.tight_layout()
-                
-                buf = io.BytesIO()
-                plt.savefig(buf, format='png', dpi=300, bbox_inches='tight')
-                buf.seek(0)
-                image_buffers.append(buf)
-                plt.close()
-
-        # 3. Grafico a barre orizzontali per wallet
-        if wallet_totals:
-            plt.figure(figsize=(12, 6))
-            # Converti le tuple in stringhe per i wallet
-            wallets_dict = {}
-            for (period, wal), (amount, count) in wallet_totals.items():
-                if wal not in wallets_dict:
-                    wallets_dict[wal] = [0, 0]
-                wallets_dict[wal][0] += float(amount)
-                wallets_dict[wal][1] += count
-
-            wallets = list(wallets_dict.keys())
-            amounts = [total[0] for total in wallets_dict.values()]
-            
-            bars = plt.barh(wallets, amounts)
-            plt.title(f'💼 Saldo per Portafoglio ({currency})', pad=20, fontsize=14)
-            plt.xlabel(f'Importo ({currency})', fontsize=12)
-            
-            for i, bar in enumerate(bars):
-                width = bar.get_width()
-                plt.text(width, bar.get_y() + bar.get_height()/2,
-                        f'{amounts[i]:,.0f} {currency}',
-                        ha='left', va='center', fontsize=10)
-            
-            plt.grid(True, linestyle='--', alpha=0.7, axis='x')
-            plt.gca().xaxis.set_major_formatter(FuncFormatter(currency_formatter))
-            
-            plt.tight_layout()
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=300, bbox_inches='tight')
-            buf.seek(0)
-            image_buffers.append(buf)
-            plt.close()
-        
-        return image_buffers
-
-    except Exception as e:
-        plt.close('all')  # Chiudi tutte le figure in caso di errore
-        raise e  # Rilancia l'eccezione per gestirla nel chiamante
+    data = report_chart_data(overall, category_totals, wallet_totals, currency)
+    return [io.BytesIO(image) for image in render_charts("report", data, preset)]
 
 @bot.message_handler(commands=["test"])
 def create_test_data(message):
@@ -1259,7 +1188,8 @@ def create_test_data(message):
         
         bot.reply_to(message, "🔄 Generazione transazioni di test in corso...")
         
-        # Genera 50 transazioni random
+        # Genera 50 transazioni random, inserite poi in un'unica transazione
+        records = []
         for _ in range(50):
             # Scegli categoria e descrizione correlata
             category = random.choice(categories)
@@ -1275,17 +1205,15 @@ def create_test_data(message):
             random_days = random.randint(0, 30)
             date = start_date + timedelta(days=random_days)
             
-            # Crea la transazione
-            create_expense(
-                session,
-                user,
-                wallet_eur,  # Usa solo il wallet EUR
-                amount,
-                description,
-                random.choice(locations),
-                date,
-                category
-            )
+            records.append({
+                "wallet": wallet_eur,  # Usa solo il wallet EUR
+                "amount": amount,
+                "description": description,
+                "location": random.choice(locations),
+                "date": date,
+                "category": category,
+            })
+        create_expenses_bulk(session, user, records)
         
         # Analisi delle transazioni
         transactions = session.query(Expense).join(Wallet).filter(
@@ -1297,22 +1225,7 @@ def create_test_data(message):
         total = sum(t.amount for t in transactions)
         
         # Crea grafico delle transazioni
-        plt.figure(figsize=(10, 6))
-        plt.bar(['EUR'], [total], color='#2ecc71')
-        plt.title('💰 Saldo Totale', pad=20, fontsize=14)
-        plt.ylabel('Saldo (€)')
-        
-        # Aggiungi etichetta sulla barra
-        plt.text(0, total, f'{total:,.2f} €',
-                ha='center', va='bottom')
-        
-        plt.grid(True, linestyle='--', alpha=0.7, axis='y')
-        
-        # Salva il grafico
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=300, bbox_inches='tight')
-        buf.seek(0)
-        plt.close()
+        buf = io.BytesIO(render_charts("balance", {"currency": "EUR", "total": total})[0])
         
         # Invia il riepilogo
         summary = (
@@ -1346,10 +1259,9 @@ def reset_database(message):
                                 message.from_user.username or message.from_user.first_name)
         session.close()
 
-        # Elimina il database
-        Base.metadata.drop_all(bind=engine)
-        # Ricrea il database
-        Base.metadata.create_all(bind=engine)
+        # Elimina il database e lo ricrea all'ultima versione dello schema
+        reset_schema(engine)
+        clear_identity_cache()
         
         bot.reply_to(message, "✅ Database eliminato e ricreato con successo!\n\n"
                     "Puoi importare i dati da un CSV usando il comando /import_csv")
@@ -1368,7 +1280,8 @@ def request_csv_import(message):
                 "- date: data (YYYY-MM-DD)\n"
                 "- location: luogo\n"
                 "- currency: valuta (EUR o SAT)\n\n"
-                "La prima riga deve contenere i nomi delle colonne.")
+                "La prima riga deve contenere i nomi delle colonne.\n"
+                "Sono accettati anche i file .parquet e .arrow esportati dal bot.")
     bot.register_next_step_handler(message, process_csv_import)
 
 def process_csv_import(message):
@@ -1379,72 +1292,82 @@ def process_csv_import(message):
             bot.reply_to(message, "⚠️ Per favore, invia un file CSV.")
             return
         
-        # Verifica che sia un file CSV
-        if not message.document.file_name.endswith('.csv'):
-            bot.reply_to(message, "⚠️ Il file deve essere in formato CSV.")
+        # Verifica che sia un file CSV (o un export Parquet/Arrow)
+        columnar = columnar_format(message.document.file_name)
+        if not columnar and not message.document.file_name.endswith('.csv'):
+            bot.reply_to(message, "⚠️ Il file deve essere in formato CSV, Parquet o Arrow.")
             return
 
         # Scarica il file
         file_info = bot.get_file(message.document.file_id)
         downloaded_file = bot.download_file(file_info.file_path)
         
-        # Leggi il CSV
-        csv_data = pd.read_csv(io.StringIO(downloaded_file.decode('utf-8')))
-        
-        # Verifica le colonne necessarie
-        required_columns = ['amount', 'description', 'category', 'date', 'location', 'currency']
-        missing_columns = [col for col in required_columns if col not in csv_data.columns]
-        if missing_columns:
-            bot.reply_to(message, f"⚠️ Colonne mancanti nel CSV: {', '.join(missing_columns)}")
-            return
-
         # Inizia l'importazione
-        bot.reply_to(message, "🔄 Importazione in corso...")
+        progress_msg = bot.reply_to(message, "🔄 Importazione in corso...")
         
         session = SessionLocal()
         user = get_or_create_user(session, str(message.from_user.id),
                                 message.from_user.username or message.from_user.first_name)
         
-        wallets = {}  # Cache per i wallet
-        imported_count = 0
-        errors = []
-
-        for _, row in csv_data.iterrows():
+        # Aggiorna il messaggio di avanzamento al massimo ogni IMPORT_PROGRESS_INTERVAL secondi
+        last_update = [time.monotonic()]
+        def on_progress(stats):
+            now = time.monotonic()
+            if now - last_update[0] < IMPORT_PROGRESS_INTERVAL:
+                return
+            last_update[0] = now
             try:
-                # Ottieni o crea il wallet per la valuta
-                currency = row['currency'].upper()
-                if currency not in wallets:
-                    wallets[currency] = create_wallet(session, f"Principale {currency}", currency)
-                
-                # Crea la transazione
-                create_expense(
-                    session,
-                    user,
-                    wallets[currency],
-                    float(row['amount']),
-                    str(row['description']),
-                    str(row['location']),
-                    pd.to_datetime(row['date']).to_pydatetime(),
-                    str(row['category'])
+                bot.edit_message_text(
+                    f"🔄 Importazione in corso...\n\n"
+                    f"• Righe elaborate: {stats['rows']}\n"
+                    f"• Transazioni importate: {stats['imported']}\n"
+                    f"• Righe scartate: {stats['rejected']}",
+                    progress_msg.chat.id,
+                    progress_msg.message_id
                 )
-                imported_count += 1
-            except Exception as e:
-                errors.append(f"Riga {_+2}: {str(e)}")
-
-        session.close()
+            except Exception:
+                pass  # L'avanzamento è solo informativo
+
+        # Lettura a blocchi con validazione vettoriale; gli scarti vanno nel report
+        error_report = open_error_report()
+        try:
+            if columnar:
+                stats = import_chunks(session, user, iter_columnar_chunks(downloaded_file, columnar),
+                                      on_progress=on_progress, error_report=error_report)
+            else:
+                stats = import_csv(session, user, io.BytesIO(downloaded_file),
+                                   on_progress=on_progress, error_report=error_report)
+        except MissingColumnsError as e:
+            bot.reply_to(message, f"⚠️ Colonne mancanti nel CSV: {', '.join(e.missing)}")
+            error_report.close()
+            return
+        finally:
+            session.close()
 
         # Invia il report dell'importazione
         report = f"✅ Importazione completata!\n\n" \
                  f"📊 Statistiche:\n" \
-                 f"• Transazioni importate: {imported_count}\n" \
-                 f"• Valute: {', '.join(wallets.keys())}\n"
+                 f"• Transazioni importate: {stats['imported']}\n" \
+                 f"• Duplicati saltati: {stats['duplicates']}\n" \
+                 f"• Valute: {', '.join(sorted(stats['currencies']))}\n"
         
+        errors = stats['errors']
         if errors:
-            report += f"\n⚠️ Errori ({len(errors)}):\n" + "\n".join(errors[:10])
-            if len(errors) > 10:
-                report += f"\n... e altri {len(errors) - 10} errori"
-
-        bot.reply_to(message, report)
+            report += f"\n⚠️ Errori ({stats['rejected']}):\n" + "\n".join(errors[:10])
+            if stats['rejected'] > 10:
+                report += f"\n... e altri {stats['rejected'] - 10} errori"
+
+        try:
+            bot.edit_message_text(report, progress_msg.chat.id, progress_msg.message_id)
+        except Exception:
+            bot.reply_to(message, report)
+
+        # Report completo delle righe scartate
+        if error_report.read(1):
+            error_report.seek(0)
+            bot.send_document(message.chat.id, document=error_report.read(),
+                              visible_file_name="righe_scartate.csv")
+        error_report.close()
 
     except Exception as e:
         bot.reply_to(message, f"⚠️ Errore durante l'importazione: {str(e)}")
@@ -1454,11 +1377,11 @@ def process_csv_import(message):
 @bot.callback_query_handler(func=lambda call: call.data.startswith(("list_transactions", "edit_tx_", "delete_tx_")))
 def list_transactions_callback(call: CallbackQuery):
     try:
-        # Estrai l'offset dalla callback data (default 0)
+        # Estrai il cursore dalla callback data (nessuno = prima pagina)
         if call.data == "list_transactions":
-            offset = 0
+            cursor = None
         elif call.data.startswith("list_transactions_"):
-            offset = int(call.data.split("_")[-1])
+            cursor = call.data[len("list_transactions_"):]
         elif call.data.startswith(("edit_tx_", "delete_tx_")):
             tx_id = int(call.data.split("_")[-1])
             if call.data.startswith("edit_tx_"):
@@ -1475,50 +1398,34 @@ def list_transactions_callback(call: CallbackQuery):
         user = get_or_create_user(session, str(call.from_user.id),
                                 call.from_user.username or call.from_user.first_name)
         
-        # Recupera sia le transazioni dell'utente che quelle condivise con lui
-        own_transactions = session.query(Expense).join(Wallet).filter(
-            Expense.user_id == user.id
+        # Transazioni dell'utente e di chi ha condiviso con lui, in un'unica query
+        owner_ids = [user.id] + get_shared_owner_ids(session, user.id)
+        # Proprietario e wallet caricati nella stessa query della pagina (niente N+1)
+        all_transactions = session.query(Expense).options(
+            joinedload(Expense.user),
+            joinedload(Expense.wallet)
+        ).filter(
+            Expense.user_id.in_(owner_ids)
         )
         
-        # Recupera gli ID degli utenti che hanno condiviso con l'utente corrente
-        shared_with_me = session.query(SharedAccess.owner_id).filter(
-            SharedAccess.viewer_id == user.id
-        ).all()
-        shared_user_ids = [owner_id for (owner_id,) in shared_with_me]
-        
-        # Se ci sono condivisioni, aggiungi anche le transazioni condivise
-        if shared_user_ids:
-            shared_transactions = session.query(Expense).join(Wallet).filter(
-                Expense.user_id.in_(shared_user_ids)
-            )
-            # Unisci le query
-            all_transactions = own_transactions.union(shared_transactions)
-        else:
-            all_transactions = own_transactions
-        
-        # Ordina e applica offset e limit
-        transactions = all_transactions.order_by(
-            Expense.date.desc()
-        ).offset(offset).limit(6).all()
+        # Pagina a cursore: il costo non dipende dalla profondità della pagina
+        page = fetch_page(all_transactions, cursor, limit=5)
+        display_transactions = page["items"]
+        offset = page["offset"]
         
-        if not transactions:
+        if not display_transactions:
             msg_text = "Nessuna transazione trovata."
             if call.message.text != msg_text:
                 bot.edit_message_text(msg_text, call.message.chat.id, call.message.message_id)
             bot.answer_callback_query(call.id)
             return
         
-        # Usa solo le prime 5 transazioni per la visualizzazione
-        display_transactions = transactions[:5]
-        has_next = len(transactions) > 5
-        has_prev = offset > 0
-        
         # Costruisci il messaggio con le transazioni
         msg_text = f"*📋 Transazioni {offset+1}-{offset+len(display_transactions)}:*\n\n"
         
         for tx in display_transactions:
-            # Recupera il proprietario della transazione
-            owner = session.query(User).get(tx.user_id)
+            # Il proprietario è già caricato insieme alla transazione
+            owner = tx.user
             is_own = owner.id == user.id
             
             # Arrotonda l'importo a 2 decimali e formatta con segno e valuta
@@ -1544,12 +1451,12 @@ def list_transactions_callback(call: CallbackQuery):
         row = []
         
         # Bottoni di navigazione
-        if has_prev:
+        if page["has_prev"]:
             row.append(InlineKeyboardButton("⬅️ Precedenti", 
-                      callback_data=f"list_transactions_{offset-5}"))
-        if has_next:
+                      callback_data=f"list_transactions_{page['prev_cursor']}"))
+        if page["has_next"]:
             row.append(InlineKeyboardButton("Successive ➡️", 
-                      callback_data=f"list_transactions_{offset+5}"))
+                      callback_data=f"list_transactions_{page['next_cursor']}"))
         if row:
             markup.row(*row)
         
@@ -0,0 +1,223 @@
+"""
+Rendering dei grafici dei report in un pool di processi.
+
+I grafici matplotlib vengono disegnati in processi separati (pyplot non è
+thread-safe e il rendering occupa la CPU), con un timeout per ogni job. I
+PNG ottenuti restano in cache, indicizzati dall'hash dei dati in ingresso
+e del preset, quindi lo stesso report non viene ridisegnato.
+
+I preset definiscono dimensioni e DPI per il tipo di invio: "photo" per
+send_photo (Telegram ridimensiona comunque le foto a ~1280 px) e
+"document" per l'invio come file in alta risoluzione.
+"""
+import hashlib
+import io
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from cache import TTLCache
+
+CHART_WORKERS = 2
+CHART_TIMEOUT = 30  # secondi per job
+CHART_CACHE_SIZE = 256
+CHART_CACHE_TTL = 24 * 3600  # secondi
+
+# "photo": il grafico più largo (12 pollici) resta sotto i 1280 px, così Telegram non lo ricampiona;
+# "document": dimensioni piene a 300 DPI per la stampa
+CHART_PRESETS = {
+    "photo": {"dpi": 110, "scale": 0.9},
+    "document": {"dpi": 300, "scale": 1.0},
+}
+
+chart_cache = TTLCache(maxsize=CHART_CACHE_SIZE, ttl=CHART_CACHE_TTL)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ChartTimeoutError(Exception):
+    """Il rendering ha superato CHART_TIMEOUT"""
+
+
+# ----------------------- RENDERING (nei processi del pool) ------------------------
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def _save(fig, preset):
+    import matplotlib.pyplot as plt
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=preset["dpi"], bbox_inches='tight')
+    plt.close(fig)
+    return buf.getvalue()
+
+
+def _figure(width, height, preset):
+    import matplotlib.pyplot as plt
+    return plt.figure(figsize=(width * preset["scale"], height * preset["scale"]))
+
+
+def _render_report(data, preset):
+    """Andamento per periodo, torta delle categorie e barre per wallet"""
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from matplotlib.ticker import FuncFormatter
+
+    currency = data["currency"]
+    plt.style.use('ggplot')
+    images = []
+
+    def currency_formatter(x, p):
+        return f'{x:,.0f} {currency}'
+
+    # 1. Grafico andamento temporale
+    fig = _figure(12, 6, preset)
+    periods = [period for period, _ in data["overall"]]
+    amounts = [amount for _, amount in data["overall"]]
+    plt.plot(periods, amounts, marker='o', linewidth=2, markersize=8)
+    plt.grid(True, linestyle='--', alpha=0.7)
+    plt.title(f'📈 Andamento Temporale ({currency})', pad=20, fontsize=14)
+    plt.xlabel('Periodo', fontsize=12)
+    plt.ylabel(f'Importo ({currency})', fontsize=12)
+    plt.xticks(rotation=45)
+    plt.gca().yaxis.set_major_formatter(FuncFormatter(currency_formatter))
+    for i, amount in enumerate(amounts):
+        plt.annotate(f'{amount:,.0f} {currency}',
+                     (periods[i], amount),
+                     textcoords="offset points",
+                     xytext=(0, 10),
+                     ha='center')
+    plt.tight_layout()
+    images.append(_save(fig, preset))
+
+    # 2. Grafico a torta delle categorie (escluse quelle sotto l'1% del totale)
+    categories = [category for category, _ in data["categories"]]
+    amounts = [abs(amount) for _, amount in data["categories"]]
+    total = sum(amounts)
+    if total > 0:
+        threshold = total * 0.01
+        significant = [(c, a) for c, a in zip(categories, amounts) if a > threshold]
+        fig = _figure(10, 10, preset)
+        colors = plt.cm.Set3(np.linspace(0, 1, len(significant)))
+        wedges, texts, autotexts = plt.pie([a for _, a in significant],
+                                           labels=[c for c, _ in significant],
+                                           colors=colors,
+                                           autopct='%1.1f%%',
+                                           pctdistance=0.85)
+        plt.setp(autotexts, size=8, weight="bold")
+        plt.setp(texts, size=10)
+        plt.title(f'🏷️ Distribuzione per Categoria ({currency})', pad=20, fontsize=14)
+        plt.tight_layout()
+        images.append(_save(fig, preset))
+
+    # 3. Grafico a barre orizzontali per wallet
+    if data["wallets"]:
+        fig = _figure(12, 6, preset)
+        wallets = [wallet for wallet, _ in data["wallets"]]
+        amounts = [amount for _, amount in data["wallets"]]
+        bars = plt.barh(wallets, amounts)
+        plt.title(f'💼 Saldo per Portafoglio ({currency})', pad=20, fontsize=14)
+        plt.xlabel(f'Importo ({currency})', fontsize=12)
+        for i, bar in enumerate(bars):
+            plt.text(bar.get_width(), bar.get_y() + bar.get_height() / 2,
+                     f'{amounts[i]:,.0f} {currency}',
+                     ha='left', va='center', fontsize=10)
+        plt.grid(True, linestyle='--', alpha=0.7, axis='x')
+        plt.gca().xaxis.set_major_formatter(FuncFormatter(currency_formatter))
+        plt.tight_layout()
+        images.append(_save(fig, preset))
+
+    return images
+
+
+def _render_balance(data, preset):
+    """Barra singola con il saldo totale"""
+    import matplotlib.pyplot as plt
+
+    total = data["total"]
+    fig = _figure(10, 6, preset)
+    plt.bar([data["currency"]], [total], color='#2ecc71')
+    plt.title('💰 Saldo Totale', pad=20, fontsize=14)
+    plt.ylabel(f'Saldo ({data["currency"]})')
+    plt.text(0, total, f'{total:,.2f} {data["currency"]}', ha='center', va='bottom')
+    plt.grid(True, linestyle='--', alpha=0.7, axis='y')
+    return [_save(fig, preset)]
+
+
+RENDERERS = {
+    "report": _render_report,
+    "balance": _render_balance,
+}
+
+
+def _render(kind, data, preset):
+    import matplotlib.pyplot as plt
+    try:
+        return RENDERERS[kind](data, preset)
+    finally:
+        plt.close('all')  # Nessuna figura resta aperta nel processo, anche in caso di errore
+
+
+# ----------------------- API ------------------------
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # "spawn": il bot ha molti thread attivi e fork li duplicherebbe in stato incoerente
+            _pool = ProcessPoolExecutor(
+                max_workers=CHART_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        return _pool
+
+
+def _reset_pool(pool):
+    """Termina i processi del pool (es. un job bloccato) e ne crea uno nuovo al prossimo uso"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    for process in list(pool._processes.values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def chart_key(kind, data, preset):
+    """Hash dei dati in ingresso e del preset"""
+    payload = json.dumps([kind, data, CHART_PRESETS[preset]], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def render_charts(kind, data, preset="photo", timeout=CHART_TIMEOUT):
+    """Restituisce i PNG (bytes) dei grafici `kind` per i dati indicati.
+
+    `data` deve essere serializzabile (liste, dict, numeri, stringhe).
+    Solleva ChartTimeoutError se il rendering supera `timeout` secondi.
+    """
+    key = chart_key(kind, data, preset)
+    images = chart_cache.get(key)
+    if images is not None:
+        return images
+
+    pool = _get_pool()
+    future = pool.submit(_render, kind, data, CHART_PRESETS[preset])
+    try:
+        images = future.result(timeout=timeout)
+    except TimeoutError:
+        _reset_pool(pool)
+        raise ChartTimeoutError(f"Rendering del grafico oltre {timeout} secondi")
+    chart_cache.set(key, images)
+    return images
+
+
+def shutdown():
+    """Chiude il pool di processi"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
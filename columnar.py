@@ -0,0 +1,158 @@
+"""
+Export e import in formato colonnare (Parquet o Arrow IPC).
+
+Il file ha colonne tipizzate: date come timestamp, importi sia in unità
+minime (int64, esatti) sia in unità principali (float64), categoria, luogo
+e valuta codificati a dizionario. Chi analizza i dati non deve più
+riconvertire testo in date e numeri, e il file Arrow si può aprire
+mappato in memoria senza copie:
+
+    import pyarrow as pa
+    table = pa.ipc.open_file(pa.memory_map("transazioni.arrow")).read_all()
+
+Gli stessi file sono accettati da /import_csv (backup e ripristino veloci):
+reimportarli non duplica le transazioni già presenti (vedi importer.py).
+Richiede il pacchetto opzionale pyarrow.
+"""
+import tempfile
+from sqlalchemy import select
+from model import Expense, Wallet
+from money import from_minor
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    pyarrow_installed = True
+except ImportError:
+    pyarrow_installed = False
+
+COLUMNAR_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+COLUMNAR_BATCH_SIZE = 10000  # Righe per row group / record batch
+COLUMNAR_SPOOL_SIZE = 1024 * 1024
+DICTIONARY_COLUMNS = ("category", "location", "currency")
+
+
+def _require_pyarrow():
+    if not pyarrow_installed:
+        raise RuntimeError("pyarrow non è installato. Installalo con 'pip install pyarrow'")
+
+
+def columnar_schema():
+    """Schema Arrow dell'export"""
+    _require_pyarrow()
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("id", pa.int64()),
+        ("date", pa.timestamp("us")),
+        ("description", pa.string()),
+        ("amount_minor", pa.int64()),
+        ("amount", pa.float64()),
+        ("category", dictionary),
+        ("location", dictionary),
+        ("currency", dictionary),
+    ])
+
+
+class _DictionaryEncoder:
+    """Dizionario che cresce tra i batch: ogni batch ne estende il precedente (delta Arrow)"""
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def encode(self, values):
+        indices = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            position = self.index.get(value)
+            if position is None:
+                position = self.index[value] = len(self.values)
+                self.values.append(value)
+            indices.append(position)
+        return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), pa.array(self.values, pa.string()))
+
+
+def _record_batch(rows, schema, encoders):
+    ids, dates, descriptions, amounts_minor, categories, locations, currencies = zip(*rows)
+    return pa.record_batch([
+        pa.array(ids, pa.int64()),
+        pa.array(dates, pa.timestamp("us")),
+        pa.array(descriptions, pa.string()),
+        pa.array(amounts_minor, pa.int64()),
+        pa.array([from_minor(a, c) for a, c in zip(amounts_minor, currencies)], pa.float64()),
+        encoders["category"].encode(categories),
+        encoders["location"].encode(locations),
+        encoders["currency"].encode(currencies),
+    ], schema=schema)
+
+
+def export_columnar(session, user_id, fmt="parquet", batch_size=COLUMNAR_BATCH_SIZE, base_name="transazioni"):
+    """Scrive le transazioni dell'utente in un file Parquet o Arrow, a batch.
+
+    Restituisce (nome file, file temporaneo) aperto in lettura dall'inizio.
+    """
+    _require_pyarrow()
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"Formato non supportato: {fmt}")
+
+    schema = columnar_schema()
+    encoders = {column: _DictionaryEncoder() for column in DICTIONARY_COLUMNS}
+    output = tempfile.SpooledTemporaryFile(max_size=COLUMNAR_SPOOL_SIZE, mode='w+b')
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(output, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(output, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+
+    stmt = select(
+        Expense.id,
+        Expense.date,
+        Expense.description,
+        Expense.amount_minor,
+        Expense.category,
+        Expense.location,
+        Wallet.currency
+    ).join(Wallet, Expense.wallet_id == Wallet.id).where(
+        Expense.user_id == user_id
+    ).order_by(Expense.date.desc(), Expense.id.desc()).execution_options(yield_per=batch_size)
+
+    # Lo schema resta valido anche senza transazioni (file con zero righe)
+    for partition in session.execute(stmt).partitions():
+        writer.write_batch(_record_batch(partition, schema, encoders))
+    writer.close()
+    output.seek(0)
+    return f"{base_name}{COLUMNAR_FORMATS[fmt]}", output
+
+
+def columnar_format(file_name):
+    """Formato colonnare dedotto dall'estensione (None se non è Parquet/Arrow)"""
+    name = file_name.lower()
+    if name.endswith(".parquet"):
+        return "parquet"
+    if name.endswith((".arrow", ".feather")):
+        return "arrow"
+    return None
+
+
+def iter_columnar_chunks(source, fmt, batch_size=COLUMNAR_BATCH_SIZE):
+    """DataFrame a blocchi da un file Parquet/Arrow, per importer.import_chunks.
+
+    `source` può essere un percorso (il file viene mappato in memoria) o i
+    bytes del file (letti senza copie tramite BufferReader).
+    """
+    _require_pyarrow()
+    reader_source = pa.memory_map(source) if isinstance(source, str) else pa.BufferReader(source)
+    if fmt == "parquet":
+        batches = pq.ParquetFile(reader_source).iter_batches(batch_size=batch_size)
+    else:
+        reader = pa.ipc.open_file(reader_source)
+        batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+
+    offset = 0
+    for batch in batches:
+        chunk = batch.to_pandas()
+        # Indice progressivo come nel CSV, per numerare le righe scartate
+        chunk.index = range(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
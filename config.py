@@ -2,8 +2,25 @@ import configparser
 import os
 
 config = configparser.ConfigParser()
-config_file = os.path.join(os.path.dirname(__file__), "config.ini")
+# EXPENSE_TRACKER_CONFIG permette di usare un altro file (es. nei test)
+config_file = os.environ.get("EXPENSE_TRACKER_CONFIG", os.path.join(os.path.dirname(__file__), "config.ini"))
 config.read(config_file)
 
 TELEGRAM_API_TOKEN = config["TELEGRAM"].get("TELEGRAM_API_TOKEN")
 DATABASE_URL = config["DATABASE"].get("DATABASE_URL")
+
+# Modalità webhook (opzionale): token segreto verificato sull'header
+# X-Telegram-Bot-Api-Secret-Token e backend della coda degli update
+WEBHOOK_SECRET_TOKEN = config.get("WEBHOOK", "SECRET_TOKEN", fallback=None)
+WEBHOOK_QUEUE_BACKEND = config.get("WEBHOOK", "QUEUE_BACKEND", fallback="memory")
+
+# Stato delle conversazioni a più passi: "memory" (singolo processo) oppure
+# "sqlite" (condiviso tra processi e persistente ai riavvii)
+STATE_BACKEND = config.get("STATE", "BACKEND", fallback="memory")
+STATE_TTL = config.getint("STATE", "TTL", fallback=3600)  # secondi
+STATE_MAX_ENTRIES = config.getint("STATE", "MAX_ENTRIES", fallback=10000)
+
+# Registrazione anonimizzata degli update (opzionale, per replay.py): percorso
+# del log (".gz" per comprimerlo) e salt degli pseudonimi di utenti e chat
+RECORD_UPDATES_PATH = config.get("RECORD", "PATH", fallback=None)
+RECORD_UPDATES_SALT = config.get("RECORD", "SALT", fallback=None)
@@ -1,51 +1,273 @@
+import json
 from datetime import datetime
 from collections import defaultdict
 from telebot.types import Message
-from model import SessionLocal, User, Wallet, Expense, SharedExpense
-from sqlalchemy.orm import Session
+from model import SessionLocal, User, Wallet, Expense, SharedExpense, SharedAccess, DailyRollup, MediaFile
+from money import to_minor, from_minor, CURRENCY_DECIMALS, DEFAULT_CURRENCY
+from rollup import rollup_key, new_deltas, add_contribution, apply_deltas, apply_expense, category_label
+from cache import TTLCache
+from sqlalchemy import func, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, make_transient_to_detached
 from typing import Optional, List, Tuple
 
+# Cache in-process delle identità: evitano SELECT (e COMMIT) a ogni update.
+# Dopo un reset del DB vanno svuotate con clear_identity_cache().
+USER_CACHE_SIZE = 10000
+WALLET_CACHE_SIZE = 1000
+IDENTITY_CACHE_TTL = 3600  # secondi
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL)  # telegram_id -> (id, username)
+_wallet_cache = TTLCache(maxsize=WALLET_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL)  # nome -> (id, valuta)
+
+def _attach_cached(session, model, **columns):
+    """Restituisce un'istanza persistente ricostruita dalla cache, senza query al DB"""
+    instance = model(**columns)
+    make_transient_to_detached(instance)
+    return session.merge(instance, load=False)
+
+# Cache dei report: la chiave include la data_version dei proprietari, quindi
+# ogni scrittura rende irraggiungibili le voci vecchie (poi rimosse dall'LRU)
+REPORT_CACHE_SIZE = 512
+REPORT_CACHE_TTL = 24 * 3600  # secondi
+report_cache = TTLCache(maxsize=REPORT_CACHE_SIZE, ttl=REPORT_CACHE_TTL)
+
+def bump_data_version(session, user_ids):
+    """Incrementa la versione dei dati degli utenti (senza commit)"""
+    session.query(User).filter(User.id.in_(list(user_ids))).update(
+        {User.data_version: User.data_version + 1}, synchronize_session=False
+    )
+
+def get_data_versions(session, user_ids) -> Tuple:
+    """Restituisce le versioni dei dati degli utenti, nello stesso ordine degli ID"""
+    versions = dict(session.query(User.id, User.data_version).filter(User.id.in_(list(user_ids))).all())
+    return tuple(versions.get(user_id, 0) for user_id in user_ids)
+
+def cached_report(session, kind, owner_ids, period, builder, currency=None):
+    """Restituisce il report dalla cache o lo calcola con `builder()` e lo memorizza.
+
+    La chiave è (tipo, proprietari, versioni dei dati, periodo, valuta).
+    """
+    owner_ids = tuple(owner_ids)
+    key = (kind, owner_ids, get_data_versions(session, owner_ids), period, currency)
+    value = report_cache.get(key)
+    if value is None:
+        value = builder()
+        report_cache.set(key, value)
+    return value
+
+def clear_identity_cache():
+    """Svuota le cache di utenti e wallet (es. dopo /reset_db), insieme a quelle di report e grafici.
+
+    Dopo un reset le data_version ripartono da 0: senza svuotare la cache dei
+    report le chiavi vecchie tornerebbero valide con i dati precedenti.
+    """
+    from charts import chart_cache
+    _user_cache.clear()
+    _wallet_cache.clear()
+    report_cache.clear()
+    chart_cache.clear()
+
 def get_or_create_user(session, telegram_id, username):
+    cached = _user_cache.get(telegram_id)
+    if cached is not None:
+        user_id, cached_username = cached
+        return _attach_cached(session, User, id=user_id, telegram_id=telegram_id, username=cached_username)
+
     user = session.query(User).filter_by(telegram_id=telegram_id).first()
     if not user:
-        user = User(telegram_id=telegram_id, username=username)
-        session.add(user)
+        # Insert-or-ignore: se un'altra richiesta ha appena creato l'utente non si ha errore
+        session.execute(sqlite_insert(User).values(
+            telegram_id=telegram_id, username=username
+        ).on_conflict_do_nothing(index_elements=["telegram_id"]))
         session.commit()
+        user = session.query(User).filter_by(telegram_id=telegram_id).one()
+    _user_cache.set(telegram_id, (user.id, user.username))
     return user
 
-def create_wallet(session, name, currency="EUR"):
+def create_wallet(session, name, currency="EUR", commit=True):
+    """Wallet con il nome dato, creato se manca.
+
+    Con commit=False il nuovo wallet resta nella transazione in corso (es.
+    inserimenti massivi) e va in cache solo alla prossima ricerca.
+    """
+    cached = _wallet_cache.get(name)
+    if cached is not None:
+        wallet_id, cached_currency = cached
+        return _attach_cached(session, Wallet, id=wallet_id, name=name, currency=cached_currency)
+
     wallet = session.query(Wallet).filter_by(name=name).first()
     if not wallet:
-        wallet = Wallet(name=name, currency=currency)
-        session.add(wallet)
+        session.execute(sqlite_insert(Wallet).values(
+            name=name, currency=currency
+        ).on_conflict_do_nothing(index_elements=["name"]))
+        if not commit:
+            return session.query(Wallet).filter_by(name=name).one()
         session.commit()
+        wallet = session.query(Wallet).filter_by(name=name).one()
+    _wallet_cache.set(name, (wallet.id, wallet.currency))
     return wallet
 
 def create_expense(session, user, wallet, amount, description, location, date, category):
     expense = Expense(
         user_id=user.id,
         wallet_id=wallet.id,
-        amount=amount,
+        amount_minor=to_minor(amount, wallet.currency),
         description=description,
         location=location,
-        date=date,
+        date=date or datetime.utcnow(),
         category=category
     )
     session.add(expense)
+    # Il rollup giornaliero e la versione dei dati vengono aggiornati nella stessa transazione
+    apply_expense(session, expense, wallet.currency)
+    bump_data_version(session, [user.id])
     session.commit()
     return expense
 
+def get_cached_file_ids(session, media_key, user_id) -> Optional[List[str]]:
+    """file_id già inviati per il media, se generati con i dati attuali dell'utente"""
+    row = session.query(MediaFile.file_ids, MediaFile.data_version).filter(
+        MediaFile.media_key == media_key
+    ).first()
+    if row is None or row.data_version != get_data_versions(session, [user_id])[0]:
+        return None
+    return json.loads(row.file_ids)
+
+def store_file_ids(session, media_key, user_id, file_ids):
+    """Salva i file_id di un media e rimuove quelli generati con dati non più attuali"""
+    version = get_data_versions(session, [user_id])[0]
+    stmt = sqlite_insert(MediaFile).values(
+        media_key=media_key, user_id=user_id, data_version=version,
+        file_ids=json.dumps(file_ids), created_at=datetime.utcnow()
+    )
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=["media_key"],
+        set_={column: stmt.excluded[column] for column in ("user_id", "data_version", "file_ids", "created_at")}
+    ))
+    session.query(MediaFile).filter(
+        MediaFile.user_id == user_id, MediaFile.data_version != version
+    ).delete(synchronize_session=False)
+    session.commit()
+
+def forget_file_ids(session, media_key):
+    """Elimina i file_id di un media (es. rifiutati da Telegram)"""
+    session.query(MediaFile).filter(MediaFile.media_key == media_key).delete(synchronize_session=False)
+    session.commit()
+
+# Righe per ogni INSERT multi-riga degli inserimenti massivi
+# (500 righe x 8 colonne restano sotto il limite di 32766 parametri di SQLite)
+BULK_CHUNK_SIZE = 500
+
+def _bulk_row(session, user, record, wallets):
+    """Valida un record e lo converte nella riga da inserire; solleva ValueError se non valido"""
+    wallet = record.get("wallet")
+    if wallet is None:
+        currency = str(record.get("currency") or DEFAULT_CURRENCY).strip().upper()
+        if currency not in CURRENCY_DECIMALS:
+            raise ValueError(f"valuta non supportata: {currency}")
+        if currency not in wallets:
+            # Nessun commit a metà: i blocchi già inseriti restano nella stessa transazione di rollup e versione
+            wallets[currency] = create_wallet(session, f"Principale {currency}", currency, commit=False)
+        wallet = wallets[currency]
+
+    date = record.get("date") or datetime.utcnow()
+    if isinstance(date, str):
+        date = datetime.strptime(date, "%Y-%m-%d")
+    if not isinstance(date, datetime):
+        raise ValueError(f"data non valida: {date}")
+
+    try:
+        if "amount_minor" in record:
+            amount_minor = int(record["amount_minor"])  # Già convertito (es. import vettoriale)
+        else:
+            amount_minor = to_minor(record["amount"], wallet.currency)
+    except KeyError:
+        raise ValueError("importo mancante")
+    except (ArithmeticError, ValueError):
+        raise ValueError(f"importo non valido: {record.get('amount', record.get('amount_minor'))}")
+
+    return {
+        "user_id": user.id,
+        "wallet_id": wallet.id,
+        "amount_minor": amount_minor,
+        "description": record.get("description"),
+        "location": record.get("location"),
+        "date": date,
+        "category": record.get("category"),
+        "fingerprint": record.get("fingerprint"),
+    }, wallet.currency
+
+def _insert_chunk(session, rows):
+    """Inserisce un blocco di righe con un solo INSERT multi-riga e restituisce gli ID nell'ordine dato"""
+    # Un'unica istruzione INSERT ... VALUES (...), (...) RETURNING: con una lista di
+    # parametri (executemany) e sort_by_parameter_order SQLite eseguirebbe un INSERT per riga.
+    # Le righe di una stessa istruzione ricevono ID crescenti, quindi ordinarli
+    # restituisce l'ordine di inserimento (RETURNING non garantisce un ordine).
+    result = session.execute(insert(Expense).values(rows).returning(Expense.id))
+    return sorted(result.scalars())
+
+def create_expenses_bulk(session, user, records, chunk_size=BULK_CHUNK_SIZE):
+    """Inserisce molte transazioni in un'unica transazione DB, a blocchi di INSERT multi-riga.
+
+    `records` è un iterabile di dict con le chiavi amount (o amount_minor già
+    convertito), description, location, date, category, currency (oppure
+    direttamente wallet) e opzionalmente fingerprint. Restituisce la tupla
+    (ids, errors): gli ID inseriti e la lista (indice, messaggio) dei record
+    scartati dalla validazione.
+    """
+    ids = []
+    errors = []
+    wallets = {}
+    deltas = new_deltas()
+    chunk = []
+    for index, record in enumerate(records):
+        try:
+            row, currency = _bulk_row(session, user, record, wallets)
+        except ValueError as e:
+            errors.append((index, str(e)))
+            continue
+        chunk.append(row)
+        add_contribution(deltas, rollup_key(user.id, currency, row["category"], row["date"]), row["amount_minor"])
+        if len(chunk) >= chunk_size:
+            ids.extend(_insert_chunk(session, chunk))
+            chunk = []
+    if chunk:
+        ids.extend(_insert_chunk(session, chunk))
+
+    # Rollup e versione dei dati aggiornati una sola volta, nella stessa transazione
+    if ids:
+        apply_deltas(session, deltas)
+        bump_data_version(session, [user.id])
+    session.commit()
+    return ids, errors
+
 def update_expense(session, expense_id, **kwargs):
     expense = session.query(Expense).filter_by(id=expense_id).first()
     if expense:
+        # Sposta il contributo della spesa dalla vecchia alla nuova riga di rollup
+        deltas = new_deltas()
+        old_currency = expense.wallet.currency
+        old_key = rollup_key(expense.user_id, old_currency, expense.category, expense.date)
+        add_contribution(deltas, old_key, expense.amount_minor, -1)
         for key, value in kwargs.items():
             setattr(expense, key, value)
+        currency = (kwargs.get("wallet") or session.get(Wallet, expense.wallet_id)).currency
+        if currency != old_currency and "amount_minor" not in kwargs:
+            # amount_minor è nella scala della valuta: va riconvertito per il nuovo wallet
+            amount = kwargs["amount"] if "amount" in kwargs else from_minor(expense.amount_minor, old_currency)
+            expense.amount_minor = to_minor(amount, currency)
+        new_key = rollup_key(expense.user_id, currency, expense.category, expense.date)
+        add_contribution(deltas, new_key, expense.amount_minor)
+        apply_deltas(session, deltas)
+        bump_data_version(session, [expense.user_id])
         session.commit()
     return expense
 
 def delete_expense(session, expense_id):
     expense = session.query(Expense).filter_by(id=expense_id).first()
     if expense:
+        apply_expense(session, expense, expense.wallet.currency, direction=-1)
+        bump_data_version(session, [expense.user_id])
         session.delete(expense)
         session.commit()
         return True
@@ -68,44 +290,151 @@ def revoke_share(session, shared_expense_id):
         return True
     return False
 
+def get_shared_owner_ids(session: Session, viewer_id: int) -> List[int]:
+    """Restituisce gli ID degli utenti che hanno condiviso le transazioni con il viewer"""
+    rows = session.query(SharedAccess.owner_id).filter(
+        SharedAccess.viewer_id == viewer_id
+    ).order_by(SharedAccess.id).all()
+    return [owner_id for (owner_id,) in rows]
+
+def get_visible_owner_ids(session: Session, user_id: int) -> List[int]:
+    """Restituisce l'utente seguito dai proprietari che hanno condiviso con lui"""
+    return [user_id] + [oid for oid in get_shared_owner_ids(session, user_id) if oid != user_id]
+
+def generate_owner_reports(session: Session, user_id: int, owner_ids: Optional[List[int]] = None) -> dict:
+    """Calcola i totali dell'utente e di tutti i proprietari che condividono con lui.
+
+    Usa una sola query aggregata sul rollup, partizionata per proprietario, e
+    recupera i nomi dei proprietari in un unico batch. Restituisce un dict
+    ordinato owner_id -> {'owner_name', 'is_own', 'total', 'income', 'expenses',
+    'by_category'} con importi in unità principali.
+    """
+    if owner_ids is None:
+        owner_ids = get_visible_owner_ids(session, user_id)
+
+    rows = session.query(
+        DailyRollup.user_id,
+        DailyRollup.currency,
+        DailyRollup.category,
+        func.sum(DailyRollup.income_minor),
+        func.sum(DailyRollup.expense_minor)
+    ).filter(
+        DailyRollup.user_id.in_(owner_ids)
+    ).group_by(
+        DailyRollup.user_id, DailyRollup.currency, DailyRollup.category
+    ).order_by(DailyRollup.category).all()
+
+    totals = defaultdict(lambda: {'income': 0.0, 'expenses': 0.0, 'by_category': defaultdict(float)})
+    for owner_id, currency, category, income_minor, expenses_minor in rows:
+        data = totals[owner_id]
+        data['income'] += from_minor(income_minor, currency)
+        data['expenses'] += from_minor(expenses_minor, currency)
+        data['by_category'][category_label(category)] += from_minor(income_minor + expenses_minor, currency)
+
+    names = {
+        owner_id: username or telegram_id
+        for owner_id, username, telegram_id in session.query(
+            User.id, User.username, User.telegram_id
+        ).filter(User.id.in_(list(totals.keys()))).all()
+    } if totals else {}
+
+    reports = {}
+    for owner_id in owner_ids:
+        if owner_id not in totals:
+            continue  # Nessuna transazione per questo proprietario
+        data = totals[owner_id]
+        reports[owner_id] = {
+            'owner_name': names.get(owner_id),
+            'is_own': owner_id == user_id,
+            'total': data['income'] + data['expenses'],
+            'income': data['income'],
+            'expenses': data['expenses'],
+            'by_category': data['by_category'],
+        }
+    return reports
+
+def aggregate_period(session: Session, user_id: int, start_date: datetime, end_date: datetime) -> List[Tuple]:
+    """Aggrega il periodo con una sola query GROUP BY sul rollup giornaliero.
+
+    Restituisce tuple (valuta, categoria, mese, entrate, n. entrate, uscite, n. uscite)
+    con gli importi interi in unità minime della valuta.
+    """
+    month_col = func.strftime("%m", DailyRollup.day)
+    return session.query(
+        DailyRollup.currency,
+        DailyRollup.category,
+        month_col,
+        func.sum(DailyRollup.income_minor),
+        func.sum(DailyRollup.income_count),
+        func.sum(DailyRollup.expense_minor),
+        func.sum(DailyRollup.expense_count)
+    ).filter(
+        DailyRollup.user_id == user_id,
+        DailyRollup.day >= start_date.date(),
+        DailyRollup.day < end_date.date()
+    ).group_by(
+        DailyRollup.currency, DailyRollup.category, month_col
+    ).all()
+
+def format_period_report(title: str, rows: List[Tuple], year: int, monthly_trend: bool = False) -> str:
+    """Costruisce il testo Markdown del report a partire dalle righe aggregate.
+
+    Le categorie sono in ordine alfabetico (quelle senza categoria per ultime)
+    e i mesi in ordine di calendario, indipendentemente dall'ordine delle righe.
+    """
+    total_income = 0.0
+    total_expenses = 0.0
+    categories = defaultdict(float)
+    months = defaultdict(float)
+    for currency, category, month, income_minor, _, expenses_minor, _ in rows:
+        # Ogni somma è esatta nella sua valuta e viene convertita una sola volta
+        total_income += from_minor(income_minor, currency)
+        total_expenses += abs(from_minor(expenses_minor, currency))
+        amount = from_minor(income_minor + expenses_minor, currency)
+        categories[category or ""] += amount
+        months[int(month)] += amount
+    categories = {
+        category_label(category): categories[category]
+        for category in sorted(categories, key=lambda category: (not category, category.lower()))
+    }
+    months = {datetime(year, month, 1).strftime("%B"): months[month] for month in sorted(months)}  # Nome del mese
+
+    msg = f"📊 *{title}*\n\n"
+    msg += f"💰 Totale: {total_income - total_expenses:+,.2f}\n"
+    msg += f"📥 Entrate: {total_income:,.2f}\n"
+    msg += f"📤 Uscite: {total_expenses:,.2f}\n\n"
+
+    msg += "*Dettaglio per categoria:*\n"
+    for category, amount in categories.items():
+        emoji = "📈" if amount >= 0 else "📉"
+        msg += f"{emoji} {category}: {amount:+,.2f}\n"
+
+    if monthly_trend:
+        msg += "\n*Andamento mensile:*\n"
+        for month, amount in months.items():
+            emoji = "📈" if amount >= 0 else "📉"
+            msg += f"{emoji} {month}: {amount:+,.2f}\n"
+
+    return msg
+
 def generate_monthly_report(session: Session, user_id: int, year: int, month: int) -> str:
     """Genera un report mensile delle spese"""
     try:
-        # Recupera le transazioni del mese specifico
         start_date = datetime(year, month, 1)
         if month == 12:
             end_date = datetime(year + 1, 1, 1)
         else:
             end_date = datetime(year, month + 1, 1)
 
-        transactions = session.query(Expense).join(Wallet).filter(
-            Expense.user_id == user_id,
-            Expense.date >= start_date,
-            Expense.date < end_date
-        ).all()
-
-        # Prepara il report
-        total_income = sum(tx.amount for tx in transactions if tx.amount > 0)
-        total_expenses = sum(abs(tx.amount) for tx in transactions if tx.amount < 0)
-        
-        # Raggruppa per categoria
-        categories = defaultdict(float)
-        for tx in transactions:
-            categories[tx.category] += tx.amount
-
-        # Genera il messaggio
         month_name = start_date.strftime("%B")
-        msg = f"📊 *Report {month_name} {year}*\n\n"
-        msg += f"💰 Totale: {total_income - total_expenses:+,.2f}\n"
-        msg += f"📥 Entrate: {total_income:,.2f}\n"
-        msg += f"📤 Uscite: {total_expenses:,.2f}\n\n"
-        
-        msg += "*Dettaglio per categoria:*\n"
-        for category, amount in categories.items():
-            emoji = "📈" if amount >= 0 else "📉"
-            msg += f"{emoji} {category}: {amount:+,.2f}\n"
-
-        return msg
+        return cached_report(
+            session, "monthly", [user_id], f"{year}-{month:02d}",
+            lambda: format_period_report(
+                f"Report {month_name} {year}",
+                aggregate_period(session, user_id, start_date, end_date),
+                year
+            )
+        )
 
     except Exception as e:
         return f"⚠️ Errore: {str(e)}"
@@ -113,45 +442,18 @@ def generate_monthly_report(session: Session, user_id: int, year: int, month: in
 def generate_yearly_report(session: Session, user_id: int, year: int) -> str:
     """Genera un report annuale delle spese"""
     try:
-        # Recupera le transazioni dell'anno specifico
         start_date = datetime(year, 1, 1)
         end_date = datetime(year + 1, 1, 1)
 
-        transactions = session.query(Expense).join(Wallet).filter(
-            Expense.user_id == user_id,
-            Expense.date >= start_date,
-            Expense.date < end_date
-        ).all()
-
-        # Prepara il report
-        total_income = sum(tx.amount for tx in transactions if tx.amount > 0)
-        total_expenses = sum(abs(tx.amount) for tx in transactions if tx.amount < 0)
-        
-        # Raggruppa per categoria e per mese
-        categories = defaultdict(float)
-        months = defaultdict(float)
-        for tx in transactions:
-            categories[tx.category] += tx.amount
-            month_key = tx.date.strftime("%B")  # Nome del mese
-            months[month_key] += tx.amount
-
-        # Genera il messaggio
-        msg = f"📊 *Report Anno {year}*\n\n"
-        msg += f"💰 Totale: {total_income - total_expenses:+,.2f}\n"
-        msg += f"📥 Entrate: {total_income:,.2f}\n"
-        msg += f"📤 Uscite: {total_expenses:,.2f}\n\n"
-        
-        msg += "*Dettaglio per categoria:*\n"
-        for category, amount in categories.items():
-            emoji = "📈" if amount >= 0 else "📉"
-            msg += f"{emoji} {category}: {amount:+,.2f}\n"
-            
-        msg += "\n*Andamento mensile:*\n"
-        for month, amount in months.items():
-            emoji = "📈" if amount >= 0 else "📉"
-            msg += f"{emoji} {month}: {amount:+,.2f}\n"
-
-        return msg
+        return cached_report(
+            session, "yearly", [user_id], str(year),
+            lambda: format_period_report(
+                f"Report Anno {year}",
+                aggregate_period(session, user_id, start_date, end_date),
+                year,
+                monthly_trend=True
+            )
+        )
 
     except Exception as e:
         return f"⚠️ Errore: {str(e)}"
@@ -0,0 +1,114 @@
+"""
+Dispatcher degli update su un pool fisso di worker.
+
+Ogni chat è assegnata sempre allo stesso worker (chat_id modulo numero di
+worker), quindi gli update di una chat vengono eseguiti in ordine mentre
+chat diverse procedono in parallelo su worker diversi. Ogni worker ha la
+sua coda: un import CSV lungo blocca solo le chat che condividono quel
+worker, non tutte.
+"""
+import itertools
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DISPATCHER_WORKERS = 16
+
+_STOP = object()
+
+
+class _Worker:
+    """Thread con la propria coda FIFO e i contatori di utilizzo"""
+
+    def __init__(self, index, handle):
+        self.index = index
+        self.handle = handle
+        self.queue = queue.Queue()
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name=f"dispatcher-{index}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                self.queue.task_done()
+                return
+            item, on_done = item
+            start = time.monotonic()
+            try:
+                self.handle(item)
+            except Exception:
+                self.errors += 1
+                logger.exception("Errore nel worker %s", self.index)
+            finally:
+                self.busy_time += time.monotonic() - start
+                self.processed += 1
+                if on_done is not None:
+                    try:
+                        on_done()
+                    except Exception:
+                        logger.exception("Errore nella conferma di un elemento del worker %s", self.index)
+                self.queue.task_done()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "worker": self.index,
+            "queued": self.queue.qsize(),
+            "processed": self.processed,
+            "errors": self.errors,
+            "utilization": self.busy_time / elapsed if elapsed else 0.0,
+        }
+
+
+class ChatDispatcher:
+    """Smista gli elementi ai worker in base alla chiave (chat_id)"""
+
+    def __init__(self, handle, workers=DISPATCHER_WORKERS):
+        self.workers = [_Worker(index, handle) for index in range(workers)]
+        self._round_robin = itertools.count()
+
+    def worker_for(self, key):
+        """Worker assegnato a una chiave; senza chiave si va a rotazione"""
+        if key is None:
+            key = next(self._round_robin)
+        return self.workers[hash(key) % len(self.workers)]
+
+    def submit(self, key, item, on_done=None):
+        """Accoda un elemento senza bloccare; restituisce la profondità della coda del worker.
+
+        `on_done()` viene chiamata dal worker al termine dell'elaborazione,
+        anche se questa è fallita.
+        """
+        worker = self.worker_for(key)
+        worker.queue.put((item, on_done))
+        return worker.queue.qsize()
+
+    def stats(self):
+        """Profondità totale delle code e statistiche per worker"""
+        workers = [worker.stats() for worker in self.workers]
+        return {
+            "queued": sum(worker["queued"] for worker in workers),
+            "processed": sum(worker["processed"] for worker in workers),
+            "workers": workers,
+        }
+
+    def join(self):
+        """Attende che tutte le code siano vuote"""
+        for worker in self.workers:
+            worker.queue.join()
+
+    def shutdown(self, wait=True):
+        """Ferma i worker dopo aver elaborato quanto già in coda"""
+        for worker in self.workers:
+            worker.queue.put(_STOP)
+        if wait:
+            for worker in self.workers:
+                worker.thread.join()
@@ -0,0 +1,108 @@
+"""
+Export in streaming delle transazioni.
+
+Le righe vengono lette a blocchi (yield_per) con una select delle sole
+colonne necessarie e scritte attraverso un compressore (zip o gzip) in file
+temporanei spooled: restano in memoria finché piccoli, poi passano su disco.
+Quando un file si avvicina al limite di upload di Telegram ne viene aperto
+un altro, quindi la memoria usata non dipende dalla lunghezza dello storico.
+"""
+import csv
+import gzip
+import io
+import tempfile
+import zipfile
+from sqlalchemy import select
+from model import Expense, Wallet
+from money import from_minor
+
+EXPORT_HEADER = ["ID", "Data", "Descrizione", "Importo", "Categoria", "Luogo", "Valuta"]
+EXPORT_BATCH_SIZE = 1000  # Righe lette dal DB per blocco
+EXPORT_SPOOL_SIZE = 1024 * 1024  # Oltre questa dimensione il file temporaneo va su disco
+# Limite di upload dei bot: 50 MB. Il margine copre i dati ancora nel buffer del compressore
+EXPORT_PART_MAX_SIZE = 45 * 1024 * 1024
+EXPORT_SIZE_CHECK_ROWS = 1000  # Ogni quante righe si controlla la dimensione del file
+EXPORT_COMPRESSIONS = ("zip", "gzip")
+
+
+def iter_export_rows(session, user_id, batch_size=EXPORT_BATCH_SIZE):
+    """Righe dell'export (già formattate) in ordine di data decrescente, lette a blocchi"""
+    stmt = select(
+        Expense.id,
+        Expense.date,
+        Expense.description,
+        Expense.amount_minor,
+        Expense.category,
+        Expense.location,
+        Wallet.currency
+    ).join(Wallet, Expense.wallet_id == Wallet.id).where(
+        Expense.user_id == user_id
+    ).order_by(Expense.date.desc(), Expense.id.desc()).execution_options(yield_per=batch_size)
+
+    for expense_id, date, description, amount_minor, category, location, currency in session.execute(stmt):
+        yield [
+            expense_id,
+            date.strftime('%Y-%m-%d'),
+            description,
+            from_minor(amount_minor, currency),
+            category,
+            location,
+            currency
+        ]
+
+
+class _Part:
+    """Un file dell'export: file temporaneo, compressore e writer CSV"""
+
+    def __init__(self, compression, csv_name):
+        self.file = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE, mode='w+b')
+        if compression == "zip":
+            self._archive = zipfile.ZipFile(self.file, 'w', compression=zipfile.ZIP_DEFLATED)
+            self._stream = self._archive.open(csv_name, 'w', force_zip64=True)
+        else:
+            self._archive = None
+            self._stream = gzip.GzipFile(filename=csv_name, mode='wb', fileobj=self.file)
+        self._text = io.TextIOWrapper(self._stream, encoding='utf-8', newline='')
+        self.writer = csv.writer(self._text)
+        self.writer.writerow(EXPORT_HEADER)
+
+    def size(self):
+        """Byte compressi scritti finora nel file temporaneo"""
+        return self.file.tell()
+
+    def close(self):
+        """Chiude il compressore e riporta il file temporaneo all'inizio"""
+        self._text.close()  # Chiude anche lo stream compresso
+        if self._archive is not None:
+            self._archive.close()
+        self.file.seek(0)
+        return self.file
+
+
+def export_files(rows, compression="zip", max_size=EXPORT_PART_MAX_SIZE, base_name="transazioni"):
+    """Scrive le righe in uno o più file compressi.
+
+    Restituisce una lista di (nome file, file temporaneo) aperti in lettura
+    dall'inizio; la chiusura dei file è a carico del chiamante.
+    """
+    if compression not in EXPORT_COMPRESSIONS:
+        raise ValueError(f"Compressione non supportata: {compression}")
+    extension = ".zip" if compression == "zip" else ".csv.gz"
+
+    files = []
+    part = None
+    for count, row in enumerate(rows, start=1):
+        if part is None:
+            # Nuovo file aperto solo se ci sono altre righe da scrivere
+            suffix = f"_{len(files) + 1}" if files else ""
+            part = _Part(compression, f"{base_name}{suffix}.csv")
+        part.writer.writerow(row)
+        if count % EXPORT_SIZE_CHECK_ROWS == 0 and part.size() >= max_size:
+            files.append(part.close())
+            part = None
+    if part is not None or not files:
+        files.append((part or _Part(compression, f"{base_name}.csv")).close())
+
+    if len(files) == 1:
+        return [(f"{base_name}{extension}", files[0])]
+    return [(f"{base_name}_{index}{extension}", file) for index, file in enumerate(files, start=1)]
@@ -0,0 +1,458 @@
+"""
+Finto server della Bot API di Telegram per test di carico end-to-end.
+
+Un server HTTP locale risponde ai metodi usati dal bot (getUpdates,
+sendMessage, editMessageText, sendPhoto, sendDocument, sendMediaGroup,
+answerCallbackQuery, getFile e download dei file); install() vi punta
+telebot tramite apihelper.API_URL e FILE_URL, quindi bot.py, outbox e
+runtime girano senza modifiche.
+
+Gli update vengono iniettati a una frequenza scelta e consegnati con
+getUpdates. La latenza end-to-end va dall'iniezione di un update alla prima
+risposta del bot nella stessa chat (o all'answerCallbackQuery della sua
+callback). Si possono simulare risposte lente e 429 (con retry_after) per
+verificare il comportamento dell'outbox sotto pressione.
+
+    python fake_telegram.py --updates 1000 --rate 50 --chats 200 --scenario report
+    python fake_telegram.py --database sqlite:///bench_data/bench_100000_42.db --latency 0.05 --rate-limit-every 20
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from telebot import apihelper
+
+FAKE_BOT_ID = 1000
+UPDATES_LIMIT = 100  # Update massimi per risposta di getUpdates (come Telegram)
+# Metodi a cui si applicano latenza e 429 simulati (tutti quelli che passano dall'outbox)
+SEND_METHODS = {"sendMessage", "editMessageText", "sendPhoto", "sendDocument",
+                "sendMediaGroup", "answerCallbackQuery"}
+
+# Scenari di traffico: testi dei messaggi o, con il prefisso "cb:", dati delle callback
+SCENARIOS = {
+    "report": ["📊 Report"],
+    "list": ["📋 Lista Transazioni"],
+    "menu": ["🏠 Menu Principale", "❓ Aiuto"],
+    "callbacks": ["cb:show_report", "cb:list_transactions"],
+    "mixed": ["📊 Report", "📋 Lista Transazioni", "🏠 Menu Principale", "cb:show_report"],
+}
+
+
+def message_update(update_id, chat_id, text):
+    """Update con un messaggio di testo privato"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"utente {chat_id}"},
+            "text": text,
+        },
+    }
+
+
+def callback_update(update_id, chat_id, data):
+    """Update con la pressione di un bottone inline"""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"utente {chat_id}"},
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+def scripted_updates(chat_ids, actions, count, seed=0, first_update_id=1):
+    """`count` update con chat e azioni scelte a caso (in modo riproducibile)"""
+    rng = random.Random(seed)
+    updates = []
+    for update_id in range(first_update_id, first_update_id + count):
+        chat_id = rng.choice(chat_ids)
+        action = rng.choice(actions)
+        if action.startswith("cb:"):
+            updates.append(callback_update(update_id, chat_id, action[3:]))
+        else:
+            updates.append(message_update(update_id, chat_id, action))
+    return updates
+
+
+def _percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)] if values else 0.0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Niente log per ogni richiesta
+
+    def _reply(self, status, payload, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if not params and body and self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            params = {key: values[-1] for key, values in parse_qs(body.decode("utf-8")).items()}
+
+        parts = url.path.strip("/").split("/")
+        if parts[0] == "file" and len(parts) >= 3:
+            content = self.server.api.files.get("/".join(parts[2:]))
+            if content is None:
+                self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            else:
+                self._reply(200, content, "application/octet-stream")
+            return
+        status, payload = self.server.api.call(parts[-1], params)
+        self._reply(status, payload)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+class FakeBotAPI:
+    """Server locale che imita la Bot API e misura le risposte del bot"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+                 rate_limit_every=0, rate_limit_probability=0.0, retry_after=1, seed=0):
+        self.latency = latency  # Secondi di attesa simulati per ogni invio
+        self.jitter = jitter  # Variazione casuale (0..jitter) aggiunta alla latenza
+        self.rate_limit_every = rate_limit_every  # Un 429 ogni N invii (0 = mai)
+        self.rate_limit_probability = rate_limit_probability  # Probabilità di 429 per invio
+        self.retry_after = retry_after
+        self.files = {}  # file_path -> contenuto, per getFile e download
+        self._rng = random.Random(seed)
+        self._condition = threading.Condition()
+        self._updates = deque()  # Update non ancora confermati dall'offset di getUpdates
+        self._injected_at = {}  # update_id -> istante di iniezione
+        self._pending = {}  # chat_id -> deque di update consegnati senza risposta
+        self._callbacks = {}  # id della callback -> (chat_id, update_id)
+        self._next_message_id = 1
+        self._send_count = 0
+        self.latencies = []
+        self.calls = Counter()
+        self.rate_limited = 0
+        self.extra_responses = 0  # Risposte senza un update in attesa nella chat
+        self.injected = 0
+        self.delivered = 0
+        self.started_at = None
+        self.last_answer_at = None
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+
+    def install(self):
+        """Fa puntare telebot a questo server invece che ad api.telegram.org"""
+        apihelper.API_URL = self.url + "/bot{0}/{1}"
+        apihelper.FILE_URL = self.url + "/file/bot{0}/{1}"
+
+    def close(self):
+        apihelper.API_URL = None
+        apihelper.FILE_URL = None
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_file(self, file_path, content):
+        """Rende scaricabile un file (es. un CSV da importare): file_id = file_path"""
+        self.files[file_path] = content
+
+    # ----------------------- INIEZIONE DEGLI UPDATE ------------------------
+
+    def push(self, update):
+        """Mette un update in coda per il prossimo getUpdates"""
+        with self._condition:
+            if self.started_at is None:
+                self.started_at = time.monotonic()
+            self._injected_at[update["update_id"]] = time.monotonic()
+            self._updates.append(update)
+            self.injected += 1
+            self._condition.notify_all()
+
+    def inject(self, updates, rate):
+        """Inietta gli update in un thread, a `rate` update al secondo; restituisce il thread"""
+        def run():
+            started = time.monotonic()
+            for index, update in enumerate(updates):
+                delay = started + index / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.push(update)
+
+        thread = threading.Thread(target=run, name="fake-telegram-inject", daemon=True)
+        thread.start()
+        return thread
+
+    def wait_answered(self, count, timeout):
+        """Attende che `count` update abbiano avuto risposta; False se scade il timeout"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while len(self.latencies) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    # ----------------------- METODI DELLA BOT API ------------------------
+
+    def call(self, method, params):
+        """Esegue un metodo; restituisce (status HTTP, risposta JSON)"""
+        self.calls[method] += 1
+        if method in SEND_METHODS:
+            fault = self._fault()
+            if fault is not None:
+                return fault
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            return 200, {"ok": True, "result": True}  # Metodi di configurazione (deleteWebhook, ...)
+        return 200, {"ok": True, "result": handler(params)}
+
+    def _fault(self):
+        """Latenza e 429 simulati per un invio"""
+        with self._condition:
+            self._send_count += 1
+            limited = (
+                (self.rate_limit_every and self._send_count % self.rate_limit_every == 0)
+                or self._rng.random() < self.rate_limit_probability
+            )
+            delay = self.latency + (self._rng.random() * self.jitter if self.jitter else 0.0)
+            if limited:
+                self.rate_limited += 1
+        if delay:
+            time.sleep(delay)
+        if limited:
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        return None
+
+    def _api_getMe(self, params):
+        return {"id": FAKE_BOT_ID, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+    def _api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or UPDATES_LIMIT)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            # L'offset conferma gli update precedenti, che non vengono più restituiti
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            while not self._updates and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            batch = list(self._updates)[:limit]
+            for update in batch:
+                if update.get("_delivered"):
+                    continue
+                update["_delivered"] = True
+                self.delivered += 1
+                chat_id, callback_id = self._update_target(update)
+                self._pending.setdefault(chat_id, deque()).append(update["update_id"])
+                if callback_id is not None:
+                    self._callbacks[callback_id] = (chat_id, update["update_id"])
+        return [{key: value for key, value in update.items() if key != "_delivered"} for update in batch]
+
+    @staticmethod
+    def _update_target(update):
+        if "callback_query" in update:
+            query = update["callback_query"]
+            return query["message"]["chat"]["id"], query["id"]
+        return update["message"]["chat"]["id"], None
+
+    def _answer(self, chat_id, update_id=None):
+        """Registra la prima risposta a un update (il più vecchio in attesa nella chat)"""
+        now = time.monotonic()
+        with self._condition:
+            pending = self._pending.get(chat_id)
+            if update_id is not None:
+                if not pending or update_id not in pending:
+                    return  # Update a cui il bot ha già risposto
+                pending.remove(update_id)
+            elif pending:
+                update_id = pending.popleft()
+            else:
+                self.extra_responses += 1
+                return
+            self.latencies.append(now - self._injected_at.pop(update_id))
+            self.last_answer_at = now
+            self._condition.notify_all()
+
+    def _message(self, params, answer=True, **fields):
+        chat_id = int(params.get("chat_id") or 0)
+        if answer:
+            self._answer(chat_id)
+        with self._condition:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        message = {
+            "message_id": int(params.get("message_id") or message_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": FAKE_BOT_ID, "is_bot": True, "first_name": "Fake"},
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        message.update(fields)
+        return message
+
+    def _file(self, prefix):
+        file_id = f"{prefix}-{self._next_message_id}"
+        return {"file_id": file_id, "file_unique_id": file_id}
+
+    def _api_sendMessage(self, params):
+        return self._message(params)
+
+    def _api_editMessageText(self, params):
+        return self._message(params)
+
+    def _api_sendPhoto(self, params):
+        photo = dict(self._file("photo"), width=1280, height=720)
+        return self._message(params, photo=[photo])
+
+    def _api_sendDocument(self, params):
+        return self._message(params, document=self._file("document"))
+
+    def _api_sendMediaGroup(self, params):
+        # Un solo messaggio risponde all'update, gli altri dell'album no
+        messages = []
+        for index, item in enumerate(json.loads(params.get("media") or "[]")):
+            if item.get("type") == "photo":
+                fields = {"photo": [dict(self._file("photo"), width=1280, height=720)]}
+            else:
+                fields = {"document": self._file("document")}
+            messages.append(self._message(params, answer=index == 0, **fields))
+        return messages
+
+    def _api_answerCallbackQuery(self, params):
+        target = self._callbacks.pop(params.get("callback_query_id"), None)
+        if target is not None:
+            self._answer(*target)
+        return True
+
+    def _api_getFile(self, params):
+        file_id = params.get("file_id")
+        return {"file_id": file_id, "file_unique_id": file_id, "file_path": file_id,
+                "file_size": len(self.files.get(file_id, b""))}
+
+    # ----------------------- METRICHE ------------------------
+
+    def stats(self):
+        """Update iniettati, consegnati e con risposta; throughput e latenza end-to-end (secondi)"""
+        with self._condition:
+            latencies = sorted(self.latencies)
+            elapsed = (self.last_answer_at - self.started_at) if self.last_answer_at else 0.0
+            return {
+                "injected": self.injected,
+                "delivered": self.delivered,
+                "answered": len(latencies),
+                "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+                "latency_p50": _percentile(latencies, 0.50),
+                "latency_p95": _percentile(latencies, 0.95),
+                "latency_p99": _percentile(latencies, 0.99),
+                "latency_max": latencies[-1] if latencies else 0.0,
+                "rate_limited": self.rate_limited,
+                "extra_responses": self.extra_responses,
+                "calls": dict(self.calls),
+            }
+
+
+def _chat_ids(count):
+    """ID Telegram degli utenti del DB (se ce ne sono abbastanza) oppure ID sintetici"""
+    from model import SessionLocal, User
+    session = SessionLocal()
+    try:
+        ids = [
+            int(telegram_id) for (telegram_id,) in
+            session.query(User.telegram_id).order_by(User.id).limit(count * 2)
+            if telegram_id.isdigit()
+        ][:count]
+    finally:
+        session.close()
+    return ids if len(ids) == count else list(range(1, count + 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test di carico del bot contro un finto server della Bot API")
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=50, help="Update iniettati al secondo")
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--latency", type=float, default=0.0, help="Secondi di latenza per ogni invio")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Un 429 ogni N invii")
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--database", help="URL SQLAlchemy del DB da usare (es. un dataset di generate_dataset.py)")
+    parser.add_argument("--timeout", type=float, default=300, help="Secondi massimi di attesa delle risposte")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, rate_limit_every=args.rate_limit_every,
+                     rate_limit_probability=args.rate_limit_probability, retry_after=args.retry_after,
+                     seed=args.seed)
+    api.install()
+
+    import asyncio
+    from sqlalchemy import create_engine
+    from model import SessionLocal
+    if args.database:
+        SessionLocal.configure(bind=create_engine(args.database))
+    from bot import bot
+    from runtime import AsyncRuntime
+
+    runtime = AsyncRuntime(bot)
+    loop = asyncio.new_event_loop()
+    polling = loop.create_task(runtime.poll())
+    polling_thread = threading.Thread(target=loop.run_until_complete, args=(asyncio.wait([polling]),),
+                                      name="polling", daemon=True)
+    polling_thread.start()
+
+    updates = scripted_updates(_chat_ids(args.chats), SCENARIOS[args.scenario], args.updates, args.seed)
+    print(f"🔄 {args.updates} update a {args.rate}/s su {args.chats} chat (scenario {args.scenario})...")
+    api.inject(updates, args.rate)
+    completed = api.wait_answered(args.updates, args.timeout)
+
+    stats = api.stats()
+    outbox = runtime.outbox.stats()
+    print(f"{'✅' if completed else '⚠️ Timeout:'} {stats['answered']}/{stats['injected']} update con risposta")
+    print(f"Throughput: {stats['throughput']:.1f} update/s")
+    print(f"Latenza end-to-end: p50 {stats['latency_p50'] * 1000:.0f} ms, p95 {stats['latency_p95'] * 1000:.0f} ms, "
+          f"p99 {stats['latency_p99'] * 1000:.0f} ms, max {stats['latency_max'] * 1000:.0f} ms")
+    print(f"429 simulati: {stats['rate_limited']}, risposte extra: {stats['extra_responses']}")
+    print(f"Outbox: {outbox['sent']} inviati, {outbox['coalesced']} edit uniti, {outbox['rate_limited']} 429, "
+          f"latenza di coda p50 {outbox['latency_p50'] * 1000:.0f} ms p95 {outbox['latency_p95'] * 1000:.0f} ms")
+    print(f"Chiamate: {stats['calls']}")
+    # Prima si ferma il polling e si attendono gli handler, poi il server
+    loop.call_soon_threadsafe(polling.cancel)
+    polling_thread.join()
+    runtime.dispatcher.shutdown()
+    from charts import shutdown
+    shutdown()
+    api.close()
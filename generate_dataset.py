@@ -0,0 +1,246 @@
+"""
+Generatore di dataset sintetici per test di carico e benchmark.
+
+Crea utenti, wallet, transazioni e condivisioni (SharedAccess) realistici:
+l'attività degli utenti segue una distribuzione a coda lunga, gli importi
+dipendono dalla categoria (entrate rare e alte, spese frequenti e piccole)
+e le date coprono l'intervallo richiesto. Il campionamento è vettoriale
+(NumPy) e le righe sono scritte con INSERT multi-riga a blocchi; a parità
+di seed e parametri il dataset è identico, quindi i risultati dei benchmark
+sono confrontabili tra esecuzioni.
+
+Uso da riga di comando:
+
+    python generate_dataset.py --database sqlite:///bench.db --users 5000 --expenses 2000000
+    python generate_dataset.py --database sqlite:///bench.db --reset --seed 7
+
+Senza --database viene usato il DATABASE_URL di config.ini.
+"""
+import argparse
+import datetime
+import time
+import numpy as np
+from sqlalchemy import create_engine, insert, select
+from model import engine as default_engine, User, Wallet, Expense, SharedAccess
+from migrations import run_migrations, reset_schema
+from rollup import rebuild_rollups
+from money import CURRENCY_DECIMALS
+
+DATASET_SEED = 42
+DATASET_USERS = 1000
+DATASET_EXPENSES = 100000
+DATASET_SHARES = 500  # Relazioni SharedAccess (proprietario -> visualizzatore)
+DATASET_DAYS = 730  # Le date coprono gli ultimi N giorni
+DATASET_CHUNK_SIZE = 50000  # Righe campionate per blocco, inserite in un'unica transazione
+DATASET_INSERT_ROWS = 500  # Righe per istruzione INSERT multi-riga (entro il limite di parametri di SQLite)
+SYNTHETIC_TELEGRAM_ID_BASE = 9 * 10 ** 11  # Fuori dal range degli ID Telegram reali
+
+# Categoria -> (peso, mediana in euro, dispersione log-normale, segno)
+CATEGORIES = {
+    "Alimentari": (0.30, 25, 0.8, -1),
+    "Trasporti": (0.15, 20, 0.9, -1),
+    "Shopping": (0.12, 45, 1.0, -1),
+    "Utenze": (0.08, 70, 0.5, -1),
+    "Svago": (0.14, 30, 0.9, -1),
+    "Stipendio": (0.04, 1800, 0.3, 1),
+    "Investimenti": (0.05, 400, 1.1, 1),
+    "Rimborsi": (0.12, 15, 1.0, 1),
+}
+DESCRIPTIONS = {
+    "Alimentari": ["Spesa settimanale", "Pranzo fuori", "Cena ristorante", "Caffè bar"],
+    "Trasporti": ["Benzina", "Biglietto treno", "Taxi", "Manutenzione auto"],
+    "Shopping": ["Vestiti", "Elettronica", "Libri", "Accessori"],
+    "Utenze": ["Bolletta luce", "Gas", "Internet", "Telefono"],
+    "Svago": ["Cinema", "Palestra", "Concerti", "Videogiochi"],
+    "Stipendio": ["Stipendio mensile", "Bonus", "Freelance", "Consulenza"],
+    "Investimenti": ["Azioni", "ETF", "Fondi", "Trading"],
+    "Rimborsi": ["Rimborso spese", "Reso Amazon", "Cashback", "Regalo"],
+}
+LOCATIONS = {
+    "Milano": 0.2, "Roma": 0.15, "Napoli": 0.08, "Torino": 0.08, "Bologna": 0.05,
+    "Online": 0.2, "Amazon": 0.12, "Supermercato": 0.12,
+}
+# Wallet -> (valuta, peso)
+WALLETS = {
+    "Principale EUR": ("EUR", 0.85),
+    "Carta EUR": ("EUR", 0.10),
+    "Principale BTC": ("BTC", 0.03),
+    "Lightning SAT": ("SAT", 0.02),
+}
+BTC_EUR = 60000  # Cambio indicativo usato per convertire gli importi in BTC/SAT
+
+
+def _weights(values):
+    weights = np.asarray(values, dtype=float)
+    return weights / weights.sum()
+
+
+def _get_or_create_wallets(conn):
+    """Nome -> ID dei wallet del dataset (i wallet sono globali, per nome)"""
+    existing = {
+        name: wallet_id
+        for wallet_id, name in conn.execute(
+            select(Wallet.id, Wallet.name).where(Wallet.name.in_(list(WALLETS)))
+        )
+    }
+    missing = [{"name": name, "currency": currency} for name, (currency, _) in WALLETS.items() if name not in existing]
+    if missing:
+        conn.execute(insert(Wallet), missing)
+        return _get_or_create_wallets(conn)
+    return existing
+
+
+def _insert_rows(conn, table, rows):
+    """Scrive le righe con istruzioni INSERT ... VALUES (...), (...) da DATASET_INSERT_ROWS righe"""
+    # Con una lista di parametri (executemany) il driver eseguirebbe un INSERT per riga
+    for start in range(0, len(rows), DATASET_INSERT_ROWS):
+        conn.execute(insert(table).values(rows[start:start + DATASET_INSERT_ROWS]))
+
+
+def _insert_users(conn, count):
+    """Crea gli utenti sintetici e restituisce i loro ID"""
+    first_id = conn.execute(select(User.id).order_by(User.id.desc()).limit(1)).scalar() or 0
+    rows = [
+        {
+            "telegram_id": str(SYNTHETIC_TELEGRAM_ID_BASE + first_id + index),
+            "username": f"utente_{first_id + index}",
+            "data_version": 0,
+        }
+        for index in range(1, count + 1)
+    ]
+    ids = []
+    for start in range(0, len(rows), DATASET_INSERT_ROWS):
+        # Le righe di una stessa istruzione ricevono ID crescenti: ordinati seguono l'ordine di inserimento
+        ids.extend(sorted(conn.execute(
+            insert(User).values(rows[start:start + DATASET_INSERT_ROWS]).returning(User.id)
+        ).scalars()))
+    return np.asarray(ids)
+
+
+def _sample_expenses(rng, size, user_ids, user_weights, wallet_ids, start):
+    """Campiona `size` transazioni come lista di righe pronte per l'INSERT"""
+    names = list(CATEGORIES)
+    params = np.asarray([CATEGORIES[name][1:] for name in names], dtype=float)
+    categories = rng.choice(len(names), size=size, p=_weights([CATEGORIES[name][0] for name in names]))
+    medians, sigmas, signs = params[categories].T
+    amounts_eur = signs * medians * rng.lognormal(0.0, sigmas)
+
+    wallet_names = list(WALLETS)
+    wallets = rng.choice(len(wallet_names), size=size, p=_weights([WALLETS[name][1] for name in wallet_names]))
+    currencies = np.asarray([WALLETS[name][0] for name in wallet_names])[wallets]
+    # Importo nella valuta del wallet, poi in unità minime
+    rates = np.where(currencies == "EUR", 1.0, 1.0 / BTC_EUR)
+    scales = np.asarray([10 ** CURRENCY_DECIMALS[currency] for currency in currencies.tolist()], dtype=float)
+    amounts_minor = np.rint(amounts_eur * rates * scales).astype(np.int64)
+    amounts_minor[amounts_minor == 0] = signs[amounts_minor == 0].astype(np.int64)
+
+    description_table = np.asarray([DESCRIPTIONS[name] for name in names], dtype=object)
+    descriptions = description_table[categories, rng.integers(0, description_table.shape[1], size=size)]
+    locations = np.asarray(list(LOCATIONS), dtype=object)[
+        rng.choice(len(LOCATIONS), size=size, p=_weights(list(LOCATIONS.values())))
+    ]
+    users = user_ids[rng.choice(len(user_ids), size=size, p=user_weights)]
+    dates = (np.datetime64(start, "s") + rng.integers(0, DATASET_DAYS * 86400, size=size).astype("timedelta64[s]"))
+    wallet_id_array = np.asarray([wallet_ids[name] for name in wallet_names])[wallets]
+
+    return [
+        {
+            "user_id": user_id,
+            "wallet_id": wallet_id,
+            "amount_minor": amount_minor,
+            "description": description,
+            "location": location,
+            "date": date,
+            "category": category,
+        }
+        for user_id, wallet_id, amount_minor, description, location, date, category in zip(
+            users.tolist(), wallet_id_array.tolist(), amounts_minor.tolist(), descriptions.tolist(),
+            locations.tolist(), dates.astype("datetime64[us]").tolist(), np.asarray(names)[categories].tolist()
+        )
+    ]
+
+
+def _sample_shares(rng, count, user_ids):
+    """Coppie (proprietario, visualizzatore) distinte, senza auto-condivisioni"""
+    if len(user_ids) < 2 or count <= 0:
+        return []
+    pairs = rng.integers(0, len(user_ids), size=(count * 2, 2))
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    _, first = np.unique(pairs, axis=0, return_index=True)
+    pairs = pairs[np.sort(first)][:count]
+    return [
+        {"owner_id": int(user_ids[owner]), "viewer_id": int(user_ids[viewer])}
+        for owner, viewer in pairs.tolist()
+    ]
+
+
+def generate_dataset(bind=default_engine, users=DATASET_USERS, expenses=DATASET_EXPENSES,
+                     shares=DATASET_SHARES, seed=DATASET_SEED, chunk_size=DATASET_CHUNK_SIZE,
+                     end_date=None, on_progress=None):
+    """Genera il dataset nel DB indicato (schema migrato se necessario).
+
+    `end_date` fissa la fine dell'intervallo delle date (default: oggi a
+    mezzanotte), per avere dataset identici anche in giorni diversi.
+    Restituisce un dict con i conteggi e la durata in secondi.
+    """
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    run_migrations(bind)
+    end_date = end_date or datetime.datetime.combine(datetime.date.today(), datetime.time())
+    start = end_date - datetime.timedelta(days=DATASET_DAYS)
+
+    with bind.begin() as conn:
+        wallet_ids = _get_or_create_wallets(conn)
+        user_ids = _insert_users(conn, users)
+        share_rows = _sample_shares(rng, shares, user_ids)
+        if share_rows:
+            _insert_rows(conn, SharedAccess, share_rows)
+
+    # Attività degli utenti a coda lunga: pochi utenti con molte transazioni
+    user_weights = _weights(rng.pareto(1.2, size=len(user_ids)) + 0.05)
+    written = 0
+    while written < expenses:
+        size = min(chunk_size, expenses - written)
+        rows = _sample_expenses(rng, size, user_ids, user_weights, wallet_ids, start)
+        with bind.begin() as conn:
+            _insert_rows(conn, Expense, rows)
+        written += size
+        if on_progress:
+            on_progress(written, expenses)
+
+    # Rollup calcolato una sola volta alla fine, con un INSERT ... SELECT
+    with bind.begin() as conn:
+        rebuild_rollups(conn)
+
+    return {
+        "users": len(user_ids),
+        "expenses": written,
+        "shares": len(share_rows),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera un dataset sintetico per test di carico e benchmark")
+    parser.add_argument("--database", help="URL SQLAlchemy del DB (default: DATABASE_URL di config.ini)")
+    parser.add_argument("--users", type=int, default=DATASET_USERS)
+    parser.add_argument("--expenses", type=int, default=DATASET_EXPENSES)
+    parser.add_argument("--shares", type=int, default=DATASET_SHARES)
+    parser.add_argument("--seed", type=int, default=DATASET_SEED)
+    parser.add_argument("--end-date", type=datetime.date.fromisoformat,
+                        help="Fine dell'intervallo delle date (AAAA-MM-GG), per dataset riproducibili")
+    parser.add_argument("--reset", action="store_true", help="Svuota il DB prima di generare")
+    args = parser.parse_args()
+
+    bind = create_engine(args.database) if args.database else default_engine
+    if args.reset:
+        reset_schema(bind)
+    end_date = datetime.datetime.combine(args.end_date, datetime.time()) if args.end_date else None
+    stats = generate_dataset(
+        bind, users=args.users, expenses=args.expenses, shares=args.shares, seed=args.seed,
+        end_date=end_date,
+        on_progress=lambda done, total: print(f"\r🔄 Transazioni: {done}/{total}", end="", flush=True)
+    )
+    print(f"\n✅ Generati {stats['users']} utenti, {stats['expenses']} transazioni e "
+          f"{stats['shares']} condivisioni in {stats['seconds']:.1f} s "
+          f"({stats['expenses'] / stats['seconds']:.0f} righe/s)")
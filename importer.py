@@ -0,0 +1,275 @@
+"""
+Import in streaming delle transazioni da CSV.
+
+Il file viene letto a blocchi: ogni blocco è validato e convertito colonna
+per colonna (importo, data, valuta) con operazioni vettoriali di pandas e
+NumPy, poi passato a crud.create_expenses_bulk. Le righe scartate finiscono
+in un report CSV con il motivo dello scarto. La memoria usata dipende dalla
+dimensione del blocco, non da quella del file.
+
+Ogni riga importata riceve un'impronta (utente, data, importo, valuta,
+descrizione e numero di occorrenza tra le righe identiche del file): le
+righe la cui impronta è già nel DB vengono saltate, quindi reimportare lo
+stesso estratto conto non crea duplicati. Prima dell'import l'impronta
+viene calcolata anche per le transazioni inserite a mano, così pure
+reimportare un export Parquet o Arrow non duplica nulla.
+"""
+import csv
+import hashlib
+import io
+import tempfile
+from collections import Counter
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, update
+from crud import create_expenses_bulk
+from model import Expense, Wallet
+from money import CURRENCY_DECIMALS, to_minor
+
+REQUIRED_COLUMNS = ['amount', 'description', 'category', 'date', 'location', 'currency']
+TEXT_COLUMNS = ['description', 'category', 'location']
+IMPORT_CHUNK_SIZE = 10000
+ERROR_REPORT_MAX_MEMORY = 1024 * 1024  # Oltre questa soglia il report degli scarti va su disco
+FINGERPRINT_BATCH_SIZE = 1000  # Transazioni senza impronta elaborate per ogni query
+
+
+class MissingColumnsError(ValueError):
+    """Il file non contiene tutte le colonne richieste"""
+
+    def __init__(self, missing):
+        super().__init__(f"Colonne mancanti: {', '.join(missing)}")
+        self.missing = missing
+
+
+# Distanza da una metà (es. 100.5 centesimi) entro cui il prodotto in virgola
+# mobile non basta a decidere l'arrotondamento e si usa money.to_minor
+HALF_TOLERANCE = 1e-6
+
+
+def amounts_to_minor(amounts, currencies):
+    """Converte in blocco gli importi in unità minime (half-up) come int64, con lo stesso risultato di to_minor"""
+    values = amounts.to_numpy(dtype=np.float64)
+    scales = currencies.map({c: 10 ** d for c, d in CURRENCY_DECIMALS.items()}).to_numpy(dtype=np.float64)
+    scaled = values * scales
+    minor = (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+    # Vicino a una metà l'errore del prodotto decide il verso (-1.005 * 100 = -100.4999...):
+    # queste righe, poche, vengono arrotondate in decimale sul valore scritto
+    fraction = np.abs(scaled) % 1
+    ties = np.flatnonzero(np.abs(fraction - 0.5) <= np.maximum(HALF_TOLERANCE, np.abs(scaled) * 1e-12))
+    if len(ties):
+        currency_values = currencies.to_numpy()
+        minor[ties] = [to_minor(float(values[i]), currency_values[i]) for i in ties]
+    return minor
+
+
+def prepare_chunk(chunk):
+    """Valida e converte un blocco di righe.
+
+    Restituisce (records, rejected): la lista dei record pronti per
+    create_expenses_bulk e il DataFrame delle righe scartate con la colonna
+    'errore'. Ogni record ha anche la chiave 'line' con la riga del file.
+    """
+    amounts = pd.to_numeric(chunk['amount'], errors='coerce')
+    # Gli export colonnari (columnar.py) hanno già l'importo esatto in unità minime
+    minor = pd.to_numeric(chunk['amount_minor'], errors='coerce') if 'amount_minor' in chunk.columns else None
+    dates = chunk['date']
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors='coerce', format='mixed')
+    currencies = chunk['currency'].astype('string').str.strip().str.upper()
+
+    bad_amount = amounts.isna() | ~np.isfinite(amounts.fillna(0))
+    if minor is not None:
+        bad_amount = minor.isna()
+    bad_date = dates.isna()
+    bad_currency = ~currencies.isin(list(CURRENCY_DECIMALS))
+    reasons = np.select(
+        [bad_amount, bad_date, bad_currency],
+        ["importo non valido", "data non valida", "valuta non supportata"],
+        default=""
+    )
+    valid = reasons == ""
+
+    rejected = chunk.loc[~valid].copy()
+    rejected['errore'] = reasons[~valid]
+
+    clean = pd.DataFrame({
+        'amount_minor': (minor[valid].to_numpy(dtype=np.int64) if minor is not None
+                         else amounts_to_minor(amounts[valid], currencies[valid])),
+        'date': pd.DatetimeIndex(dates[valid]).to_pydatetime(),
+        'currency': currencies[valid].to_numpy(dtype=object),
+    }, index=chunk.index[valid])
+    for column in TEXT_COLUMNS:
+        clean[column] = chunk.loc[valid, column].astype(object).fillna("").astype(str).to_numpy(dtype=object)
+    # Riga nel file = indice del DataFrame + 2 (intestazione e base 1)
+    clean['line'] = chunk.index[valid] + 2
+
+    return clean.to_dict('records'), rejected
+
+
+def row_fingerprint(user_id, record, occurrence=0):
+    """Impronta del contenuto di un record importato (hex SHA-1).
+
+    `occurrence` distingue le righe identiche dello stesso file (es. due caffè
+    dello stesso giorno), che vanno importate entrambe.
+    """
+    content = "\x1f".join([
+        str(user_id),
+        record['date'].isoformat(),
+        str(record['amount_minor']),
+        record['currency'],
+        " ".join(str(record['description']).split()).lower(),
+        str(occurrence),
+    ])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def skip_duplicates(session, user_id, records, occurrences):
+    """Assegna le impronte ai record e toglie quelli già importati.
+
+    `occurrences` (Counter) conta le righe identiche già viste nel file e va
+    condiviso tra i blocchi. Una sola query per blocco. Restituisce la
+    lista dei record nuovi e il numero di duplicati saltati.
+    """
+    for record in records:
+        base = row_fingerprint(user_id, record)
+        if occurrences[base]:
+            record['fingerprint'] = row_fingerprint(user_id, record, occurrences[base])
+        else:
+            record['fingerprint'] = base
+        occurrences[base] += 1
+
+    fingerprints = {record['fingerprint'] for record in records}
+    if not fingerprints:
+        return records, 0
+    existing = set(session.execute(
+        select(Expense.fingerprint).where(
+            Expense.user_id == user_id,
+            Expense.fingerprint.in_(fingerprints)
+        )
+    ).scalars())
+    fresh = [record for record in records if record['fingerprint'] not in existing]
+    return fresh, len(records) - len(fresh)
+
+
+def fill_missing_fingerprints(session, user_id, batch_size=FINGERPRINT_BATCH_SIZE):
+    """Calcola l'impronta delle transazioni dell'utente che non ne hanno una (non importate).
+
+    Le righe identiche ricevono numeri di occorrenza non ancora usati, come
+    le righe ripetute di un file. Le righe sono elaborate a blocchi e per
+    ogni blocco si leggono dal DB solo le impronte candidate, non tutte
+    quelle dell'utente. Restituisce il numero di righe aggiornate.
+    """
+    occurrences = Counter()  # Prossima occorrenza da provare per ogni impronta di base
+    total = 0
+    while True:
+        missing = session.execute(
+            select(Expense.id, Expense.date, Expense.amount_minor, Wallet.currency, Expense.description)
+            .join(Wallet, Expense.wallet_id == Wallet.id)
+            .where(Expense.user_id == user_id, Expense.fingerprint.is_(None))
+            .order_by(Expense.id)
+            .limit(batch_size)
+        ).all()
+        if not missing:
+            return total
+
+        rows_by_base = {}
+        samples = {}
+        for expense_id, date, amount_minor, currency, description in missing:
+            # Stessi valori che avrebbe la riga letta da un export (descrizione vuota se mancante)
+            record = {'date': date, 'amount_minor': amount_minor, 'currency': currency,
+                      'description': description or ""}
+            base = row_fingerprint(user_id, record)
+            rows_by_base.setdefault(base, []).append(expense_id)
+            samples[base] = record
+
+        # Le occorrenze già usate nel DB vengono saltate: si riprova con le successive
+        assigned = {base: [] for base in rows_by_base}
+        while True:
+            candidates = {}
+            for base, ids in rows_by_base.items():
+                for _ in range(len(ids) - len(assigned[base])):
+                    occurrence = occurrences[base]
+                    occurrences[base] += 1
+                    fingerprint = row_fingerprint(user_id, samples[base], occurrence) if occurrence else base
+                    candidates[fingerprint] = base
+            if not candidates:
+                break
+            taken = set(session.execute(
+                select(Expense.fingerprint).where(
+                    Expense.user_id == user_id,
+                    Expense.fingerprint.in_(list(candidates))
+                )
+            ).scalars())
+            for fingerprint, base in candidates.items():
+                if fingerprint not in taken:
+                    assigned[base].append(fingerprint)
+
+        updates = [{"id": expense_id, "fingerprint": fingerprint}
+                   for base, ids in rows_by_base.items()
+                   for expense_id, fingerprint in zip(ids, assigned[base])]
+        session.execute(update(Expense), updates)
+        session.commit()
+        total += len(updates)
+
+
+def open_error_report():
+    """Crea il file temporaneo (in memoria finché piccolo) per le righe scartate"""
+    return tempfile.SpooledTemporaryFile(max_size=ERROR_REPORT_MAX_MEMORY, mode='w+b')
+
+
+def import_chunks(session, user, chunks, on_progress=None, error_report=None):
+    """Importa una sequenza di DataFrame, un'unica transazione DB per blocco.
+
+    `on_progress(stats)` viene chiamata dopo ogni blocco; se `error_report` è
+    un file binario vi vengono scritte le righe scartate in formato CSV.
+    Restituisce il dict di statistiche: rows, imported, duplicates, rejected,
+    currencies ed errors (i primi messaggi di errore).
+    """
+    stats = {"rows": 0, "imported": 0, "duplicates": 0, "rejected": 0, "currencies": set(), "errors": []}
+    occurrences = Counter()
+    writer = None
+    fill_missing_fingerprints(session, user.id)
+    text_report = io.TextIOWrapper(error_report, encoding='utf-8', newline='') if error_report else None
+
+    for chunk in chunks:
+        missing = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+        if missing:
+            raise MissingColumnsError(missing)
+
+        records, rejected = prepare_chunk(chunk)
+        stats["currencies"].update(record["currency"] for record in records)
+        records, duplicates = skip_duplicates(session, user.id, records, occurrences)
+        ids, bulk_errors = create_expenses_bulk(session, user, records)
+        stats["rows"] += len(chunk)
+        stats["imported"] += len(ids)
+        stats["duplicates"] += duplicates
+
+        for line, reason in zip(rejected.index, rejected['errore']):
+            if len(stats["errors"]) < 10:
+                stats["errors"].append(f"Riga {line + 2}: {reason}")
+        for index, reason in bulk_errors:
+            if len(stats["errors"]) < 10:
+                stats["errors"].append(f"Riga {records[index]['line']}: {reason}")
+        stats["rejected"] += len(rejected) + len(bulk_errors)
+
+        if text_report is not None and len(rejected):
+            if writer is None:
+                writer = csv.writer(text_report)
+                writer.writerow(['riga'] + list(rejected.columns))
+            for line, row in zip(rejected.index, rejected.astype(object).fillna("").itertuples(index=False)):
+                writer.writerow([line + 2] + list(row))
+
+        if on_progress:
+            on_progress(stats)
+
+    if text_report is not None:
+        text_report.flush()
+        text_report.detach()  # Lascia aperto il file binario sottostante
+        error_report.seek(0)
+    return stats
+
+
+def import_csv(session, user, fileobj, chunksize=IMPORT_CHUNK_SIZE, on_progress=None, error_report=None):
+    """Importa un CSV leggendolo a blocchi di `chunksize` righe"""
+    chunks = pd.read_csv(fileobj, chunksize=chunksize, dtype=str, skipinitialspace=True)
+    return import_chunks(session, user, chunks, on_progress, error_report)
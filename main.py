@@ -1,6 +1,48 @@
+import asyncio
+import sys
+import threading
 
-from bot import bot
+WEBAPP_PORT = 5000
+
+def make_recorder():
+    """Registratore degli update se configurato nella sezione [RECORD] di config.ini"""
+    from config import RECORD_UPDATES_PATH, RECORD_UPDATES_SALT
+    if not RECORD_UPDATES_PATH:
+        return None
+    from bot import NAVIGATION_BUTTONS
+    from update_log import UpdateRecorder
+    print(f"Registrazione degli update in {RECORD_UPDATES_PATH}")
+    return UpdateRecorder(RECORD_UPDATES_PATH, RECORD_UPDATES_SALT, keep_texts=NAVIGATION_BUTTONS)
+
+def start_webhook(bot, webhook_url, recorder=None):
+    """Avvia la webapp Flask (dashboard e ricevitore del webhook) nello stesso processo"""
+    import webapp
+    from config import WEBHOOK_SECRET_TOKEN, WEBHOOK_QUEUE_BACKEND
+    from runtime import run_webhook
+    from update_queue import make_update_queue
+    webapp.update_queue = make_update_queue(WEBHOOK_QUEUE_BACKEND)
+    threading.Thread(
+        target=webapp.app.run,
+        kwargs={"port": WEBAPP_PORT, "use_reloader": False},
+        daemon=True
+    ).start()
+    return run_webhook(bot, webapp.update_queue, webhook_url, WEBHOOK_SECRET_TOKEN, recorder=recorder)
 
 if __name__ == "__main__":
+    # Import qui: i processi del pool dei grafici (spawn) rieseguono questo
+    # modulo e non devono caricare il bot
+    from bot import bot, NGROK_URL
+    from runtime import run_polling
+
+    recorder = make_recorder()
     print("Bot in esecuzione...")
-    bot.infinity_polling()
+    try:
+        if "--webhook" in sys.argv:
+            asyncio.run(start_webhook(bot, f"{NGROK_URL}/telegram/webhook", recorder))
+        else:
+            asyncio.run(run_polling(bot, recorder=recorder))
+    except KeyboardInterrupt:
+        print("Bot arrestato")
+    finally:
+        if recorder is not None:
+            recorder.close()
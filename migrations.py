@@ -0,0 +1,194 @@
+"""
+Gestione delle migrazioni dello schema del database.
+
+Ogni migrazione ha un numero di versione crescente e viene applicata una sola
+volta, dentro una transazione. La versione corrente è salvata nella tabella
+`schema_version`, così i file SQLite esistenti vengono aggiornati senza
+perdere dati.
+
+Uso da riga di comando:
+
+    python migrations.py          # applica le migrazioni mancanti
+    python migrations.py --status # mostra la versione corrente
+"""
+import datetime
+import sys
+from sqlalchemy import inspect, text
+from model import engine, Base, User, Wallet, Expense, SharedExpense, SharedAccess, DailyRollup, PendingUpdate, ConversationState, MediaFile
+from rollup import rebuild_rollups
+from money import CURRENCY_DECIMALS, DEFAULT_CURRENCY
+
+# Elenco ordinato di (versione, descrizione, funzione)
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Registra una funzione come migrazione con la versione indicata"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR, "
+        "applied_at DATETIME)"
+    ))
+
+
+def get_schema_version(conn) -> int:
+    """Restituisce l'ultima versione applicata (0 se il DB non è versionato)"""
+    _ensure_version_table(conn)
+    version = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+
+def _has_column(conn, table, column):
+    return column in {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def _add_column(conn, table, column_ddl):
+    """Aggiunge una colonna se non esiste già (ALTER TABLE idempotente)"""
+    column = column_ddl.split()[0]
+    if not _has_column(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column_ddl}"))
+
+
+def _analyze(conn):
+    """Aggiorna le statistiche usate dal query planner di SQLite"""
+    if conn.dialect.name == "sqlite":
+        conn.execute(text("ANALYZE"))
+
+
+# ----------------------- MIGRAZIONI ------------------------
+
+@migration(1, "Schema iniziale")
+def _initial_schema(conn):
+    # Su un DB già creato con create_all le tabelle esistono e non vengono toccate
+    Base.metadata.create_all(bind=conn, tables=[
+        User.__table__,
+        Wallet.__table__,
+        Expense.__table__,
+        SharedExpense.__table__,
+        SharedAccess.__table__,
+    ])
+
+
+@migration(2, "Indici composti su expenses (user_id, date) e (user_id, category, date)")
+def _expense_composite_indexes(conn):
+    for index in Expense.__table__.indexes:
+        if index.name in ("ix_expenses_user_date", "ix_expenses_user_category_date"):
+            index.create(bind=conn, checkfirst=True)
+    _analyze(conn)
+
+
+@migration(3, "Importi in unità minime intere (amount_minor) al posto di amount float")
+def _amount_minor_units(conn):
+    _add_column(conn, "expenses", "amount_minor BIGINT NOT NULL DEFAULT 0")
+    if not _has_column(conn, "expenses", "amount"):
+        return
+
+    # Converte i vecchi importi float nella scala della valuta del wallet
+    scales = " ".join(
+        f"WHEN '{currency}' THEN {10 ** decimals}"
+        for currency, decimals in CURRENCY_DECIMALS.items()
+    )
+    default_scale = 10 ** CURRENCY_DECIMALS[DEFAULT_CURRENCY]
+    conn.execute(text(
+        "UPDATE expenses SET amount_minor = CAST(ROUND(amount * "
+        f"(CASE (SELECT currency FROM wallets WHERE wallets.id = expenses.wallet_id) "
+        f"{scales} ELSE {default_scale} END)) AS INTEGER) "
+        "WHERE amount IS NOT NULL"
+    ))
+
+    # SQLite supporta DROP COLUMN dalla 3.35; sulle versioni precedenti
+    # la vecchia colonna resta nel file ma non è più mappata dal modello
+    if conn.dialect.name != "sqlite" or conn.dialect.dbapi.sqlite_version_info >= (3, 35):
+        conn.execute(text("ALTER TABLE expenses DROP COLUMN amount"))
+
+
+@migration(4, "Tabella daily_rollups con i totali giornalieri per utente, valuta e categoria")
+def _daily_rollups(conn):
+    DailyRollup.__table__.create(bind=conn, checkfirst=True)
+    rebuild_rollups(conn)
+    _analyze(conn)
+
+
+@migration(5, "Versione dei dati per utente (users.data_version) per invalidare le cache")
+def _user_data_version(conn):
+    _add_column(conn, "users", "data_version INTEGER NOT NULL DEFAULT 0")
+
+
+@migration(6, "Impronta delle transazioni importate (expenses.fingerprint) per evitare duplicati")
+def _expense_fingerprint(conn):
+    _add_column(conn, "expenses", "fingerprint VARCHAR(40)")
+    for index in Expense.__table__.indexes:
+        if index.name == "ix_expenses_user_fingerprint":
+            index.create(bind=conn, checkfirst=True)
+
+
+@migration(7, "Tabella pending_updates per la coda degli update ricevuti via webhook")
+def _pending_updates(conn):
+    PendingUpdate.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(8, "Tabella conversation_state per lo stato delle conversazioni con scadenza")
+def _conversation_state(conn):
+    ConversationState.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(9, "Tabella media_files con i file_id Telegram dei media generati")
+def _media_files(conn):
+    MediaFile.__table__.create(bind=conn, checkfirst=True)
+
+
+# ----------------------- ESECUZIONE ------------------------
+
+def run_migrations(bind=engine, verbose=False):
+    """Applica in ordine le migrazioni non ancora eseguite.
+
+    Restituisce la lista delle versioni applicate.
+    """
+    with bind.begin() as conn:
+        current = get_schema_version(conn)
+
+    applied = []
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        with bind.begin() as conn:
+            func(conn)
+            conn.execute(
+                text("INSERT INTO schema_version (version, description, applied_at) "
+                     "VALUES (:version, :description, :applied_at)"),
+                {"version": version, "description": description,
+                 "applied_at": datetime.datetime.utcnow()}
+            )
+        if verbose:
+            print(f"✅ Migrazione {version} applicata: {description}")
+        applied.append(version)
+    return applied
+
+
+def reset_schema(bind=engine):
+    """Elimina tutte le tabelle e ricrea lo schema all'ultima versione"""
+    Base.metadata.drop_all(bind=bind)
+    with bind.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS schema_version"))
+    run_migrations(bind)
+
+
+if __name__ == "__main__":
+    if "--status" in sys.argv:
+        with engine.begin() as conn:
+            current = get_schema_version(conn)
+        latest = MIGRATIONS[-1][0] if MIGRATIONS else 0
+        print(f"Versione schema: {current} (ultima disponibile: {latest})")
+    else:
+        applied = run_migrations(verbose=True)
+        if not applied:
+            print("Lo schema è già aggiornato.")
@@ -2,9 +2,10 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import DATABASE_URL
+from money import to_minor, from_minor
 
 import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Enum, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Text, LargeBinary, Date, DateTime, ForeignKey, Enum, Boolean, Index
 from sqlalchemy.orm import relationship
 engine = create_engine(DATABASE_URL, echo=False)
 SessionLocal = sessionmaker(bind=engine)
@@ -16,6 +17,7 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     telegram_id = Column(String, unique=True, index=True)
     username = Column(String)
+    data_version = Column(Integer, nullable=False, default=0)  # Incrementata a ogni modifica delle transazioni
     expenses = relationship("Expense", back_populates="user")
     shared_expenses = relationship("SharedExpense", back_populates="shared_with")
 
@@ -31,15 +33,32 @@ class Expense(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     wallet_id = Column(Integer, ForeignKey("wallets.id"))
-    amount = Column(Float)  # Importo della spesa/entrata
+    amount_minor = Column(BigInteger, nullable=False, default=0)  # Importo in unità minime della valuta del wallet
     description = Column(String)
     location = Column(String)
     date = Column(DateTime, default=datetime.datetime.utcnow)
     category = Column(String)  # Es. "alimentari", "trasporti", ecc.
+    fingerprint = Column(String(40))  # Impronta del contenuto per le transazioni importate (vedi importer.py)
     user = relationship("User", back_populates="expenses")
     wallet = relationship("Wallet", back_populates="expenses")
     shared = relationship("SharedExpense", back_populates="expense")
 
+    @property
+    def amount(self):
+        """Importo della spesa/entrata in unità principali (es. euro)"""
+        return from_minor(self.amount_minor, self.wallet.currency if self.wallet else None)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_minor = to_minor(value, self.wallet.currency if self.wallet else None)
+
+    # Indici composti per le query più frequenti (liste, report e dashboard)
+    __table_args__ = (
+        Index("ix_expenses_user_date", "user_id", "date"),
+        Index("ix_expenses_user_category_date", "user_id", "category", "date"),
+        Index("ix_expenses_user_fingerprint", "user_id", "fingerprint"),
+    )
+
 class SharedExpense(Base):
     __tablename__ = "shared_expenses"
     id = Column(Integer, primary_key=True, index=True)
@@ -59,3 +78,44 @@ class SharedAccess(Base):
     
     owner = relationship("User", foreign_keys=[owner_id])
     viewer = relationship("User", foreign_keys=[viewer_id])
+
+class DailyRollup(Base):
+    """Totali giornalieri per utente, valuta e categoria, aggiornati a ogni scrittura"""
+    __tablename__ = "daily_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    currency = Column(String, primary_key=True)
+    category = Column(String, primary_key=True)  # "" per le transazioni senza categoria
+    day = Column(Date, primary_key=True)
+    income_minor = Column(BigInteger, nullable=False, default=0)  # Somma degli importi >= 0
+    income_count = Column(Integer, nullable=False, default=0)
+    expense_minor = Column(BigInteger, nullable=False, default=0)  # Somma degli importi < 0
+    expense_count = Column(Integer, nullable=False, default=0)
+
+class PendingUpdate(Base):
+    """Update Telegram ricevuti via webhook e non ancora elaborati (coda su SQLite)"""
+    __tablename__ = "pending_updates"
+
+    id = Column(Integer, primary_key=True)
+    update_id = Column(BigInteger, unique=True, nullable=False)  # Telegram può ripetere lo stesso update
+    payload = Column(Text, nullable=False)  # JSON dell'update così come ricevuto
+    received_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class ConversationState(Base):
+    """Stato delle conversazioni a più passi (vedi state_store.py), condiviso tra processi"""
+    __tablename__ = "conversation_state"
+
+    key = Column(String, primary_key=True)  # Es. "expense:<chat_id>", "next_step:<chat_id>"
+    value = Column(LargeBinary, nullable=False)  # Valore serializzato con pickle
+    expires_at = Column(DateTime, index=True)  # NULL = nessuna scadenza
+    accessed_at = Column(DateTime, nullable=False, index=True)  # Per l'eviction LRU
+
+class MediaFile(Base):
+    """file_id restituiti da Telegram per i media generati, per reinviarli senza upload"""
+    __tablename__ = "media_files"
+
+    media_key = Column(String, primary_key=True)  # Hash dei dati da cui è generato il media
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    data_version = Column(Integer, nullable=False)  # users.data_version al momento dell'invio
+    file_ids = Column(Text, nullable=False)  # Lista JSON dei file_id (es. più grafici)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,33 @@
+"""
+Conversione degli importi tra unità principali (es. euro) e unità minime
+intere (es. centesimi). Nel DB gli importi sono salvati come interi nella
+scala della valuta del wallet, così somme e confronti sono esatti.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+# Cifre decimali per valuta: EUR in centesimi, BTC in satoshi, SAT già interi
+CURRENCY_DECIMALS = {
+    "EUR": 2,
+    "BTC": 8,
+    "SAT": 0,
+}
+DEFAULT_CURRENCY = "EUR"
+
+
+def currency_scale(currency) -> int:
+    """Restituisce il fattore di scala (10^decimali) della valuta"""
+    decimals = CURRENCY_DECIMALS.get(currency or DEFAULT_CURRENCY, CURRENCY_DECIMALS[DEFAULT_CURRENCY])
+    return 10 ** decimals
+
+
+def to_minor(amount, currency) -> int:
+    """Converte un importo in unità principali nell'intero in unità minime"""
+    scaled = Decimal(str(amount)) * currency_scale(currency)
+    return int(scaled.to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_minor(amount_minor, currency) -> float:
+    """Converte un intero in unità minime nell'importo in unità principali"""
+    if amount_minor is None:
+        return 0.0
+    return amount_minor / currency_scale(currency)
@@ -0,0 +1,285 @@
+"""
+Coda unica delle richieste in uscita verso la Bot API.
+
+Si aggancia a telebot tramite apihelper.CUSTOM_REQUEST_SENDER, quindi gli
+handler continuano a chiamare bot.send_message, edit_message_text,
+send_photo... e ricevono il risultato come prima. Nel frattempo l'outbox:
+
+- rispetta un budget globale e uno per chat (token bucket);
+- in caso di 429 attende il retry_after indicato da Telegram e riprova;
+- unisce più edit_message_text in coda sullo stesso messaggio nell'ultimo;
+- invia in parallelo messaggi di chat diverse, in ordine quelli della stessa chat;
+- misura la latenza di coda (tempo tra accodamento e invio).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+import requests
+from telebot import apihelper
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE = 30  # richieste al secondo verso la Bot API
+GLOBAL_BURST = 30
+CHAT_RATE = 1  # messaggi al secondo per chat
+CHAT_BURST = 3
+SENDER_THREADS = 8
+MAX_RETRIES = 5  # tentativi dopo un 429 prima di restituire l'errore
+LATENCY_SAMPLES = 1000
+BUCKET_SWEEP_INTERVAL = 60  # secondi tra due rimozioni dei bucket per chat inattivi
+
+# Metodi che non passano dalla coda (long polling, configurazione, download)
+BYPASS_METHODS = {"getUpdates", "getMe", "getFile", "setWebhook", "deleteWebhook", "getWebhookInfo"}
+COALESCED_METHODS = {"editMessageText"}
+
+
+class TokenBucket:
+    """Budget di `rate` richieste al secondo con picchi fino a `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now):
+        """Secondi da attendere prima di poter spendere un token (0 se subito)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def is_idle(self, now):
+        """Pieno e non sospeso: ricrearlo da zero non cambierebbe nulla"""
+        return self.wait_time(now) == 0.0 and self.tokens >= self.capacity
+
+    def block(self, seconds):
+        """Sospende il bucket (es. dopo un 429 con retry_after)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+def _file_object(value):
+    """Oggetto file di un valore di `files`: il file stesso o la tupla (nome, file[, tipo[, header]])"""
+    if isinstance(value, (tuple, list)) and len(value) >= 2:
+        value = value[1]
+    return value if hasattr(value, "seek") else None
+
+
+class _Job:
+    def __init__(self, method_name, chat_id, args, kwargs, future, edit_key=None):
+        self.method_name = method_name
+        self.chat_id = chat_id
+        self.edit_key = edit_key  # (chat_id, message_id) per gli edit unificabili
+        self.args = args
+        self.kwargs = kwargs
+        self.futures = [future]  # Più chiamanti se altri edit sono stati uniti a questo
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        # telebot passa i file come tuple (nome, file): la posizione è quella dell'oggetto file
+        self.file_positions = {
+            key: _file_object(value).tell() for key, value in (kwargs.get("files") or {}).items()
+            if _file_object(value) is not None
+        }
+
+    def rewind_files(self):
+        """Riporta i file alla posizione iniziale prima di un nuovo tentativo"""
+        files = self.kwargs.get("files") or {}
+        for key, position in self.file_positions.items():
+            _file_object(files[key]).seek(position)
+
+
+def _retry_after(response):
+    try:
+        return float(response.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return 1.0
+
+
+class Outbox:
+    """Scheduler delle richieste in uscita con budget globale e per chat"""
+
+    def __init__(self, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                 chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, workers=SENDER_THREADS):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._chat_buckets = {}  # Solo le chat attive: quelli inattivi e pieni vengono rimossi
+        self._swept_at = time.monotonic()
+        self._queues = OrderedDict()  # chat_id -> deque di job (None = senza chat)
+        self._busy_chats = set()  # chat con un invio in corso (l'ordine va mantenuto)
+        self._pending_edits = {}  # (chat_id, message_id) -> job non ancora inviato
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self._threads = [
+            threading.Thread(target=self._run, name=f"outbox-{index}", daemon=True)
+            for index in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def install(self):
+        """Fa passare da questa coda tutte le richieste di telebot"""
+        apihelper.CUSTOM_REQUEST_SENDER = self.request
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _send(self, method, url, **kwargs):
+        return self._session().request(method, url, **kwargs)
+
+    # ----------------------- ACCODAMENTO ------------------------
+
+    def request(self, method, url, **kwargs):
+        """Punto d'ingresso compatibile con apihelper.CUSTOM_REQUEST_SENDER"""
+        method_name = url.rsplit("/", 1)[-1]
+        if method_name in BYPASS_METHODS:
+            return self._send(method, url, **kwargs)
+
+        params = kwargs.get("params") or {}
+        chat_id = params.get("chat_id")
+        future = Future()
+        with self._condition:
+            edit_key = None
+            if method_name in COALESCED_METHODS and "message_id" in params:
+                edit_key = (chat_id, params["message_id"])
+            pending = self._pending_edits.get(edit_key) if edit_key is not None else None
+            if pending is not None:
+                # Un edit più recente sostituisce quello ancora in coda
+                pending.args = (method, url)
+                pending.kwargs = kwargs
+                pending.futures.append(future)
+                self.coalesced += 1
+            else:
+                job = _Job(method_name, chat_id, (method, url), kwargs, future, edit_key)
+                if edit_key is not None:
+                    self._pending_edits[edit_key] = job
+                self._queues.setdefault(chat_id, deque()).append(job)
+                self._condition.notify()
+        return future.result()
+
+    # ----------------------- INVIO ------------------------
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _sweep_buckets(self, now):
+        """Rimuove i bucket delle chat senza job in coda o in invio, già pieni e non sospesi"""
+        self._swept_at = now
+        for chat_id in [
+            chat_id for chat_id, bucket in self._chat_buckets.items()
+            if chat_id not in self._queues and chat_id not in self._busy_chats and bucket.is_idle(now)
+        ]:
+            del self._chat_buckets[chat_id]
+
+    def _next_job(self):
+        """Sceglie il primo job inviabile; restituisce (job, None) o (None, secondi di attesa)"""
+        now = time.monotonic()
+        if now - self._swept_at >= BUCKET_SWEEP_INTERVAL:
+            self._sweep_buckets(now)
+        wait = None
+        global_wait = self.global_bucket.wait_time(now)
+        for chat_id, jobs in self._queues.items():
+            if chat_id is not None and chat_id in self._busy_chats:
+                continue
+            chat_wait = self._chat_bucket(chat_id).wait_time(now) if chat_id is not None else 0.0
+            job_wait = max(global_wait, chat_wait)
+            if job_wait > 0:
+                wait = job_wait if wait is None else min(wait, job_wait)
+                continue
+            job = jobs.popleft()
+            if not jobs:
+                del self._queues[chat_id]
+            else:
+                self._queues.move_to_end(chat_id)  # Rotazione equa tra le chat
+            self.global_bucket.consume()
+            if chat_id is not None:
+                self._chat_bucket(chat_id).consume()
+                self._busy_chats.add(chat_id)
+            if job.edit_key is not None:
+                self._pending_edits.pop(job.edit_key, None)
+            return job, None
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._condition:
+                job, wait = self._next_job()
+                while job is None:
+                    self._condition.wait(wait)
+                    job, wait = self._next_job()
+            self._execute(job)
+
+    def _execute(self, job):
+        if job.attempts == 0:
+            self.latencies.append(time.monotonic() - job.enqueued_at)
+        job.attempts += 1
+        try:
+            response = self._send(*job.args, **job.kwargs)
+        except Exception as e:
+            self._finish(job, exception=e)
+            return
+
+        if response.status_code == 429 and job.attempts <= MAX_RETRIES:
+            retry_after = _retry_after(response)
+            self.rate_limited += 1
+            logger.warning("429 su %s (chat %s), nuovo tentativo tra %s s",
+                           job.method_name, job.chat_id, retry_after)
+            with self._condition:
+                bucket = self._chat_bucket(job.chat_id) if job.chat_id is not None else self.global_bucket
+                bucket.block(retry_after)
+                job.rewind_files()
+                self._queues.setdefault(job.chat_id, deque()).appendleft(job)
+                self._queues.move_to_end(job.chat_id, last=False)
+                self._busy_chats.discard(job.chat_id)
+                self._condition.notify_all()
+            return
+        self._finish(job, response=response)
+
+    def _finish(self, job, response=None, exception=None):
+        with self._condition:
+            self.sent += 1
+            self._busy_chats.discard(job.chat_id)
+            self._condition.notify_all()
+        for future in job.futures:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(response)
+
+    # ----------------------- METRICHE ------------------------
+
+    def stats(self):
+        """Richieste in coda, inviate, unite, 429 ricevuti e latenza di coda (secondi)"""
+        with self._condition:
+            queued = sum(len(jobs) for jobs in self._queues.values())
+            latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)] if latencies else 0.0
+
+        return {
+            "queued": queued,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+            "latency_p50": percentile(0.50),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
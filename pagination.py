@@ -0,0 +1,93 @@
+"""
+Paginazione a cursore (keyset) per le liste di transazioni.
+
+Invece di OFFSET, ogni pagina parte dalla chiave (date, id) dell'ultima o
+della prima transazione mostrata, così la pagina N costa quanto la prima.
+Il cursore è codificato in modo compatto per stare nel callback_data di
+Telegram (max 64 byte): "<direzione>.<offset>.<timestamp>.<id>" in base 36.
+"""
+import datetime
+from sqlalchemy import and_, or_
+from model import Expense
+
+EPOCH = datetime.datetime(1970, 1, 1)
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _to_base36(number: int) -> str:
+    if number < 0:
+        return "-" + _to_base36(-number)
+    if number == 0:
+        return "0"
+    digits = []
+    while number:
+        number, rem = divmod(number, 36)
+        digits.append(DIGITS[rem])
+    return "".join(reversed(digits))
+
+
+def encode_cursor(direction: str, offset: int, date: datetime.datetime, expense_id: int) -> str:
+    """Codifica il cursore: direction è "n" (successive) o "p" (precedenti)"""
+    micros = (date - EPOCH) // datetime.timedelta(microseconds=1)
+    return f"{direction}.{_to_base36(offset)}.{_to_base36(micros)}.{_to_base36(expense_id)}"
+
+
+def decode_cursor(cursor):
+    """Decodifica il cursore; restituisce None se assente o non valido (prima pagina)"""
+    try:
+        direction, offset, micros, expense_id = cursor.split(".")
+        if direction not in ("n", "p"):
+            return None
+        date = EPOCH + datetime.timedelta(microseconds=int(micros, 36))
+        return direction, int(offset, 36), date, int(expense_id, 36)
+    except (AttributeError, ValueError):
+        return None
+
+
+def fetch_page(query, cursor=None, limit=5):
+    """Restituisce una pagina di transazioni ordinate per data decrescente.
+
+    `query` è una Query su Expense già filtrata (es. per proprietario).
+    Restituisce un dict con le chiavi: items, offset, has_prev, has_next,
+    prev_cursor e next_cursor.
+    """
+    decoded = decode_cursor(cursor)
+    if decoded is None:
+        direction, offset = "n", 0
+        rows = query.order_by(Expense.date.desc(), Expense.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        items = rows[:limit]
+        has_prev, has_next = False, has_more
+    else:
+        direction, offset, date, expense_id = decoded
+        if direction == "n":
+            # Transazioni più vecchie della chiave (date, id)
+            rows = query.filter(or_(
+                Expense.date < date,
+                and_(Expense.date == date, Expense.id < expense_id)
+            )).order_by(Expense.date.desc(), Expense.id.desc()).limit(limit + 1).all()
+            items = rows[:limit]
+            has_prev, has_next = True, len(rows) > limit
+        else:
+            # Transazioni più recenti della chiave, lette in ordine crescente e poi invertite
+            rows = query.filter(or_(
+                Expense.date > date,
+                and_(Expense.date == date, Expense.id > expense_id)
+            )).order_by(Expense.date.asc(), Expense.id.asc()).limit(limit + 1).all()
+            items = list(reversed(rows[:limit]))
+            offset = max(offset - len(items), 0)
+            has_prev, has_next = len(rows) > limit, True
+
+    page = {
+        "items": items,
+        "offset": offset,
+        "has_prev": has_prev and bool(items),
+        "has_next": has_next and bool(items),
+        "prev_cursor": None,
+        "next_cursor": None,
+    }
+    if items:
+        first, last = items[0], items[-1]
+        page["prev_cursor"] = encode_cursor("p", offset, first.date, first.id)
+        page["next_cursor"] = encode_cursor("n", offset + len(items), last.date, last.id)
+    return page
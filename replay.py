@@ -0,0 +1,248 @@
+"""
+Replay di un log di update (update_log.py) sugli handler del bot.
+
+Gli update vengono riproposti con i tempi registrati (--speed 1), N volte
+più veloci (--speed N) o senza pause (--speed 0), sul dispatcher per chat
+come in produzione. Il bot lavora su una copia del DB indicato (lo
+snapshot non viene modificato) e le chiamate alla Bot API vanno al finto
+server di fake_telegram.py.
+
+Per ogni handler si misurano il tempo di esecuzione e la latenza
+end-to-end (dall'istante previsto dal log alla fine dell'handler, attesa
+in coda compresa). I risultati si possono salvare in JSON e confrontare
+con quelli di un'altra build.
+
+    python replay.py updates.log.gz --database sqlite:///snapshot.db --speed 10 --map-users
+    python replay.py updates.log.gz --database sqlite:///snapshot.db --output nuova.json --compare vecchia.json
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from update_log import read_update_log, map_ids
+
+NO_HANDLER = "(nessun handler)"
+
+
+def _percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)] if values else 0.0
+
+
+def _summary(values):
+    values = sorted(values)
+    return {
+        "p50_ms": round(_percentile(values, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+def snapshot_engine(database_url, in_place=False):
+    """Engine su una copia temporanea del DB SQLite (o sul DB stesso con in_place)"""
+    url = make_url(database_url)
+    if in_place or not url.drivername.startswith("sqlite") or not url.database:
+        return create_engine(database_url), None
+    directory = tempfile.mkdtemp(prefix="replay-")
+    copy = os.path.join(directory, os.path.basename(url.database))
+    shutil.copyfile(url.database, copy)
+    return create_engine(url.set(database=copy)), directory
+
+
+def user_mapper(session):
+    """Associa ogni pseudonimo, in ordine di apparizione, a un utente dello snapshot"""
+    from model import User
+    telegram_ids = [
+        int(telegram_id) for (telegram_id,) in session.query(User.telegram_id).order_by(User.id)
+        if telegram_id.lstrip("-").isdigit()
+    ]
+    mapping = {}
+
+    def mapper(value):
+        if not telegram_ids:
+            return value
+        if value not in mapping:
+            mapping[value] = telegram_ids[len(mapping) % len(telegram_ids)]
+        return mapping[value]
+    return mapper
+
+
+class HandlerTimer:
+    """Nome dell'handler che ha gestito ogni update, letto avvolgendo gli handler di telebot"""
+
+    def __init__(self, bot):
+        self._local = threading.local()
+        for name, handlers in vars(bot).items():
+            if name.endswith("_handlers") and isinstance(handlers, list):
+                for handler in handlers:
+                    if isinstance(handler, dict) and "function" in handler:
+                        handler["function"] = self._wrap(handler["function"], handler["function"].__name__)
+        # I next step handler (conversazioni a più passi) passano da _exec_task
+        exec_task = bot._exec_task
+        run_handlers = bot._run_middlewares_and_handler
+
+        def timed_exec_task(task, *args, **kwargs):
+            if task != run_handlers:
+                task = self._wrap(task, f"next_step:{getattr(task, '__name__', task)}")
+            return exec_task(task, *args, **kwargs)
+        bot._exec_task = timed_exec_task
+
+    def _wrap(self, function, label):
+        def wrapper(*args, **kwargs):
+            if getattr(self._local, "label", None) is None:
+                self._local.label = label
+            return function(*args, **kwargs)
+        wrapper.__name__ = getattr(function, "__name__", label)
+        return wrapper
+
+    def start(self):
+        self._local.label = None
+
+    def label(self):
+        return self._local.label or NO_HANDLER
+
+
+def replay(bot, entries, speed=1.0, workers=None, on_progress=None):
+    """Riesegue gli update; restituisce i tempi per handler e il riepilogo"""
+    from telebot.types import Update
+    from dispatcher import ChatDispatcher, DISPATCHER_WORKERS
+    from runtime import update_chat_id
+
+    timer = HandlerTimer(bot)
+    handler_times = defaultdict(list)
+    end_to_end = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def process(item):
+        update, due = item
+        timer.start()
+        started = time.monotonic()
+        failed = False
+        try:
+            bot.process_new_updates([update])
+        except Exception:
+            failed = True
+        finished = time.monotonic()
+        label = timer.label()
+        with lock:
+            handler_times[label].append(finished - started)
+            end_to_end[label].append(finished - due)
+            if failed:
+                errors[label] += 1
+
+    bot.threaded = False
+    dispatcher = ChatDispatcher(process, workers or DISPATCHER_WORKERS)
+    started = time.monotonic()
+    first_time = None
+    count = 0
+    for received_at, payload in entries:
+        if first_time is None:
+            first_time = received_at
+        due = started + (received_at - first_time) / speed if speed > 0 else time.monotonic()
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        update = Update.de_json(payload)
+        dispatcher.submit(update_chat_id(update), (update, due))
+        count += 1
+        if on_progress and count % 100 == 0:
+            on_progress(count)
+    dispatcher.join()
+    dispatcher.shutdown()
+    elapsed = time.monotonic() - started
+
+    return {
+        "updates": count,
+        "seconds": round(elapsed, 3),
+        "throughput": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+        "speed": speed,
+        "handlers": {
+            label: {
+                "count": len(times),
+                "errors": errors[label],
+                "handler": _summary(times),
+                "end_to_end": _summary(end_to_end[label]),
+            }
+            for label, times in sorted(handler_times.items(), key=lambda item: -len(item[1]))
+        },
+    }
+
+
+def print_results(results, baseline=None):
+    print(f"✅ {results['updates']} update in {results['seconds']:.1f} s ({results['throughput']:.1f} update/s)")
+    print(f"{'Handler':<36} {'N':>6} {'Err':>4} {'p50':>9} {'p95':>9} {'p99':>9} {'e2e p95':>9}")
+    for label, data in results["handlers"].items():
+        handler = data["handler"]
+        line = (f"{label[:36]:<36} {data['count']:>6} {data['errors']:>4} {handler['p50_ms']:>9.1f} "
+                f"{handler['p95_ms']:>9.1f} {handler['p99_ms']:>9.1f} {data['end_to_end']['p95_ms']:>9.1f}")
+        previous = (baseline or {}).get("handlers", {}).get(label)
+        if previous:
+            # Variazione rispetto all'altra build (p50 e p95 del tempo dell'handler)
+            line += (f"   Δp50 {handler['p50_ms'] - previous['handler']['p50_ms']:+.1f}"
+                     f" Δp95 {handler['p95_ms'] - previous['handler']['p95_ms']:+.1f}")
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay di un log di update sugli handler del bot")
+    parser.add_argument("log", help="Log registrato (update_log.py), anche .gz")
+    parser.add_argument("--database", help="URL del DB snapshot (SQLite: viene usata una copia)")
+    parser.add_argument("--in-place", action="store_true", help="Lavora direttamente sullo snapshot")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = tempo reale, N = N volte più veloce, 0 = senza pause")
+    parser.add_argument("--map-users", action="store_true",
+                        help="Associa gli utenti pseudonimi a quelli dello snapshot (report su dati reali)")
+    parser.add_argument("--direct", action="store_true",
+                        help="Invii senza outbox: misura solo il costo degli handler, senza i limiti di Telegram")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--output", help="File JSON in cui salvare i risultati")
+    parser.add_argument("--compare", help="Risultati JSON di un'altra build da confrontare")
+    args = parser.parse_args()
+
+    from fake_telegram import FakeBotAPI
+    api = FakeBotAPI()
+    api.install()
+
+    from model import SessionLocal
+    temp_dir = None
+    if args.database:
+        engine, temp_dir = snapshot_engine(args.database, args.in_place)
+        SessionLocal.configure(bind=engine)
+    from bot import bot
+    if not args.direct:
+        from outbox import Outbox
+        Outbox().install()
+
+    entries = read_update_log(args.log)
+    if args.map_users:
+        session = SessionLocal()
+        try:
+            mapper = user_mapper(session)
+        finally:
+            session.close()
+        entries = ((received_at, map_ids(payload, mapper)) for received_at, payload in entries)
+
+    try:
+        results = replay(bot, entries, args.speed, args.workers,
+                         on_progress=lambda count: print(f"\r🔄 {count} update", end="", flush=True))
+        print()
+        baseline = None
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+        print_results(results, baseline)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+    finally:
+        from charts import shutdown
+        shutdown()
+        api.close()
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,143 @@
+"""
+Tabella di rollup giornaliera (daily_rollups).
+
+Per ogni (utente, valuta, categoria, giorno) conserva somma e numero di
+entrate e uscite in unità minime. Le funzioni di scrittura in crud.py la
+aggiornano nella stessa transazione della spesa, così report e dashboard
+leggono O(giorni × categorie) righe invece di tutte le transazioni.
+
+Ricostruzione completa (es. dopo un import manuale nel DB):
+
+    python rollup.py --rebuild [--user USER_ID]
+"""
+import sys
+from collections import defaultdict
+from sqlalchemy import func, case, delete, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from model import SessionLocal, DailyRollup, Expense, Wallet
+
+# Etichetta delle transazioni senza categoria (la stessa dei report calcolati sulle spese)
+NO_CATEGORY_LABEL = "None"
+
+
+def rollup_key(user_id, currency, category, date):
+    """Chiave della riga di rollup a cui contribuisce una transazione"""
+    return (user_id, currency, category or "", date.date() if hasattr(date, "date") else date)
+
+
+def category_label(category):
+    """Categoria da mostrare nei report: il rollup salva come "" quelle mancanti"""
+    return category or NO_CATEGORY_LABEL
+
+
+def add_contribution(deltas, key, amount_minor, direction=1):
+    """Accumula in `deltas` il contributo (o la rimozione, direction=-1) di un importo"""
+    delta = deltas[key]
+    if amount_minor >= 0:
+        delta[0] += direction * amount_minor
+        delta[1] += direction
+    else:
+        delta[2] += direction * amount_minor
+        delta[3] += direction
+
+
+def new_deltas():
+    """Dizionario chiave -> [income_minor, income_count, expense_minor, expense_count]"""
+    return defaultdict(lambda: [0, 0, 0, 0])
+
+
+def apply_deltas(session, deltas):
+    """Applica le variazioni accumulate con un unico upsert (senza commit)"""
+    if not deltas:
+        return
+    rows = [
+        {
+            "user_id": user_id,
+            "currency": currency,
+            "category": category,
+            "day": day,
+            "income_minor": income_minor,
+            "income_count": income_count,
+            "expense_minor": expense_minor,
+            "expense_count": expense_count,
+        }
+        for (user_id, currency, category, day), (income_minor, income_count, expense_minor, expense_count)
+        in deltas.items()
+    ]
+    stmt = sqlite_insert(DailyRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "currency", "category", "day"],
+        set_={
+            "income_minor": DailyRollup.income_minor + stmt.excluded.income_minor,
+            "income_count": DailyRollup.income_count + stmt.excluded.income_count,
+            "expense_minor": DailyRollup.expense_minor + stmt.excluded.expense_minor,
+            "expense_count": DailyRollup.expense_count + stmt.excluded.expense_count,
+        }
+    )
+    session.execute(stmt, rows)
+
+    # Le righe rimaste senza transazioni vengono eliminate (solo se qualcosa è stato tolto)
+    if not any(delta[1] < 0 or delta[3] < 0 for delta in deltas.values()):
+        return
+    user_ids = {key[0] for key in deltas}
+    session.execute(delete(DailyRollup).where(
+        DailyRollup.user_id.in_(user_ids),
+        DailyRollup.income_count == 0,
+        DailyRollup.expense_count == 0
+    ))
+
+
+def apply_expense(session, expense, currency, direction=1):
+    """Aggiunge (direction=1) o rimuove (direction=-1) una spesa dal rollup"""
+    deltas = new_deltas()
+    key = rollup_key(expense.user_id, currency, expense.category, expense.date)
+    add_contribution(deltas, key, expense.amount_minor, direction)
+    apply_deltas(session, deltas)
+
+
+def rebuild_rollups(bind, user_id=None):
+    """Ricalcola il rollup dalle transazioni (tutti gli utenti o uno solo).
+
+    `bind` può essere una Session o una Connection; il commit è a carico del chiamante.
+    """
+    clear = delete(DailyRollup)
+    if user_id is not None:
+        clear = clear.where(DailyRollup.user_id == user_id)
+    bind.execute(clear)
+
+    is_income = Expense.amount_minor >= 0
+    source = select(
+        Expense.user_id,
+        Wallet.currency,
+        func.coalesce(Expense.category, ""),
+        func.date(Expense.date),
+        func.sum(case((is_income, Expense.amount_minor), else_=0)),
+        func.sum(case((is_income, 1), else_=0)),
+        func.sum(case((is_income, 0), else_=Expense.amount_minor)),
+        func.sum(case((is_income, 0), else_=1)),
+    ).join(Wallet, Expense.wallet_id == Wallet.id).group_by(
+        Expense.user_id, Wallet.currency, func.coalesce(Expense.category, ""), func.date(Expense.date)
+    )
+    if user_id is not None:
+        source = source.where(Expense.user_id == user_id)
+
+    bind.execute(insert(DailyRollup).from_select([
+        "user_id", "currency", "category", "day",
+        "income_minor", "income_count", "expense_minor", "expense_count",
+    ], source))
+
+
+if __name__ == "__main__":
+    if "--rebuild" not in sys.argv:
+        print(__doc__)
+        sys.exit(1)
+    user_id = None
+    if "--user" in sys.argv:
+        user_id = int(sys.argv[sys.argv.index("--user") + 1])
+    session = SessionLocal()
+    try:
+        rebuild_rollups(session, user_id)
+        session.commit()
+        print("✅ Rollup ricostruito con successo")
+    finally:
+        session.close()
@@ -0,0 +1,153 @@
+"""
+Runtime asyncio per il bot.
+
+Il polling di getUpdates gira nel loop asyncio; ogni update viene poi
+eseguito dagli handler sincroni di bot.py tramite il ChatDispatcher, così
+un handler lento (grafici, import CSV) non blocca le altre chat. Gli
+update della stessa chat restano in ordine (le conversazioni a più passi
+con register_next_step_handler dipendono dall'ordine dei messaggi).
+
+In modalità webhook gli update arrivano invece dalla coda riempita dal
+ricevitore HTTP in webapp.py (vedi update_queue.py).
+
+    python main.py            # long polling
+    python main.py --webhook  # webhook su NGROK_URL/telegram/webhook
+
+Con la sezione [RECORD] di config.ini gli update ricevuti vengono anche
+registrati, anonimizzati, per replay.py (vedi update_log.py).
+"""
+import asyncio
+import functools
+import logging
+from telebot.types import Update
+from dispatcher import ChatDispatcher, DISPATCHER_WORKERS
+from outbox import Outbox
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 25  # secondi di long polling per ogni getUpdates
+POLL_RETRY_DELAY = 3  # secondi di attesa dopo un errore di rete
+STATS_INTERVAL = 300  # secondi tra due log delle statistiche del dispatcher
+QUEUE_GET_TIMEOUT = 1  # secondi di attesa sulla coda del webhook
+
+
+def update_chat_id(update):
+    """Chat a cui appartiene un update (None se non ne ha una)"""
+    if update.message:
+        return update.message.chat.id
+    if update.edited_message:
+        return update.edited_message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    return None
+
+
+class AsyncRuntime:
+    """Riceve gli update con il long polling e li smista agli handler sincroni"""
+
+    def __init__(self, bot, workers=DISPATCHER_WORKERS, recorder=None):
+        self.bot = bot
+        self.recorder = recorder  # update_log.UpdateRecorder opzionale
+        # Gli handler girano già nei worker del dispatcher, non nel worker pool di TeleBot
+        self.bot.threaded = False
+        self.dispatcher = ChatDispatcher(self._process, workers)
+        # Tutte le chiamate alla Bot API degli handler passano dalla coda in uscita
+        self.outbox = Outbox()
+        self.outbox.install()
+
+    def _process(self, update):
+        self.bot.process_new_updates([update])
+
+    def dispatch(self, update, on_done=None):
+        """Accoda un update sul worker della sua chat (on_done: vedi ChatDispatcher.submit)"""
+        if self.recorder is not None:
+            try:
+                self.recorder.record(update)
+            except Exception:
+                logger.exception("Registrazione dell'update %s non riuscita", update.update_id)
+        self.dispatcher.submit(update_chat_id(update), update, on_done)
+
+    async def poll(self):
+        """Ciclo di long polling: getUpdates gira in un thread per non bloccare il loop"""
+        offset = None
+        while True:
+            try:
+                updates = await asyncio.to_thread(
+                    self.bot.get_updates, offset=offset, timeout=POLL_TIMEOUT,
+                    long_polling_timeout=POLL_TIMEOUT
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Errore nel polling, nuovo tentativo tra %s s", POLL_RETRY_DELAY)
+                await asyncio.sleep(POLL_RETRY_DELAY)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                self.dispatch(update)
+
+    async def consume(self, update_queue):
+        """Preleva gli update ricevuti dal webhook e li passa al dispatcher"""
+        while True:
+            item = await asyncio.to_thread(update_queue.get, QUEUE_GET_TIMEOUT)
+            if item is None:
+                continue
+            token, payload = item
+            try:
+                update = Update.de_json(payload)
+            except Exception:
+                logger.exception("Update non valido scartato: %s", payload[:200])
+                update_queue.ack(token)
+                continue
+            # Confermato solo quando l'handler è terminato (anche con errore):
+            # se il processo si ferma prima, l'update viene riconsegnato al riavvio
+            self.dispatch(update, on_done=functools.partial(update_queue.ack, token))
+
+    async def log_stats(self, interval=STATS_INTERVAL):
+        """Scrive periodicamente nel log profondità delle code e utilizzo dei worker"""
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.dispatcher.stats()
+            busiest = max(stats["workers"], key=lambda worker: worker["utilization"])
+            logger.info(
+                "Dispatcher: %s in coda, %s elaborati, worker più carico #%s (%.0f%%, %s in coda)",
+                stats["queued"], stats["processed"], busiest["worker"],
+                busiest["utilization"] * 100, busiest["queued"]
+            )
+            outbox = self.outbox.stats()
+            logger.info(
+                "Outbox: %s in coda, %s inviati, %s edit uniti, %s 429, latenza p50 %.2fs p95 %.2fs",
+                outbox["queued"], outbox["sent"], outbox["coalesced"], outbox["rate_limited"],
+                outbox["latency_p50"], outbox["latency_p95"]
+            )
+
+    async def shutdown(self):
+        """Attende gli update in coda e ferma i worker"""
+        await asyncio.to_thread(self.dispatcher.shutdown)
+
+
+async def run_polling(bot, workers=DISPATCHER_WORKERS, recorder=None):
+    runtime = AsyncRuntime(bot, workers, recorder)
+    # Il webhook eventualmente impostato impedisce getUpdates
+    await asyncio.to_thread(bot.remove_webhook)
+    stats_task = asyncio.create_task(runtime.log_stats())
+    try:
+        await runtime.poll()
+    finally:
+        stats_task.cancel()
+        await runtime.shutdown()
+
+
+async def run_webhook(bot, update_queue, webhook_url, secret_token=None, workers=DISPATCHER_WORKERS,
+                      recorder=None):
+    """Registra il webhook e consuma la coda riempita dal ricevitore HTTP"""
+    runtime = AsyncRuntime(bot, workers, recorder)
+    await asyncio.to_thread(bot.set_webhook, url=webhook_url, secret_token=secret_token)
+    stats_task = asyncio.create_task(runtime.log_stats())
+    try:
+        await runtime.consume(update_queue)
+    finally:
+        stats_task.cancel()
+        await runtime.shutdown()
@@ -0,0 +1,161 @@
+"""
+Stato delle conversazioni a più passi (es. inserimento di una transazione).
+
+Ogni voce scade dopo `ttl` secondi e il numero di voci è limitato a
+`maxsize` (si eliminano le meno usate di recente), così le conversazioni
+abbandonate non restano in memoria per sempre. Backend disponibili:
+
+- "memory": TTLCache nel processo;
+- "sqlite": tabella conversation_state, condivisa tra più processi del bot
+  e persistente ai riavvii.
+
+StateHandlerBackend salva nello stesso store anche gli handler registrati
+con bot.register_next_step_handler.
+"""
+import pickle
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from telebot.handler_backends import HandlerBackend
+from cache import TTLCache
+from config import STATE_TTL, STATE_MAX_ENTRIES
+from model import SessionLocal, ConversationState
+
+
+class MemoryStateStore:
+    """Store in memoria con scadenza ed eviction LRU"""
+
+    def __init__(self, ttl=STATE_TTL, maxsize=STATE_MAX_ENTRIES):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key, default=None):
+        return self._cache.get(key, default)
+
+    def set(self, key, value, ttl=None):
+        self._cache.set(key, value, ttl)
+
+    def pop(self, key, default=None):
+        return self._cache.pop(key, default)
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class SQLiteStateStore:
+    """Store sulla tabella conversation_state, valori serializzati con pickle"""
+
+    def __init__(self, ttl=STATE_TTL, maxsize=STATE_MAX_ENTRIES, session_factory=SessionLocal):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.session_factory = session_factory
+
+    def get(self, key, default=None):
+        now = datetime.utcnow()
+        session = self.session_factory()
+        try:
+            value = session.execute(
+                select(ConversationState.value).where(
+                    ConversationState.key == key,
+                    (ConversationState.expires_at.is_(None)) | (ConversationState.expires_at > now)
+                )
+            ).scalar()
+            if value is None:
+                return default
+            session.execute(
+                update(ConversationState)
+                .where(ConversationState.key == key)
+                .values(accessed_at=now)
+            )
+            session.commit()
+            return pickle.loads(value)
+        finally:
+            session.close()
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = datetime.utcnow()
+        row = {
+            "key": key,
+            "value": pickle.dumps(value),
+            "expires_at": now + timedelta(seconds=ttl) if ttl is not None else None,
+            "accessed_at": now,
+        }
+        stmt = sqlite_insert(ConversationState).values(row)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={column: stmt.excluded[column] for column in ("value", "expires_at", "accessed_at")}
+        )
+        session = self.session_factory()
+        try:
+            session.execute(stmt)
+            # Pulizia: voci scadute e, oltre il limite, le meno usate di recente
+            session.execute(delete(ConversationState).where(ConversationState.expires_at <= now))
+            overflow = select(ConversationState.key).order_by(
+                ConversationState.accessed_at.desc()
+            ).offset(self.maxsize).scalar_subquery()
+            session.execute(delete(ConversationState).where(ConversationState.key.in_(overflow)))
+            session.commit()
+        finally:
+            session.close()
+
+    def pop(self, key, default=None):
+        session = self.session_factory()
+        try:
+            row = session.execute(
+                delete(ConversationState)
+                .where(ConversationState.key == key)
+                .returning(ConversationState.value, ConversationState.expires_at)
+            ).first()
+            session.commit()
+        finally:
+            session.close()
+        if row is None or (row.expires_at is not None and row.expires_at <= datetime.utcnow()):
+            return default
+        return pickle.loads(row.value)
+
+    def __len__(self):
+        session = self.session_factory()
+        try:
+            return session.query(ConversationState).count()
+        finally:
+            session.close()
+
+
+STATE_STORE_BACKENDS = {
+    "memory": MemoryStateStore,
+    "sqlite": SQLiteStateStore,
+}
+
+
+def make_state_store(backend="memory", ttl=STATE_TTL, maxsize=STATE_MAX_ENTRIES):
+    """Crea lo store per il backend indicato ("memory" o "sqlite")"""
+    try:
+        return STATE_STORE_BACKENDS[backend](ttl=ttl, maxsize=maxsize)
+    except KeyError:
+        raise ValueError(f"Backend dello stato non supportato: {backend}")
+
+
+class StateHandlerBackend(HandlerBackend):
+    """Backend dei next step handler di telebot salvato in uno state store"""
+
+    def __init__(self, store, prefix="next_step"):
+        super().__init__()
+        self.store = store
+        self.prefix = prefix
+        self._lock = threading.Lock()
+
+    def _key(self, handler_group_id):
+        return f"{self.prefix}:{handler_group_id}"
+
+    def register_handler(self, handler_group_id, handler):
+        with self._lock:
+            handlers = self.store.get(self._key(handler_group_id)) or []
+            handlers.append(handler)
+            self.store.set(self._key(handler_group_id), handlers)
+
+    def clear_handlers(self, handler_group_id):
+        self.store.pop(self._key(handler_group_id))
+
+    def get_handlers(self, handler_group_id):
+        return self.store.pop(self._key(handler_group_id))
@@ -0,0 +1,73 @@
+"""
+Configurazione comune dei test: DB SQLite temporaneo e contatore degli statement SQL.
+
+La configurazione viene scritta in un file temporaneo prima di importare i
+moduli del bot, quindi i test non usano mai il config.ini locale.
+"""
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+_tmp_dir = tempfile.mkdtemp(prefix="expense-tests-")
+_config_path = os.path.join(_tmp_dir, "config.ini")
+with open(_config_path, "w") as f:
+    f.write(
+        "[TELEGRAM]\n"
+        "TELEGRAM_API_TOKEN = 123456:TEST\n"
+        "[DATABASE]\n"
+        f"DATABASE_URL = sqlite:///{os.path.join(_tmp_dir, 'test.db')}\n"
+    )
+os.environ["EXPENSE_TRACKER_CONFIG"] = _config_path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import event
+from model import engine, SessionLocal
+from migrations import reset_schema
+
+
+@pytest.fixture
+def session():
+    """Sessione su uno schema appena ricreato, con le cache in-process vuote"""
+    import crud
+    reset_schema(engine)
+    crud.clear_identity_cache()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@contextmanager
+def count_statements(bind=engine):
+    """Raccoglie gli statement SQL eseguiti sull'engine nel blocco with"""
+    statements = []
+
+    def on_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(bind, "before_cursor_execute", on_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(bind, "before_cursor_execute", on_execute)
+
+
+@pytest.fixture
+def silent_bot(monkeypatch):
+    """Bot con le chiamate alla Bot API sostituite da risposte fittizie"""
+    from types import SimpleNamespace
+    import bot as bot_module
+    sent = []
+
+    def reply(*args, **kwargs):
+        sent.append((args, kwargs))
+        return SimpleNamespace(chat=SimpleNamespace(id=0), message_id=1)
+
+    for name in ("send_message", "reply_to", "edit_message_text", "send_photo",
+                 "send_document", "answer_callback_query"):
+        monkeypatch.setattr(bot_module.bot, name, reply)
+    bot_module.bot.sent = sent
+    return bot_module.bot
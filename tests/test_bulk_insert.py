@@ -0,0 +1,64 @@
+"""Inserimenti massivi: un INSERT multi-riga per blocco, non uno per riga"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+from conftest import count_statements
+from crud import get_or_create_user, create_expenses_bulk
+from model import engine, Expense, DailyRollup
+
+
+def make_records(count):
+    return [
+        {"amount": -(i + 1), "description": f"spesa {i}", "category": "cibo",
+         "date": datetime(2025, 1, 1 + i % 28), "currency": "EUR"}
+        for i in range(count)
+    ]
+
+
+def test_one_insert_per_chunk(session):
+    user = get_or_create_user(session, "1000", "utente")
+    with count_statements() as statements:
+        ids, errors = create_expenses_bulk(session, user, make_records(1200), chunk_size=500)
+
+    inserts = [statement for statement in statements if statement.startswith("INSERT INTO expenses")]
+    assert len(inserts) == 3
+    assert len(statements) < 20
+    assert not errors
+    assert len(ids) == 1200
+
+
+def test_ids_follow_record_order(session):
+    user = get_or_create_user(session, "1000", "utente")
+    ids, _ = create_expenses_bulk(session, user, make_records(30), chunk_size=7)
+    descriptions = dict(session.query(Expense.id, Expense.description))
+    assert [descriptions[expense_id] for expense_id in ids] == [f"spesa {i}" for i in range(30)]
+    assert session.query(DailyRollup).count() == 28
+
+
+def test_new_wallet_does_not_commit_mid_insert(session):
+    user = get_or_create_user(session, "1000", "utente")
+    records = make_records(10) + [{"amount": 0.001, "date": datetime(2025, 2, 1), "currency": "BTC"}]
+    commits = []
+
+    def on_commit(conn):
+        commits.append(conn)
+
+    event.listen(engine, "commit", on_commit)
+    try:
+        ids, errors = create_expenses_bulk(session, user, records, chunk_size=5)
+    finally:
+        event.remove(engine, "commit", on_commit)
+    # Un solo commit, alla fine: blocchi, rollup e data_version nella stessa transazione
+    assert len(commits) == 1
+    assert len(ids) == 11 and not errors
+
+
+def test_invalid_amount_minor_is_rejected():
+    from crud import _bulk_row
+    user = SimpleNamespace(id=1)
+    wallet = SimpleNamespace(id=1, currency="EUR")
+    with pytest.raises(ValueError, match="importo non valido: abc"):
+        _bulk_row(None, user, {"amount_minor": "abc", "wallet": wallet}, {})
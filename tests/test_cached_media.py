@@ -0,0 +1,32 @@
+"""Reinvio dei media tramite file_id: se Telegram ne rifiuta uno si ricaricano solo le parti mancanti"""
+import io
+from types import SimpleNamespace
+
+from telebot.apihelper import ApiTelegramException
+
+from crud import get_or_create_user, get_cached_file_ids, store_file_ids
+
+CHAT_ID = 1000
+MEDIA_KEY = "chart:test"
+
+
+def test_rejected_file_id_resends_only_remaining_parts(session, silent_bot, monkeypatch):
+    import bot as bot_module
+    user = get_or_create_user(session, str(CHAT_ID), "utente")
+    store_file_ids(session, MEDIA_KEY, user.id, ["id-0", "id-1", "id-2"])
+    sent = []
+
+    def send_photo(chat_id, photo, **kwargs):
+        if photo == "id-1":
+            raise ApiTelegramException("sendPhoto", None,
+                                       {"error_code": 400, "description": "Bad Request: wrong file identifier"})
+        sent.append(photo if isinstance(photo, str) else photo.getvalue().decode())
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"nuovo-{len(sent)}")])
+    monkeypatch.setattr(bot_module.bot, "send_photo", send_photo)
+
+    bot_module.send_cached_media(CHAT_ID, user.id, MEDIA_KEY,
+                                 lambda: [io.BytesIO(f"grafico {i}".encode()) for i in range(3)])
+
+    # La prima parte era già arrivata: non viene inviata di nuovo
+    assert sent == ["id-0", "grafico 1", "grafico 2"]
+    assert get_cached_file_ids(session, MEDIA_KEY, user.id) == ["id-0", "nuovo-2", "nuovo-3"]
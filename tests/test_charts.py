@@ -0,0 +1,21 @@
+"""Preset dei grafici: la foto resta entro il limite di Telegram, il documento è in alta risoluzione"""
+import struct
+
+from charts import CHART_PRESETS, chart_key, _render
+
+
+def png_size(image):
+    width, height = struct.unpack(">II", image[16:24])  # Chunk IHDR
+    return width, height
+
+
+def test_presets_render_different_sizes():
+    data = {"total": 1234.5, "currency": "EUR"}
+    (photo,) = _render("balance", data, CHART_PRESETS["photo"])
+    (document,) = _render("balance", data, CHART_PRESETS["document"])
+
+    photo_width, _ = png_size(photo)
+    document_width, _ = png_size(document)
+    assert photo_width <= 1280
+    assert document_width > 2 * photo_width
+    assert chart_key("balance", data, "photo") != chart_key("balance", data, "document")
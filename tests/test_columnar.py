@@ -0,0 +1,61 @@
+"""Export Parquet/Arrow e reimport: importi esatti e nessun duplicato"""
+from datetime import datetime
+
+import pytest
+
+from columnar import export_columnar, iter_columnar_chunks, pyarrow_installed
+from crud import get_or_create_user, create_wallet, create_expense
+from importer import import_chunks
+from model import Expense
+
+pytestmark = pytest.mark.skipif(not pyarrow_installed, reason="pyarrow non installato")
+
+
+def add_expenses(session, user):
+    eur = create_wallet(session, "Principale EUR", "EUR")
+    btc = create_wallet(session, "Principale BTC", "BTC")
+    day = datetime(2025, 3, 1, 8, 30)
+    # Inserite a mano (senza impronta), comprese due righe identiche e una senza descrizione
+    create_expense(session, user, eur, -2.5, "caffè", None, day, "cibo")
+    create_expense(session, user, eur, -2.5, "caffè", None, day, "cibo")
+    create_expense(session, user, eur, 1500, None, None, day, "stipendio")
+    create_expense(session, user, btc, 0.00012345, "bitcoin", "Milano", day, None)
+
+
+def export_and_import(session, user, fmt):
+    _, output = export_columnar(session, user.id, fmt)
+    data = output.read()
+    return import_chunks(session, user, iter_columnar_chunks(data, fmt))
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_reimport_of_export_creates_no_duplicates(session, fmt):
+    user = get_or_create_user(session, "1000", "utente")
+    add_expenses(session, user)
+
+    stats = export_and_import(session, user, fmt)
+    assert stats["imported"] == 0
+    assert stats["duplicates"] == 4
+    assert session.query(Expense).count() == 4
+
+    # Una nuova transazione identica a una esistente viene importata dopo le altre
+    create_expense(session, user, create_wallet(session, "Principale EUR", "EUR"),
+                   -2.5, "caffè", None, datetime(2025, 3, 1, 8, 30), "cibo")
+    stats = export_and_import(session, user, fmt)
+    assert stats["imported"] == 0
+    assert stats["duplicates"] == 5
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_import_into_other_user_is_exact(session, fmt):
+    user = get_or_create_user(session, "1000", "utente")
+    other = get_or_create_user(session, "2000", "altro")
+    add_expenses(session, user)
+
+    _, output = export_columnar(session, user.id, fmt)
+    stats = import_chunks(session, other, iter_columnar_chunks(output.read(), fmt))
+    assert stats["imported"] == 4
+
+    def amounts(owner):
+        return sorted(amount for (amount,) in session.query(Expense.amount_minor).filter_by(user_id=owner.id))
+    assert amounts(other) == amounts(user)
@@ -0,0 +1,25 @@
+"""Generatore di dataset: le righe sono scritte con INSERT multi-riga, non una per riga"""
+import datetime
+import math
+
+from conftest import count_statements
+from generate_dataset import DATASET_INSERT_ROWS, generate_dataset
+from model import engine, Expense, User
+
+END_DATE = datetime.datetime(2026, 1, 1)
+
+
+def test_rows_are_written_with_multi_row_inserts(session):
+    with count_statements() as statements:
+        stats = generate_dataset(engine, users=1200, expenses=2300, shares=50, chunk_size=1000, end_date=END_DATE)
+
+    def inserts(table):
+        return sum(statement.startswith(f"INSERT INTO {table} ") for statement in statements)
+
+    assert (stats["users"], stats["expenses"], stats["shares"]) == (1200, 2300, 50)
+    assert inserts("users") == math.ceil(1200 / DATASET_INSERT_ROWS)
+    # Ogni blocco campionato (1000, 1000, 300 righe) è diviso in istruzioni da DATASET_INSERT_ROWS
+    assert inserts("expenses") == 2 * math.ceil(1000 / DATASET_INSERT_ROWS) + math.ceil(300 / DATASET_INSERT_ROWS)
+    assert session.query(Expense).count() == 2300
+    assert session.query(User).count() == 1200
+
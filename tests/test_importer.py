@@ -0,0 +1,80 @@
+"""Importer: conversione vettoriale degli importi e impronte delle transazioni inserite a mano"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import count_statements
+from crud import get_or_create_user, create_wallet, create_expense
+from importer import amounts_to_minor, fill_missing_fingerprints, row_fingerprint
+from model import Expense
+from money import to_minor
+
+
+@pytest.mark.parametrize("currency, step", [("EUR", 0.01), ("BTC", 1e-8), ("SAT", 1)])
+def test_half_unit_amounts_match_to_minor(currency, step):
+    # Importi a metà tra due unità minime (es. x.xx5 EUR), positivi e negativi
+    amounts = [round(sign * (i * step + step / 2), 10) for i in range(2000) for sign in (1, -1)]
+    amounts += [-1.005, 1.005, 0.125, 2.675, 1.115, -0.285]
+    series = pd.Series(amounts, dtype=np.float64)
+    currencies = pd.Series([currency] * len(amounts), dtype="string")
+    expected = [to_minor(amount, currency) for amount in amounts]
+    assert amounts_to_minor(series, currencies).tolist() == expected
+
+
+def test_random_amounts_match_to_minor():
+    rng = np.random.default_rng(7)
+    amounts = [round(value, int(digits)) for value, digits in zip(rng.uniform(-10000, 10000, 5000), rng.integers(0, 9, 5000))]
+    currencies = pd.Series(rng.choice(["EUR", "BTC", "SAT"], 5000), dtype="string")
+    expected = [to_minor(float(amount), currency) for amount, currency in zip(amounts, currencies)]
+    amounts = pd.Series(amounts, dtype=np.float64)
+    assert amounts_to_minor(amounts, currencies).tolist() == expected
+
+
+def add_imported(session, user, wallet, rows):
+    """Transazioni con impronta già assegnata, diverse da quelle inserite a mano"""
+    for i in range(rows):
+        session.add(Expense(user_id=user.id, wallet_id=wallet.id, amount_minor=i, description=f"importata {i}",
+                            date=datetime(2024, 1, 1), fingerprint=f"{i:040x}"))
+    session.commit()
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_fill_missing_fingerprints_skips_used_occurrences(session, batch_size):
+    user = get_or_create_user(session, "1000", "utente")
+    wallet = create_wallet(session, "Principale EUR", "EUR")
+    day = datetime(2025, 3, 1, 8, 30)
+    record = {'date': day, 'amount_minor': -250, 'currency': "EUR", 'description': "caffè"}
+    # L'occorrenza 1 è già di una riga importata: le tre righe a mano ricevono 0, 2 e 3
+    session.add(Expense(user_id=user.id, wallet_id=wallet.id, amount_minor=-250, description="caffè",
+                        date=day, fingerprint=row_fingerprint(user.id, record, 1)))
+    session.commit()
+    for _ in range(3):
+        create_expense(session, user, wallet, -2.5, "caffè", None, day, "cibo")
+
+    assert fill_missing_fingerprints(session, user.id, batch_size) == 3
+    fingerprints = {fingerprint for (fingerprint,) in session.query(Expense.fingerprint)}
+    assert fingerprints == {row_fingerprint(user.id, record, occurrence) if occurrence else row_fingerprint(user.id, record)
+                            for occurrence in range(4)}
+    assert fill_missing_fingerprints(session, user.id, batch_size) == 0
+
+
+def test_fill_missing_fingerprints_reads_only_candidates(session):
+    user = get_or_create_user(session, "1000", "utente")
+    wallet = create_wallet(session, "Principale EUR", "EUR")
+    create_expense(session, user, wallet, -2.5, "caffè", None, datetime(2025, 3, 1), "cibo")
+
+    def statements(imported):
+        add_imported(session, user, wallet, imported)
+        session.query(Expense).filter(Expense.description == "caffè").update({"fingerprint": None})
+        session.commit()
+        with count_statements() as executed:
+            fill_missing_fingerprints(session, user.id)
+        return executed
+
+    small, large = statements(10), statements(1000)
+    assert len(small) == len(large)
+    # Le impronte dell'utente vengono lette solo filtrate per le candidate
+    assert all(" IN (" in statement for statement in large
+               if statement.lstrip().startswith("SELECT expenses.fingerprint"))
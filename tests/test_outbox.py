@@ -0,0 +1,130 @@
+"""Outbox: ripetizione dopo un 429, edit uniti, ordine per chat e pulizia dei bucket"""
+import io
+import threading
+import time
+
+import pytest
+
+from outbox import Outbox
+
+URL = "https://api.telegram.org/botTOKEN/"
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+@pytest.mark.parametrize("wrap", [
+    lambda file: file,
+    lambda file: ("grafico.png", file),
+    lambda file: ("grafico.png", file, "image/png"),
+])
+def test_retry_after_429_resends_whole_file(wrap):
+    outbox = Outbox(global_rate=1000, global_burst=1000, chat_rate=1000, chat_burst=1000, workers=1)
+    bodies = []
+
+    def send(method, url, **kwargs):
+        # Come requests: legge il file fino alla fine
+        value = kwargs["files"]["photo"]
+        file = value[1] if isinstance(value, tuple) else value
+        bodies.append(file.read())
+        if len(bodies) == 1:
+            return FakeResponse(429, {"ok": False, "parameters": {"retry_after": 0.01}})
+        return FakeResponse(200, {"ok": True})
+
+    outbox._send = send
+    response = outbox.request("post", "https://api.telegram.org/botTOKEN/sendPhoto",
+                              params={"chat_id": 1}, files={"photo": wrap(io.BytesIO(b"PNG-DATA"))})
+
+    assert response.status_code == 200
+    assert bodies == [b"PNG-DATA", b"PNG-DATA"]
+    assert outbox.rate_limited == 1
+
+
+def make_outbox(workers=4):
+    return Outbox(global_rate=1000, global_burst=1000, chat_rate=1000, chat_burst=1000, workers=workers)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condizione non raggiunta"
+        time.sleep(0.005)
+
+
+def in_thread(outbox, method_name, params, results):
+    thread = threading.Thread(target=lambda: results.append(outbox.request("post", URL + method_name, params=params)))
+    thread.start()
+    return thread
+
+
+def blocking_sender(outbox, release):
+    """_send che registra le richieste e tiene occupata la chat 1 finché `release` non è impostato"""
+    sent = []
+
+    def send(method, url, params=None, **kwargs):
+        sent.append((url.rsplit("/", 1)[-1], dict(params)))
+        if params.get("text") == "blocca":
+            release.wait(5)
+        return FakeResponse(200, {"ok": True})
+    outbox._send = send
+    return sent
+
+
+def test_queued_edits_of_a_message_are_coalesced():
+    outbox = make_outbox()
+    release = threading.Event()
+    sent = blocking_sender(outbox, release)
+    results = []
+    threads = [in_thread(outbox, "sendMessage", {"chat_id": 1, "text": "blocca"}, results)]
+    wait_for(lambda: sent)
+    for index in range(3):
+        threads.append(in_thread(outbox, "editMessageText",
+                                 {"chat_id": 1, "message_id": 7, "text": f"progresso {index}"}, results))
+        wait_for(lambda: outbox.stats()["queued"] == 1 and outbox.coalesced == index)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    edits = [params["text"] for method, params in sent if method == "editMessageText"]
+    assert edits == ["progresso 2"]  # Solo l'ultimo stato viene inviato
+    assert outbox.coalesced == 2
+    assert len(results) == 4  # Tutti i chiamanti ricevono la risposta
+
+
+def test_same_chat_in_order_other_chats_in_parallel():
+    outbox = make_outbox()
+    release = threading.Event()
+    sent = blocking_sender(outbox, release)
+    results = []
+    threads = [in_thread(outbox, "sendMessage", {"chat_id": 1, "text": "blocca"}, results)]
+    wait_for(lambda: sent)
+    for index in range(5):
+        threads.append(in_thread(outbox, "sendMessage", {"chat_id": 1, "text": f"messaggio {index}"}, results))
+        wait_for(lambda: outbox.stats()["queued"] == index + 1)
+    # La chat 1 è occupata, la chat 2 no: il suo messaggio parte subito
+    threads.append(in_thread(outbox, "sendMessage", {"chat_id": 2, "text": "altra chat"}, results))
+    wait_for(lambda: ("sendMessage", {"chat_id": 2, "text": "altra chat"}) in sent)
+    assert len(sent) == 2
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    chat_1 = [params["text"] for _, params in sent if params["chat_id"] == 1]
+    assert chat_1 == ["blocca"] + [f"messaggio {index}" for index in range(5)]
+
+
+def test_idle_chat_buckets_are_removed():
+    outbox = make_outbox(workers=1)
+    outbox._send = lambda method, url, **kwargs: FakeResponse(200, {"ok": True})
+    for chat_id in range(50):
+        outbox.request("post", URL + "sendMessage", params={"chat_id": chat_id, "text": "ciao"})
+    with outbox._condition:
+        outbox._chat_bucket(1000).block(60)  # Sospeso da un 429: va conservato
+        outbox._sweep_buckets(time.monotonic() + 10)
+        assert list(outbox._chat_buckets) == [1000]
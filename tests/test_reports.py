@@ -0,0 +1,56 @@
+"""Testo dei report mensili e annuali (snapshot)"""
+from datetime import datetime
+
+from crud import (get_or_create_user, create_wallet, create_expense,
+                  generate_monthly_report, generate_yearly_report)
+
+
+def add_expenses(session):
+    user = get_or_create_user(session, "1000", "utente")
+    eur = create_wallet(session, "Principale EUR", "EUR")
+    btc = create_wallet(session, "Principale BTC", "BTC")
+    # Inserite fuori ordine: il report non deve dipendere dall'ordine di inserimento
+    for amount, wallet, day, category in [
+        (-12.5, eur, datetime(2025, 3, 4), "zeta"),
+        (2000, eur, datetime(2025, 1, 31), "Stipendio"),
+        (-3.2, eur, datetime(2025, 3, 1), "media"),
+        (-7, eur, datetime(2025, 2, 10), None),
+        (0.001, btc, datetime(2025, 3, 15), "alfa"),
+        (-40, eur, datetime(2025, 1, 5), "media"),
+    ]:
+        create_expense(session, user, wallet, amount, "spesa", None, day, category)
+    return user
+
+
+def test_yearly_report_snapshot(session):
+    user = add_expenses(session)
+    assert generate_yearly_report(session, user.id, 2025) == (
+        "📊 *Report Anno 2025*\n\n"
+        "💰 Totale: +1,937.30\n"
+        "📥 Entrate: 2,000.00\n"
+        "📤 Uscite: 62.70\n\n"
+        "*Dettaglio per categoria:*\n"
+        "📈 alfa: +0.00\n"
+        "📉 media: -43.20\n"
+        "📈 Stipendio: +2,000.00\n"
+        "📉 zeta: -12.50\n"
+        "📉 None: -7.00\n"
+        "\n*Andamento mensile:*\n"
+        "📈 January: +1,960.00\n"
+        "📉 February: -7.00\n"
+        "📉 March: -15.70\n"
+    )
+
+
+def test_monthly_report_snapshot(session):
+    user = add_expenses(session)
+    assert generate_monthly_report(session, user.id, 2025, 3) == (
+        "📊 *Report March 2025*\n\n"
+        "💰 Totale: -15.70\n"
+        "📥 Entrate: 0.00\n"
+        "📤 Uscite: 15.70\n\n"
+        "*Dettaglio per categoria:*\n"
+        "📈 alfa: +0.00\n"
+        "📉 media: -3.20\n"
+        "📉 zeta: -12.50\n"
+    )
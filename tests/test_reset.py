@@ -0,0 +1,36 @@
+"""/reset_db non deve lasciare in cache report calcolati sul DB precedente"""
+from datetime import datetime
+from types import SimpleNamespace
+
+from crud import get_or_create_user, create_wallet, create_expense
+
+CHAT_ID = 1000
+
+
+def add_expense(session, amount):
+    user = get_or_create_user(session, str(CHAT_ID), "utente")
+    wallet = create_wallet(session, "Principale EUR", "EUR")
+    create_expense(session, user, wallet, amount, "spesa", None, datetime.utcnow(), "cibo")
+
+
+def last_text(bot):
+    args, kwargs = bot.sent[-1]
+    return kwargs.get("text", args[1] if len(args) > 1 else args[0])
+
+
+def test_reset_database_invalidates_reports(session, silent_bot):
+    import bot as bot_module
+    add_expense(session, -12.5)
+    bot_module.show_report(CHAT_ID)
+    assert "12.50" in last_text(silent_bot)
+
+    message = SimpleNamespace(from_user=SimpleNamespace(id=CHAT_ID, username="utente", first_name="utente"))
+    bot_module.reset_database(message)
+    assert "✅" in last_text(silent_bot)
+
+    # Stessi proprietari e stesse data_version del DB precedente: la chiave in cache coinciderebbe
+    session.close()
+    add_expense(session, -3)
+    bot_module.show_report(CHAT_ID)
+    text = last_text(silent_bot)
+    assert "3.00" in text and "12.50" not in text
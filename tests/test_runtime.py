@@ -0,0 +1,80 @@
+"""Webhook: l'update viene confermato nella coda solo a handler terminato"""
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from telebot import apihelper
+
+from runtime import AsyncRuntime
+from update_queue import SQLiteUpdateQueue
+
+
+def message_update(update_id, chat_id=1000):
+    return json.dumps({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "text": "ciao",
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": {"id": chat_id, "is_bot": False, "first_name": "utente"}},
+    })
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condizione non raggiunta")
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_ack_after_handler_completion(session, monkeypatch, fail):
+    monkeypatch.setattr(apihelper, "CUSTOM_REQUEST_SENDER", None)  # Ripristinato dopo l'install dell'outbox
+    started = []
+    release = threading.Event()
+
+    def process_new_updates(updates):
+        started.extend(update.update_id for update in updates)
+        release.wait(5)
+        if fail:
+            raise RuntimeError("handler fallito")
+
+    bot = SimpleNamespace(threaded=True, process_new_updates=process_new_updates)
+    update_queue = SQLiteUpdateQueue(poll_interval=0.01)
+    update_queue.put(1, message_update(1))
+    update_queue.put(2, message_update(2))
+
+    async def scenario():
+        runtime = AsyncRuntime(bot, workers=1)
+        consumer = asyncio.create_task(runtime.consume(update_queue))
+        try:
+            await asyncio.to_thread(wait_for, lambda: started == [1])
+            await asyncio.sleep(0.1)
+            # Handler in corso: nulla è confermato e l'update non viene riconsegnato
+            assert len(update_queue) == 2
+            assert started == [1]
+            release.set()
+            await asyncio.to_thread(wait_for, lambda: len(update_queue) == 0)
+            assert started == [1, 2]
+        finally:
+            consumer.cancel()
+            await runtime.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_queue_delivers_updates_saved_out_of_order(session):
+    update_queue = SQLiteUpdateQueue(poll_interval=0.01)
+    update_queue.put(5, message_update(5))
+    token5, _ = update_queue.get(0)
+    # Un'altra connessione al webhook salva un update più vecchio dopo la consegna del 5
+    update_queue.put(3, message_update(3))
+    token3, payload = update_queue.get(0)
+    assert json.loads(payload)["update_id"] == 3
+    # Nessuna riconsegna di quelli in elaborazione
+    assert update_queue.get(0) is None
+    update_queue.ack(token3)
+    update_queue.ack(token5)
+    assert len(update_queue) == 0
@@ -0,0 +1,81 @@
+"""Numero di statement SQL di lista, report e dashboard: non deve dipendere dal numero di transazioni"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import count_statements
+from crud import get_or_create_user, create_wallet, create_expense
+from model import SharedAccess
+
+CHAT_ID = 1000
+FRIEND_CHAT_ID = 2000
+
+
+def share_with_user(session):
+    """L'amico condivide tutte le sue transazioni con l'utente"""
+    user = get_or_create_user(session, str(CHAT_ID), "utente")
+    friend = get_or_create_user(session, str(FRIEND_CHAT_ID), "amico")
+    session.add(SharedAccess(owner_id=friend.id, viewer_id=user.id))
+    session.commit()
+    return user, friend
+
+
+def populate(session, user, friend, rows):
+    """Transazioni dell'utente e dell'amico (le sue sono le più recenti, quindi in prima pagina)"""
+    wallets = [create_wallet(session, "Principale EUR", "EUR"), create_wallet(session, "Principale BTC", "BTC")]
+    now = datetime.utcnow()
+    for owner, step in ((user, timedelta(days=1)), (friend, timedelta(minutes=1))):
+        for i in range(rows):
+            create_expense(session, owner, wallets[i % 2], (-1) ** i * (i + 1), f"spesa {i}", None,
+                           now - step * (i % 40 + 1), ("cibo", "casa", None)[i % 3])
+
+
+def statements_for(function):
+    with count_statements() as statements:
+        function()
+    return len(statements)
+
+
+def last_text(bot):
+    args, kwargs = bot.sent[-1]
+    return kwargs.get("text", args[1] if len(args) > 1 else args[0])
+
+
+@pytest.mark.parametrize("operation, limit", [
+    ("list", 3),
+    ("report", 5),
+    ("dashboard", 5),
+])
+def test_statement_count_does_not_grow_with_rows(session, silent_bot, operation, limit):
+    import bot as bot_module
+    import webapp
+    client = webapp.app.test_client()
+    user, friend = share_with_user(session)
+
+    def run():
+        if operation == "list":
+            bot_module.show_transactions_list(CHAT_ID)
+        elif operation == "report":
+            bot_module.show_report(CHAT_ID)
+        else:
+            assert client.get(f"/dashboard/{CHAT_ID}").status_code == 200
+
+    populate(session, user, friend, 10)
+    small = statements_for(run)
+    populate(session, user, friend, 100)
+    large = statements_for(run)
+
+    assert small == large
+    assert large <= limit
+    if operation != "dashboard":
+        # Lista e report includono le transazioni di chi ha condiviso con l'utente
+        assert "Transazioni di amico" in last_text(silent_bot)
+
+
+def test_cached_report_runs_only_version_lookup(session, silent_bot):
+    import bot as bot_module
+    user, friend = share_with_user(session)
+    populate(session, user, friend, 20)
+    bot_module.show_report(CHAT_ID)
+    # Seconda richiesta: utente dalla cache, versioni dei dati e testo dalla cache del report
+    assert statements_for(lambda: bot_module.show_report(CHAT_ID)) <= 2
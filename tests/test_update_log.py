@@ -0,0 +1,54 @@
+"""Anonimizzazione degli update registrati per il replay"""
+import json
+
+from telebot.types import Update
+
+from update_log import anonymize_update, FILE_ID_PLACEHOLDER
+
+SALT = "test"
+
+
+def callback_update(data):
+    return {
+        "update_id": 10,
+        "callback_query": {
+            "id": "1", "chat_instance": "1", "data": data,
+            "from": {"id": 1000, "is_bot": False, "first_name": "Mario", "username": "mario"},
+            "message": {"message_id": 5, "date": 0, "text": "Seleziona la valuta",
+                        "chat": {"id": 1000, "type": "private", "first_name": "Mario"}},
+        },
+    }
+
+
+def test_location_callback_is_masked():
+    # bot.py mette il luogo (o le coordinate GPS) nel callback_data della scelta valuta
+    for location in ("45.4642, 9.19", "Via Roma 12, Milano"):
+        anonymized = anonymize_update(callback_update(f"currency_EUR_{location}"), SALT)
+        data = anonymized["callback_query"]["data"]
+        assert data.startswith("currency_EUR_")
+        assert not any(character.isdigit() and character != "0" for character in data)
+        assert "Roma" not in data and "Milano" not in data
+        assert "Mario" not in json.dumps(anonymized)
+        # Il log resta rieseguibile: il payload è ancora un update valido per telebot
+        assert Update.de_json(json.dumps(anonymized)).callback_query.data == data
+
+
+def test_button_callbacks_are_kept():
+    assert anonymize_update(callback_update("main_menu"), SALT)["callback_query"]["data"] == "main_menu"
+    assert anonymize_update(callback_update("edit_tx_123"), SALT)["callback_query"]["data"] == "edit_tx_000"
+    assert anonymize_update(callback_update("ignoto 42"), SALT)["callback_query"]["data"] == "xxxxxx 00"
+
+
+def test_file_ids_are_dropped():
+    update = {
+        "update_id": 11,
+        "message": {
+            "message_id": 6, "date": 0, "chat": {"id": 1000, "type": "private"},
+            "document": {"file_id": "BQACAgQAAxkBAAI", "file_unique_id": "AgADqQ", "file_name": "spese_2025.csv"},
+        },
+    }
+    anonymized = anonymize_update(update, SALT)
+    document = anonymized["message"]["document"]
+    assert document["file_id"] == document["file_unique_id"] == FILE_ID_PLACEHOLDER
+    assert document["file_name"] == "file.csv"
+    assert Update.de_json(json.dumps(anonymized)).message.document.file_id == FILE_ID_PLACEHOLDER
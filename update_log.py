@@ -0,0 +1,171 @@
+"""
+Registrazione anonimizzata degli update ricevuti (log append-only).
+
+Ogni update viene scritto su una riga JSON compatta con l'istante di
+ricezione: {"t": <unix time>, "u": <update>}. Se il percorso termina in
+".gz" il log è compresso (ogni apertura aggiunge un membro gzip, quindi si
+continua ad accodare). replay.py rilegge il log e lo riesegue sugli handler.
+
+Anonimizzazione:
+
+- ID di utenti e chat sostituiti da pseudonimi stabili (HMAC con `salt`),
+  così l'ordine e la distribuzione per chat restano quelli reali;
+- nomi, username, telefono e posizione rimossi;
+- nei testi le lettere diventano "x" mentre cifre, punteggiatura e
+  lunghezza restano: importi e formati si possono ancora interpretare.
+  Comandi ("/report") e testi dei bottoni indicati in `keep_texts` restano
+  invariati;
+- nei callback_data resta il prefisso generato dal bot ("currency_EUR_",
+  "edit_tx_"...) mentre il parametro che segue (luogo o coordinate, ID,
+  cursori con date) perde lettere e cifre; quelli senza prefisso noto
+  restano solo se sono nomi fissi di pulsanti ("main_menu");
+- file_id e file_unique_id (con il token del bot permettono di scaricare
+  il file) sostituiti da un segnaposto.
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import re
+import secrets
+import threading
+import time
+
+# Campi dell'update che contengono un utente o una chat con un "id"
+ID_OBJECTS = {"chat", "from", "user", "sender_chat", "forward_from", "forward_from_chat", "via_bot"}
+NAME_FIELDS = {"first_name", "last_name", "username", "title", "phone_number", "bio", "vcard"}
+TEXT_FIELDS = {"text", "caption", "query"}
+FILE_ID_FIELDS = {"file_id", "file_unique_id"}
+FILE_ID_PLACEHOLDER = "anonimo"  # telebot richiede i campi per ricostruire foto e documenti
+# Prefissi dei callback_data di bot.py seguiti da un parametro (i più lunghi prima)
+CALLBACK_PREFIXES = ("currency_EUR_", "currency_SAT_", "list_transactions_", "list_expenses_page_",
+                     "edit_tx_", "delete_tx_", "edit_", "delete_", "unshare_", "shared_report_")
+UPDATE_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post", "inline_query",
+                 "chosen_inline_result", "callback_query", "shipping_query", "pre_checkout_query",
+                 "poll", "poll_answer", "my_chat_member", "chat_member", "chat_join_request")
+
+_LETTERS = re.compile(r"[^\W\d_]")
+_DIGITS = re.compile(r"\d")
+_BUTTON_NAME = re.compile(r"[a-z_]+")
+
+
+def update_payload(update):
+    """JSON dell'update (dict) a partire dall'oggetto telebot"""
+    payload = {"update_id": update.update_id}
+    for field in UPDATE_FIELDS:
+        value = getattr(update, field, None)
+        if value is not None:
+            payload[field] = value.json
+    return payload
+
+
+def pseudonym(value, salt):
+    """Pseudonimo intero stabile di un ID (stesso segno: le chat di gruppo restano negative)"""
+    digest = hmac.new(salt.encode("utf-8"), str(abs(value)).encode("utf-8"), hashlib.sha256).hexdigest()
+    alias = int(digest[:12], 16) or 1
+    return -alias if value < 0 else alias
+
+
+def map_ids(payload, mapper):
+    """Copia dell'update con gli ID di utenti e chat trasformati da `mapper`"""
+    def walk(value, key=None):
+        if isinstance(value, dict):
+            result = {k: walk(v, k) for k, v in value.items()}
+            if key in ID_OBJECTS and isinstance(result.get("id"), int):
+                result["id"] = mapper(result["id"])
+            return result
+        if isinstance(value, list):
+            return [walk(item) for item in value]
+        return value
+    return walk(payload)
+
+
+def _mask_text(text, keep_texts):
+    if text in keep_texts:
+        return text
+    if text.startswith("/"):
+        command, _, rest = text.partition(" ")
+        return f"{command} {_LETTERS.sub('x', rest)}" if rest else command
+    return _LETTERS.sub("x", text)
+
+
+def _mask_callback_data(data):
+    for prefix in CALLBACK_PREFIXES:
+        if data.startswith(prefix):
+            return prefix + _DIGITS.sub("0", _LETTERS.sub("x", data[len(prefix):]))
+    if _BUTTON_NAME.fullmatch(data):
+        return data
+    return _DIGITS.sub("0", _LETTERS.sub("x", data))
+
+
+def anonymize_update(payload, salt, keep_texts=frozenset()):
+    """Versione anonimizzata dell'update (vedi docstring del modulo)"""
+    def walk(value, key=None):
+        if isinstance(value, dict):
+            result = {}
+            for k, v in value.items():
+                if k in NAME_FIELDS:
+                    continue
+                if k == "location":
+                    result[k] = {"latitude": 0.0, "longitude": 0.0}
+                elif k in TEXT_FIELDS and isinstance(v, str):
+                    result[k] = _mask_text(v, keep_texts)
+                elif k == "data" and key == "callback_query" and isinstance(v, str):
+                    result[k] = _mask_callback_data(v)
+                elif k in FILE_ID_FIELDS:
+                    result[k] = FILE_ID_PLACEHOLDER
+                elif k == "file_name" and isinstance(v, str):
+                    result[k] = "file" + (v[v.rfind("."):] if "." in v else "")
+                else:
+                    result[k] = walk(v, k)
+            if key in ID_OBJECTS and "first_name" in value:
+                result["first_name"] = "utente"  # Campo obbligatorio per telebot
+            return result
+        if isinstance(value, list):
+            return [walk(item) for item in value]
+        return value
+    return map_ids(walk(payload), lambda value: pseudonym(value, salt))
+
+
+class UpdateRecorder:
+    """Scrive gli update anonimizzati in coda al log (thread-safe)"""
+
+    def __init__(self, path, salt=None, keep_texts=frozenset()):
+        # Senza salt configurato gli pseudonimi sono stabili solo fino al riavvio
+        self.salt = salt or secrets.token_hex(16)
+        self.keep_texts = frozenset(keep_texts)
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "at", encoding="utf-8") if path.endswith(".gz") else open(path, "a", encoding="utf-8")
+        self.recorded = 0
+
+    def record(self, update):
+        """Registra un update (oggetto telebot o dict JSON)"""
+        payload = update if isinstance(update, dict) else update_payload(update)
+        line = json.dumps(
+            {"t": round(time.time(), 3), "u": anonymize_update(payload, self.salt, self.keep_texts)},
+            ensure_ascii=False, separators=(",", ":")
+        )
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.recorded += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_update_log(path):
+    """Legge il log: genera (istante di ricezione, update) nell'ordine di registrazione"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Ultima riga troncata (es. processo interrotto durante la scrittura)
+            yield entry["t"], entry["u"]
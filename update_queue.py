@@ -0,0 +1,130 @@
+"""
+Code degli update ricevuti via webhook.
+
+Il ricevitore HTTP (webapp.py) salva il JSON grezzo dell'update e risponde
+subito a Telegram; il runtime (runtime.run_webhook) li preleva e li passa
+al dispatcher. Backend disponibili:
+
+- "memory": coda in memoria, ricevitore e bot nello stesso processo;
+- "sqlite": tabella pending_updates, sopravvive ai riavvii e permette di
+  eseguire il ricevitore in un processo separato.
+
+Tutti i backend espongono put(update_id, payload), get(timeout) -> (token,
+payload) oppure None, e ack(token) da chiamare a update elaborato. Un
+update prelevato e non ancora confermato non viene restituito di nuovo da
+get() (fino al riavvio del processo).
+"""
+import queue
+import threading
+import time
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from model import SessionLocal, PendingUpdate
+
+SQLITE_POLL_INTERVAL = 0.2  # secondi tra due letture della tabella quando è vuota
+
+
+class MemoryUpdateQueue:
+    """Coda FIFO in memoria (gli update non ancora elaborati si perdono al riavvio)"""
+
+    def __init__(self, maxsize=0):
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, update_id, payload):
+        self._queue.put(payload)
+
+    def get(self, timeout=None):
+        try:
+            return None, self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def ack(self, token):
+        pass
+
+    def __len__(self):
+        return self._queue.qsize()
+
+
+class SQLiteUpdateQueue:
+    """Coda persistente sulla tabella pending_updates (un solo consumatore)"""
+
+    def __init__(self, session_factory=SessionLocal, poll_interval=SQLITE_POLL_INTERVAL):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self._available = threading.Event()  # Segnala i put fatti nello stesso processo
+        # Righe consegnate e non ancora confermate: restano in tabella fino all'ack.
+        # Non basta l'ultimo update_id consegnato: con più connessioni al webhook
+        # un update con ID più basso può essere salvato dopo uno più alto.
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def put(self, update_id, payload):
+        session = self.session_factory()
+        try:
+            # Gli update ripetuti da Telegram (stesso update_id) vengono ignorati
+            session.execute(
+                sqlite_insert(PendingUpdate)
+                .values(update_id=update_id, payload=payload)
+                .on_conflict_do_nothing(index_elements=["update_id"])
+            )
+            session.commit()
+        finally:
+            session.close()
+        self._available.set()
+
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            session = self.session_factory()
+            try:
+                with self._lock:
+                    in_flight = list(self._in_flight)
+                query = select(PendingUpdate.id, PendingUpdate.payload)
+                if in_flight:
+                    query = query.where(PendingUpdate.id.not_in(in_flight))
+                row = session.execute(query.order_by(PendingUpdate.update_id).limit(1)).first()
+            finally:
+                session.close()
+            if row is not None:
+                with self._lock:
+                    self._in_flight.add(row.id)
+                return row.id, row.payload
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            wait = self.poll_interval
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.monotonic(), 0))
+            self._available.wait(wait)
+            self._available.clear()
+
+    def ack(self, token):
+        session = self.session_factory()
+        try:
+            session.execute(delete(PendingUpdate).where(PendingUpdate.id == token))
+            session.commit()
+        finally:
+            session.close()
+        with self._lock:
+            self._in_flight.discard(token)
+
+    def __len__(self):
+        session = self.session_factory()
+        try:
+            return session.query(PendingUpdate).count()
+        finally:
+            session.close()
+
+
+UPDATE_QUEUE_BACKENDS = {
+    "memory": MemoryUpdateQueue,
+    "sqlite": SQLiteUpdateQueue,
+}
+
+
+def make_update_queue(backend="memory"):
+    """Crea la coda per il backend indicato ("memory" o "sqlite")"""
+    try:
+        return UPDATE_QUEUE_BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(f"Backend della coda non supportato: {backend}")
@@ -1,6 +1,11 @@
-from flask import Flask, render_template
-from model import SessionLocal, User, Expense, Wallet
-from sqlalchemy import func, cast, Date
+from flask import Flask, render_template, request
+from model import SessionLocal, User, DailyRollup
+from sqlalchemy import func
+from money import from_minor
+from crud import cached_report
+from config import WEBHOOK_SECRET_TOKEN, WEBHOOK_QUEUE_BACKEND
+from update_queue import make_update_queue
+import hmac
 import json
 import logging
 from datetime import datetime, timedelta
@@ -9,6 +14,88 @@ app = Flask(__name__)
 # Abilita il logging dettagliato
 app.logger.setLevel(logging.DEBUG)
 
+# Coda in cui il webhook deposita gli update; main.py --webhook la sostituisce
+# con quella letta dal proprio runtime quando gira nello stesso processo
+update_queue = None
+
+def build_dashboard_payload(session, user_id):
+    """Calcola i dati della dashboard (totali, categorie e andamento) dal rollup"""
+    # Totali interi per valuta letti dal rollup giornaliero, convertiti poi in unità principali
+    totals_by_currency = session.query(
+        DailyRollup.currency,
+        func.sum(DailyRollup.income_minor),
+        func.sum(DailyRollup.expense_minor)
+    ).filter(
+        DailyRollup.user_id == user_id
+    ).group_by(DailyRollup.currency).all()
+
+    total_income = sum(from_minor(income, currency) for currency, income, _ in totals_by_currency)
+    total_expenses = sum(from_minor(expenses, currency) for currency, _, expenses in totals_by_currency)
+
+    # Calcola il saldo corrente
+    current_balance = float(total_income) + float(total_expenses)  # total_expenses è già negativo
+
+    # Spese per categoria (solo importi negativi)
+    expenses_by_category = session.query(
+        DailyRollup.category,
+        DailyRollup.currency,
+        func.sum(DailyRollup.expense_minor).label('total')
+    ).filter(
+        DailyRollup.user_id == user_id,
+        DailyRollup.expense_count > 0
+    ).group_by(DailyRollup.category, DailyRollup.currency).all()
+
+    category_totals = {}
+    for category, currency, total in expenses_by_category:
+        if category:  # Ignora le categorie nulle
+            category_totals[category] = category_totals.get(category, 0.0) + from_minor(total, currency)
+
+    categories = list(category_totals.keys())
+    amounts = [abs(total) for total in category_totals.values()]  # Converti in positivo per la visualizzazione
+
+    # Andamento temporale (ultimi 30 giorni)
+    thirty_days_ago = datetime.now() - timedelta(days=30)
+    
+    # Saldo giornaliero (entrate e uscite) dal rollup
+    daily_transactions = session.query(
+        DailyRollup.day,
+        DailyRollup.currency,
+        func.sum(DailyRollup.income_minor + DailyRollup.expense_minor).label('total')
+    ).filter(
+        DailyRollup.user_id == user_id,
+        DailyRollup.day >= thirty_days_ago.date()
+    ).group_by(
+        DailyRollup.day, DailyRollup.currency
+    ).order_by(
+        DailyRollup.day
+    ).all()
+
+    # Prepara i dati per il grafico temporale
+    timeline_data = {
+        'dates': [],
+        'balances': []
+    }
+
+    # Calcola il saldo progressivo
+    running_balance = 0
+    for day, currency, amount in daily_transactions:
+        date_str = day.strftime('%Y-%m-%d')
+        running_balance += from_minor(amount, currency)
+        if timeline_data['dates'] and timeline_data['dates'][-1] == date_str:
+            timeline_data['balances'][-1] = running_balance
+        else:
+            timeline_data['dates'].append(date_str)
+            timeline_data['balances'].append(running_balance)
+
+    return {
+        'categories': categories,
+        'amounts': amounts,
+        'timeline_data': timeline_data,
+        'current_balance': current_balance,
+        'total_income': total_income,
+        'total_expenses': abs(total_expenses),
+    }
+
 @app.route('/dashboard/<chat_id>')
 def dashboard(chat_id):
     app.logger.info(f"Richiesta dashboard per chat_id: {chat_id}")
@@ -19,75 +106,22 @@ def dashboard(chat_id):
             app.logger.warning(f"Utente non trovato per chat_id: {chat_id}")
             return "Utente non trovato", 404
 
-        # Calcola le spese totali
-        total_expenses = session.query(func.sum(Expense.amount)).filter(
-            Expense.user_id == user.id,
-            Expense.amount < 0  # Solo le spese (importi negativi)
-        ).scalar() or 0
-
-        # Calcola le entrate totali
-        total_income = session.query(func.sum(Expense.amount)).filter(
-            Expense.user_id == user.id,
-            Expense.amount > 0  # Solo le entrate (importi positivi)
-        ).scalar() or 0
-
-        # Calcola il saldo corrente
-        current_balance = float(total_income) + float(total_expenses)  # total_expenses è già negativo
-
-        # Spese per categoria (solo importi negativi)
-        expenses_by_category = session.query(
-            Expense.category,
-            func.sum(Expense.amount).label('total')
-        ).filter(
-            Expense.user_id == user.id,
-            Expense.amount < 0
-        ).group_by(Expense.category).all()
-        
-        categories = []
-        amounts = []
-        for category, total in expenses_by_category:
-            if category:  # Ignora le categorie nulle
-                categories.append(category)
-                amounts.append(abs(float(total)))  # Converti in positivo per la visualizzazione
-
-        # Andamento temporale (ultimi 30 giorni)
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        
-        # Query per ottenere tutte le transazioni (entrate e uscite)
-        daily_transactions = session.query(
-            func.strftime('%Y-%m-%d', Expense.date).label('date'),
-            func.sum(Expense.amount).label('total')
-        ).filter(
-            Expense.user_id == user.id,
-            Expense.date >= thirty_days_ago
-        ).group_by(
-            func.strftime('%Y-%m-%d', Expense.date)
-        ).order_by(
-            func.strftime('%Y-%m-%d', Expense.date)
-        ).all()
-
-        # Prepara i dati per il grafico temporale
-        timeline_data = {
-            'dates': [],
-            'balances': []
-        }
-
-        # Calcola il saldo progressivo
-        running_balance = 0
-        for date_str, amount in daily_transactions:
-            timeline_data['dates'].append(date_str)
-            running_balance += float(amount)
-            timeline_data['balances'].append(running_balance)
+        # Il payload resta in cache finché l'utente non modifica i propri dati;
+        # la data odierna nella chiave fa scorrere la finestra degli ultimi 30 giorni
+        payload = cached_report(
+            session, "dashboard", [user.id], datetime.now().date().isoformat(),
+            lambda: build_dashboard_payload(session, user.id)
+        )
 
         return render_template(
             'dashboard.html',
             username=user.username or user.telegram_id,
-            categories=json.dumps(categories),
-            amounts=json.dumps(amounts),
-            timeline_data=json.dumps(timeline_data),
-            current_balance=current_balance,
-            total_income=total_income,
-            total_expenses=abs(total_expenses)
+            categories=json.dumps(payload['categories']),
+            amounts=json.dumps(payload['amounts']),
+            timeline_data=json.dumps(payload['timeline_data']),
+            current_balance=payload['current_balance'],
+            total_income=payload['total_income'],
+            total_expenses=payload['total_expenses']
         )
     except Exception as e:
         app.logger.error(f"Errore durante l'elaborazione: {str(e)}", exc_info=True)
@@ -95,5 +129,25 @@ def dashboard(chat_id):
     finally:
         session.close()
 
+@app.route('/telegram/webhook', methods=['POST'])
+def telegram_webhook():
+    """Riceve un update da Telegram, lo mette in coda e risponde subito"""
+    if WEBHOOK_SECRET_TOKEN:
+        received = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(received, WEBHOOK_SECRET_TOKEN):
+            return "Token non valido", 403
+
+    payload = request.get_data(as_text=True)
+    try:
+        update_id = int(json.loads(payload)['update_id'])
+    except (ValueError, KeyError, TypeError):
+        return "Update non valido", 400
+
+    global update_queue
+    if update_queue is None:
+        update_queue = make_update_queue(WEBHOOK_QUEUE_BACKEND)
+    update_queue.put(update_id, payload)
+    return "", 200
+
 if __name__ == '__main__':
     app.run(port=5000, debug=True) 
\ No newline at end of file